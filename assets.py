@@ -0,0 +1,173 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+from functools import partial
+import mimetypes
+import os
+import time
+
+from bottle import Bottle, HTTPResponse, abort, request, static_file
+
+from cache import FileCache
+from decorators import require_site_registered, require_site_activated
+from settings import STATIC_DIR, STATIC_URL, STATIC_PATH, IMAGE_DIR, IMAGE_URL, IMAGE_PATH, TEMPLATES_DIR, \
+    TEMPLATES_URL, TEMPLATES_PATH, STATIC_CACHE_CONTROL, IMAGE_CACHE_CONTROL, TEMPLATES_CACHE_CONTROL, \
+    IMAGE_PRESET_URL, IMAGE_PRESETS, RENDITION_CACHE_PATH, RENDITION_CACHE_SIZE
+from storage import image_storage
+from utils import save_image_rendition
+
+
+__author__ = 'João Neto'
+
+
+"""
+Asset app
+Static, image and template files are served by this app without sessions,
+sites come from sites cache so no database query is done in common case
+"""
+asset_app = Bottle()
+
+# WebP copies of images, mimetypes of Python < 3.11 does not know WebP
+mimetypes.add_type('image/webp', '.webp')
+
+# Url prefixes of asset files
+ASSET_PREFIXES = tuple('/%s/' % dir_name for dir_name in (STATIC_DIR, IMAGE_DIR, TEMPLATES_DIR))
+
+# Renditions of image size presets
+rendition_cache = FileCache(RENDITION_CACHE_PATH, RENDITION_CACHE_SIZE)
+
+
+class AssetMiddleware(object):
+    """
+    WSGI middleware sending asset requests to asset_app and other requests to app
+    """
+
+    def __init__(self, asset_app, app):
+        self.asset_app = asset_app
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO', '').startswith(ASSET_PREFIXES):
+            return self.asset_app(environ, start_response)
+        return self.app(environ, start_response)
+
+
+def etag_matches(if_none_match, etag):
+    """
+    :return True if etag is in If-None-Match header (weak comparison)
+    """
+    if if_none_match.strip() == '*':
+        return True
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def serve_file(file_path, root, cache_control):
+    """
+    Serve file with ETag and Last-Modified validators and cache_control policy
+    Conditional requests (If-None-Match and If-Modified-Since) of unchanged files
+    are answered with 304 without body
+    """
+    root = os.path.abspath(root) + os.sep
+    file_name = os.path.abspath(os.path.join(root, file_path.strip('/\\')))
+
+    # Strong ETag of file from modification time and size
+    etag = None
+    if file_name.startswith(root) and os.path.isfile(file_name):
+        stats = os.stat(file_name)
+        etag = '"%x-%x"' % (stats.st_mtime_ns, stats.st_size)
+
+        # If-None-Match has precedence over If-Modified-Since
+        if_none_match = request.environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            if etag_matches(if_none_match, etag):
+                headers = {'ETag': etag, 'Cache-Control': cache_control,
+                           'Date': time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime())}
+                return HTTPResponse(status=304, headers=headers)
+            request.environ.pop('HTTP_IF_MODIFIED_SINCE', None)
+
+    # Response file, answers If-Modified-Since, Range and HEAD requests
+    response_file = static_file(file_path, root=root)
+    if (etag is not None) and (response_file.status_code < 400):
+        response_file.set_header("ETag", etag)
+        response_file.set_header("Cache-Control", cache_control)
+    return response_file
+
+
+@asset_app.route(STATIC_URL)
+@require_site_registered()
+def server_static(site, host, netloc, file_path):
+    """
+    Serving static files
+    """
+
+    # Return static files
+    return serve_file(file_path, STATIC_PATH, STATIC_CACHE_CONTROL)
+
+
+@asset_app.route(IMAGE_PRESET_URL)
+@require_site_registered()
+@require_site_activated()
+def server_image_preset(site, host, netloc, width, height, file_path):
+    """
+    Serving image renditions of size presets
+    Renditions are made on first request and served from rendition cache, image file
+    names are versioned by content so renditions never change
+    """
+    if (width, height) not in IMAGE_PRESETS:
+        abort(404, 'Tamanho de imagem não disponível')
+    img_path = os.path.abspath(site.get_image_path(IMAGE_PATH, create=False))
+    image_file = image_storage.get_image_file(img_path, file_path)
+    if image_file is None:
+        abort(403, 'Acesso negado')
+
+    # Make rendition on cache miss
+    rendition_name = os.path.join('site%d' % site.get_id(), '%dx%d' % (width, height),
+                                  os.path.relpath(image_file, img_path))
+    if rendition_cache.get(rendition_name) is None:
+        if not os.path.isfile(image_file):
+            abort(404, 'Imagem não encontrada')
+        try:
+            rendition_cache.set(rendition_name, partial(save_image_rendition, image_file, (width, height)))
+        except IOError:
+            abort(404, 'Imagem não encontrada')
+
+    # Return rendition file
+    return serve_file(rendition_name, RENDITION_CACHE_PATH, IMAGE_CACHE_CONTROL)
+
+
+@asset_app.route(IMAGE_URL)
+@require_site_registered()
+@require_site_activated()
+def server_image(site, host, netloc, file_path):
+    """
+    Serving image files
+    Images files is served by site according get_image_path function, file_path is
+    resolved by image storage
+    """
+    img_path = os.path.abspath(site.get_image_path(IMAGE_PATH, create=False))
+    image_file = image_storage.get_image_file(img_path, file_path)
+    if image_file is None:
+        abort(403, 'Acesso negado')
+
+    # Return image files
+    return serve_file(os.path.relpath(image_file, img_path), img_path, IMAGE_CACHE_CONTROL)
+
+
+@asset_app.route(TEMPLATES_URL)
+@require_site_registered()
+@require_site_activated()
+def server_template(site, host, netloc, file_path):
+    """
+    Serving template files
+    """
+
+    # Return template files
+    return serve_file(file_path, TEMPLATES_PATH, TEMPLATES_CACHE_CONTROL)
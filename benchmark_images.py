@@ -0,0 +1,142 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+import argparse
+import io
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+from settings import ORIG_SIZE, NORM_SIZE, THUMB_SIZE
+from utils import save_image, save_image_renditions
+
+
+__author__ = 'João Neto'
+
+# Sizes of benchmark uploads
+UPLOAD_SIZES = ((1600, 1200), (3000, 2000), (4000, 3000), (6000, 4000))
+
+
+def legacy_renditions(upload_file, output_path):
+    """
+    Renditions as made before the pipeline, reopening the original file from disk
+    Images are saved by save_image as in the pipeline, so both methods have the same encoding
+    (IMAGE_ENCODING and WebP copies) and only the decoding differs
+    """
+    original_file = os.path.join(output_path, 'legacy.jpg')
+    normalized_file = os.path.join(output_path, 'legacy_norm.jpg')
+    thumbnail_file = os.path.join(output_path, 'legacy_thumb.jpg')
+    im = Image.open(upload_file)
+    im.thumbnail(ORIG_SIZE, Image.ANTIALIAS)
+    save_image(im, original_file)
+    for rendition_file, rendition_size in ((normalized_file, NORM_SIZE), (thumbnail_file, THUMB_SIZE)):
+        with open(original_file, "rb") as f:
+            im = Image.open(f)
+            im.thumbnail(rendition_size, Image.ANTIALIAS)
+            save_image(im, rendition_file)
+
+
+def pipeline_renditions(upload_file, output_path):
+    """
+    Renditions made by save_image_renditions, decoding upload only once
+    """
+    im = Image.open(upload_file)
+    save_image_renditions(im, [(os.path.join(output_path, 'pipeline.jpg'), ORIG_SIZE),
+                               (os.path.join(output_path, 'pipeline_norm.jpg'), NORM_SIZE),
+                               (os.path.join(output_path, 'pipeline_thumb.jpg'), THUMB_SIZE)])
+
+
+METHODS = {
+    'legacy': legacy_renditions,
+    'pipeline': pipeline_renditions,
+}
+
+
+def get_peak_memory():
+    """
+    :return Peak memory (resident set size) of current process in MB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Bytes on macOS, kilobytes on other systems
+        peak /= 1024
+    return peak / 1024
+
+
+def make_upload(upload_file, size):
+    """
+    Create a JPEG upload of size with smooth random content
+    """
+    im = Image.frombytes('RGB', (64, 48), os.urandom(64 * 48 * 3))
+    im = im.resize(size, Image.BILINEAR)
+    im.save(upload_file, "JPEG", quality=90)
+
+
+def run_child(method, upload_file, output_path):
+    """
+    Measure one upload in this process, printing latency and peak memory
+    Each measure runs in a new process because peak memory never decreases
+    """
+    with open(upload_file, 'rb') as f:
+        upload = io.BytesIO(f.read())
+    base_memory = get_peak_memory()
+    start = time.perf_counter()
+    METHODS[method](upload, output_path)
+    elapsed = time.perf_counter() - start
+    print('%f %f %f' % (elapsed, base_memory, get_peak_memory()))
+
+
+def main():
+    """
+    Main routine
+    """
+    parser = argparse.ArgumentParser(description='Benchmark of image upload renditions')
+    parser.add_argument('--repeat', type=int, default=3, help='Measures of each upload size')
+    parser.add_argument('--child', nargs=3, metavar=('METHOD', 'UPLOAD', 'OUTPUT'), help=argparse.SUPPRESS)
+    parser.add_argument('--make', nargs=3, metavar=('UPLOAD', 'WIDTH', 'HEIGHT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(*args.child)
+        return 0
+    if args.make:
+        make_upload(args.make[0], (int(args.make[1]), int(args.make[2])))
+        return 0
+
+    temp_path = tempfile.mkdtemp(prefix='opcms-benchmark-')
+    try:
+        print('%-10s %-10s %10s %12s %12s %12s' % ('upload', 'method', 'size (KB)', 'latency (ms)',
+                                                   'peak (MB)', 'growth (MB)'))
+        for size in UPLOAD_SIZES:
+            upload_file = os.path.join(temp_path, 'upload_%dx%d.jpg' % size)
+            # Upload is made in other process, children inherit the peak memory of this process
+            subprocess.check_call([sys.executable, os.path.abspath(__file__),
+                                   '--make', upload_file, '%d' % size[0], '%d' % size[1]])
+            upload_kb = os.path.getsize(upload_file) / 1024
+            for method in sorted(METHODS):
+                latencies = []
+                peak_memory = growth_memory = 0
+                for repeat in range(args.repeat):
+                    output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                                      '--child', method, upload_file, temp_path])
+                    elapsed, base_memory, peak = [float(value) for value in output.split()]
+                    latencies.append(elapsed)
+                    peak_memory = max(peak_memory, peak)
+                    growth_memory = max(growth_memory, peak - base_memory)
+                latency = sorted(latencies)[len(latencies) // 2]
+                print('%-10s %-10s %10d %12.1f %12.1f %12.1f' % ('%dx%d' % size, method, upload_kb,
+                                                                 latency * 1000, peak_memory, growth_memory))
+    finally:
+        shutil.rmtree(temp_path, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+from collections import OrderedDict
+from threading import Lock
+import os
+import time
+
+from settings import VERSION_PATH
+from utils import write_atomic
+
+
+__author__ = 'João Neto'
+
+
+class SharedVersion(object):
+    """
+    Version shared by all processes of the server through a stamp file
+    The version is the inode and modification time of the stamp file, which is
+    replaced on every bump, so checking it costs a single stat call
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def get(self):
+        """
+        :return Current version
+        """
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def bump(self):
+        """
+        Change the version, invalidating everything cached with older versions
+        """
+        version_dir = os.path.dirname(self.file_path)
+        if not os.path.exists(version_dir):
+            os.makedirs(version_dir, exist_ok=True)
+        write_atomic(self.file_path, self.write_stamp)
+
+    @staticmethod
+    def write_stamp(stamp_file):
+        """
+        Write stamp file with the time of bump
+        """
+        with open(stamp_file, 'w') as f:
+            f.write('%f' % time.time())
+
+
+"""
+Shared versions
+content_version changes with site, portfolios and pictures
+site_version changes with sites and users
+"""
+content_version = SharedVersion(os.path.join(VERSION_PATH, 'content'))
+site_version = SharedVersion(os.path.join(VERSION_PATH, 'site'))
+
+
+class VersionedValue(object):
+    """
+    Value loaded by load_function and kept in memory
+    The value is loaded again when the shared version changes
+    """
+
+    def __init__(self, version, load_function):
+        self.version = version
+        self.load_function = load_function
+        self.loaded_version = None
+        self.value = None
+        self.lock = Lock()
+
+    def get(self):
+        """
+        :return Cached value, loading it when needed
+        """
+        # Version is read before loading so concurrent changes are never lost
+        version = self.version.get()
+        with self.lock:
+            if (self.value is None) or (version != self.loaded_version):
+                self.value = self.load_function()
+                self.loaded_version = version
+            return self.value
+
+    def clear(self):
+        """
+        Discard the cached value
+        """
+        with self.lock:
+            self.value = None
+
+
+class PageCache(object):
+    """
+    Cache of rendered pages
+    Least recently used pages are evicted when the cache reaches max_size pages
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.pages = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, key):
+        """
+        :return Cached page or None
+        """
+        with self.lock:
+            page = self.pages.get(key)
+            if page is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.pages.move_to_end(key)
+            return page
+
+    def set(self, key, page):
+        """
+        Cache page evicting least recently used pages
+        """
+        with self.lock:
+            self.pages[key] = page
+            self.pages.move_to_end(key)
+            while len(self.pages) > self.max_size:
+                self.pages.popitem(last=False)
+
+    def clear(self):
+        """
+        Remove all cached pages
+        """
+        with self.lock:
+            self.pages.clear()
+
+    def get_stats(self):
+        """
+        :return Cache statistics, hit_ratio is the fraction of gets served from cache
+        """
+        with self.lock:
+            gets = self.hits + self.misses
+            return dict(size=len(self.pages), max_size=self.max_size, hits=self.hits, misses=self.misses,
+                        hit_ratio=self.hits / gets if gets else 0.0)
+
+
+class FileCache(object):
+    """
+    Cache of files in cache_path limited to max_size bytes
+    Least recently used files are removed when the cache is full, use of files is
+    marked in their access time so the cache is shared by all processes
+    """
+
+    def __init__(self, cache_path, max_size):
+        self.cache_path = cache_path
+        self.max_size = max_size
+        self.size = None
+        self.lock = Lock()
+
+    def get(self, file_name):
+        """
+        :return Path of cached file or None, marking the file as recently used
+        """
+        file_path = os.path.join(self.cache_path, file_name)
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+
+        # Modification time is kept, it is part of the ETag of served files
+        now = int(time.time() * 1e9)
+        if now - stat.st_atime_ns > 60 * 1e9:
+            os.utime(file_path, ns=(now, stat.st_mtime_ns))
+        return file_path
+
+    def set(self, file_name, write_function):
+        """
+        Create cached file calling write_function with a temporary path
+        :return Path of cached file
+        """
+        file_path = os.path.join(self.cache_path, file_name)
+        file_dir = os.path.dirname(file_path)
+        if not os.path.exists(file_dir):
+            os.makedirs(file_dir, exist_ok=True)
+
+        # Temporary files start with a dot and are never evicted
+        write_atomic(file_path, write_function)
+
+        # Size is estimated by this process and computed again on eviction
+        with self.lock:
+            if self.size is None:
+                self.size = self.evict()
+            else:
+                self.size += os.path.getsize(file_path)
+                if self.size > self.max_size:
+                    self.size = self.evict()
+        return file_path
+
+    def evict(self):
+        """
+        Remove least recently used files until the cache is below 90% of max_size
+        :return Size of cache
+        """
+        files = []
+        for root, dir_names, file_names in os.walk(self.cache_path):
+            for file_name in file_names:
+                if file_name.startswith('.'):
+                    continue
+                file_path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_atime_ns, stat.st_size, file_path))
+        size = sum(file_size for atime, file_size, file_path in files)
+        if size <= self.max_size:
+            return size
+        files.sort()
+        for atime, file_size, file_path in files:
+            if size <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(file_path)
+                size -= file_size
+            except FileNotFoundError:
+                # Removed by other process
+                size -= file_size
+        return size
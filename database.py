@@ -0,0 +1,116 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+from threading import local
+
+from peewee import SqliteDatabase
+from playhouse.pool import PooledSqliteDatabase
+
+from settings import DATABASE_FILE, DATABASE_PRAGMAS, DATABASE_POOL_SIZE, DATABASE_POOL_TIMEOUT
+
+
+__author__ = 'João Neto'
+
+
+"""
+Database
+To configure database check peewee documentation
+http://docs.peewee-orm.com/en/latest/peewee/database.html
+Every thread has its own connection, opened on first query of a request and closed
+at the end of it, connections of pool are reused by the next requests
+Pragmas are set on each new connection, WAL journal lets readers work while one writer
+commits and busy_timeout waits for the lock instead of failing with "database is locked"
+"""
+
+
+class ImmediateTransactions(object):
+    """
+    Transactions begin with the write lock (BEGIN IMMEDIATE), deferred transactions that read
+    before writing fail without waiting when another connection commits in between
+    """
+
+    def begin(self, lock_type='IMMEDIATE'):
+        super(ImmediateTransactions, self).begin(lock_type)
+
+
+class CommitCallbacks(object):
+    """
+    Functions called after the commit of the transaction of the thread, so changes are seen by
+    other processes before shared versions are bumped, functions are dropped on rollback
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(CommitCallbacks, self).__init__(*args, **kwargs)
+        self.commit_callbacks = local()
+
+    def get_commit_callbacks(self):
+        """
+        :return Functions waiting for the commit of the transaction of the thread
+        """
+        if not hasattr(self.commit_callbacks, 'functions'):
+            self.commit_callbacks.functions = []
+        return self.commit_callbacks.functions
+
+    def after_commit(self, function):
+        """
+        Call function after the commit of the current transaction, or now out of transactions
+        A function is called once even if it is added many times in the transaction
+        """
+        if self.transaction_depth() == 0:
+            function()
+            return
+        functions = self.get_commit_callbacks()
+        if function not in functions:
+            functions.append(function)
+
+    def commit(self):
+        super(CommitCallbacks, self).commit()
+        functions = self.get_commit_callbacks()
+        self.commit_callbacks.functions = []
+        for function in functions:
+            function()
+
+    def rollback(self):
+        self.commit_callbacks.functions = []
+        super(CommitCallbacks, self).rollback()
+
+
+class OpcmsSqliteDatabase(CommitCallbacks, ImmediateTransactions, SqliteDatabase):
+    pass
+
+
+class OpcmsPooledSqliteDatabase(CommitCallbacks, ImmediateTransactions, PooledSqliteDatabase):
+    pass
+
+
+def get_database():
+    """
+    :return Database configured by DATABASE_* settings
+    """
+    if DATABASE_POOL_SIZE:
+        # Pooled connections are used by many threads, one thread at a time
+        return OpcmsPooledSqliteDatabase(DATABASE_FILE, pragmas=list(DATABASE_PRAGMAS),
+                                         max_connections=DATABASE_POOL_SIZE, stale_timeout=DATABASE_POOL_TIMEOUT,
+                                         check_same_thread=False)
+    return OpcmsSqliteDatabase(DATABASE_FILE, pragmas=list(DATABASE_PRAGMAS))
+
+
+db = get_database()
+
+
+def close_request_connection():
+    """
+    Close connection of thread at the end of request, a pooled connection returns to the pool
+    """
+    if not db.is_closed():
+        db.close()
+
+
+def install_request_connections(*apps):
+    """
+    Close connection of each request of apps, connections are opened on first query
+    """
+    for app in apps:
+        app.add_hook('after_request', close_request_connection)
@@ -4,17 +4,71 @@ https://github.com/jfmedeirosneto/opcms
 Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
 """
 from _sha256 import sha256
+import binascii
 import functools
+import hashlib
+import hmac
 import os
+import time
 
 from bottle import request, abort, redirect
 
-from models import Site
+from cache import VersionedValue, site_version
+from models import Site, User
+from settings import DEFAULT_SITE_ID, SECRET_KEY_FILE, CSRF_TOKEN_AGE
+from utils import get_secret_key
 
 
 __author__ = 'João Neto'
 
 
+"""
+Secret key to sign stateless csrf tokens
+"""
+SECRET_KEY = get_secret_key(SECRET_KEY_FILE)
+
+
+def load_sites():
+    """
+    :return Dictionaries of sites by domain and by id
+    Sites are loaded with their users joined
+    """
+    sites_by_domain = {}
+    sites_by_id = {}
+    for site in Site.select(Site, User).join(User):
+        sites_by_id[site.get_id()] = site
+        if site.domain:
+            sites_by_domain[site.domain] = site
+    return sites_by_domain, sites_by_id
+
+
+"""
+Sites cache, refreshed when any site or user is saved
+"""
+sites_cache = VersionedValue(site_version, load_sites)
+
+
+def get_site(netloc):
+    """
+    :return Cached site registered with netloc domain, default site or None
+    """
+    sites_by_domain, sites_by_id = sites_cache.get()
+    domain = netloc.split(':')[0].lower()
+    site = sites_by_domain.get(domain)
+    if (site is None) and (DEFAULT_SITE_ID is not None):
+        site = sites_by_id.get(DEFAULT_SITE_ID)
+    return site
+
+
+def copy_site(site):
+    """
+    :return Copy of site and its user, changes on the copy do not touch the cached site
+    """
+    site_copy = Site(**site._data)
+    site_copy.user = User(**site.user._data)
+    return site_copy
+
+
 def require_site_registered(json_response=False):
     """
     require_site_registered decorator
@@ -35,14 +89,14 @@ def require_site_registered(json_response=False):
             normalized_host = 'http://%s' % netloc
 
             # Get site information
-            try:
-                site = Site.get(Site.id == 1)
-            except Site.DoesNotExist:
+            site = get_site(netloc)
+            if site is None:
                 msg = 'Site %s não existe neste servidor' % host
                 if json_response:
                     return dict(status=False, info=msg)
                 else:
                     abort(404, msg)
+            site = copy_site(site)
 
             # callback function with site and host arguments injected
             kwargs.update({'site': site, 'host': host, 'netloc': netloc})
@@ -77,26 +131,96 @@ def require_site_activated(json_response=False):
     return decorator
 
 
-def require_csrf(token_id='csrf', json_response=False):
+def require_body_size(max_size, json_response=False):
+    """
+    require_body_size decorator
+    Check Content-Length of request before the body is read, must be the first decorator
+    Requests without Content-Length (chunked) are refused, their size is only known after reading the body
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if request.content_length < 0:
+                msg = 'Envio sem tamanho informado não é permitido'
+                if json_response:
+                    return dict(status=False, info=msg)
+                else:
+                    abort(411, msg)
+            if request.content_length > max_size:
+                msg = 'Envio muito grande, o limite é %d MB' % (max_size // (1024 * 1024))
+                if json_response:
+                    return dict(status=False, info=msg)
+                else:
+                    abort(413, msg)
+
+            # callback function
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def make_stateless_csrf(token_id, site_id):
+    """
+    :return New csrf token signed with secret key, no session is needed to verify it
+    Token format is timestamp.nonce.signature
+    """
+    timestamp = '%d' % time.time()
+    nonce = binascii.hexlify(os.urandom(8)).decode()
+    message = '%s:%s:%s:%s' % (token_id, site_id, timestamp, nonce)
+    signature = hmac.new(SECRET_KEY, message.encode(), hashlib.sha256).hexdigest()
+    return '%s.%s.%s' % (timestamp, nonce, signature)
+
+
+def verify_stateless_csrf(csrf, token_id, site_id):
+    """
+    :return True if csrf token was signed with secret key and is not expired
+    """
+    try:
+        timestamp, nonce, signature = csrf.split('.')
+        age = time.time() - int(timestamp)
+    except ValueError:
+        return False
+    if (age < 0) or (age > CSRF_TOKEN_AGE):
+        return False
+    message = '%s:%s:%s:%s' % (token_id, site_id, timestamp, nonce)
+    expected_signature = hmac.new(SECRET_KEY, message.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(signature, expected_signature)
+
+
+def require_csrf(token_id='csrf', json_response=False, stateless=False):
     """
     require_csrf decorator
+    Stateless tokens are signed instead of stored in session, so anonymous pages
+    are served without creating a session
     """
 
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             session = request.environ.get('beaker.session')
+            site = kwargs.get('site')
+            site_id = site.get_id() if site else None
             if request.method == 'POST':
                 csrf = request.POST.get('csrf')
-                if not csrf or csrf != session.get(token_id):
+                if stateless:
+                    valid = csrf and verify_stateless_csrf(csrf, token_id, site_id)
+                else:
+                    valid = csrf and csrf == session.get(token_id)
+                if not valid:
                     msg = 'Dados inválidos ou expirados, recaregue a página.'
                     if json_response:
                         return dict(status=False, info=msg)
                     else:
                         abort(403, msg)
             elif request.method == 'GET':
-                csrf = sha256(os.urandom(8)).hexdigest()
-                session[token_id] = csrf
+                if stateless:
+                    csrf = make_stateless_csrf(token_id, site_id)
+                else:
+                    csrf = sha256(os.urandom(8)).hexdigest()
+                    session[token_id] = csrf
             else:
                 csrf = None
             # callback function with csrf argument injected
@@ -0,0 +1,161 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+import os
+from threading import Lock
+
+from models import Job
+from renditions import get_rendition_names, get_rendition_profiles
+from settings import IMAGE_WORKERS
+from utils import process_image, remove_images
+
+
+__author__ = 'João Neto'
+
+
+"""
+Image pool
+Renditions of uploaded images are made by a pool of processes, so requests are not
+blocked by image processing and images are processed by all cores
+A pool broken by a worker process that died is replaced by a new pool on the next job
+"""
+image_pool = None
+image_pool_lock = Lock()
+
+
+def get_image_pool():
+    """
+    :return Image pool, created on first use
+    """
+    global image_pool
+    with image_pool_lock:
+        if image_pool is None:
+            image_pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+        return image_pool
+
+
+def discard_image_pool(pool):
+    """
+    Discard broken pool, the next call of get_image_pool creates a new pool
+    """
+    global image_pool
+    with image_pool_lock:
+        if image_pool is pool:
+            image_pool = None
+    pool.shutdown(wait=False)
+
+
+def submit_to_image_pool(function, *args):
+    """
+    Submit function to image pool, a broken pool is replaced once by a new pool
+    :return Future of function
+    """
+    pool = get_image_pool()
+    try:
+        return pool.submit(function, *args)
+    except BrokenProcessPool:
+        discard_image_pool(pool)
+        return get_image_pool().submit(function, *args)
+
+
+def get_job_images(upload_response, template_renditions):
+    """
+    :return Names of images made by job of upload_response
+    """
+    new_images = [upload_response['original_filename'],
+                  upload_response['normalized_filename'],
+                  upload_response['thumbnail_filename']]
+    if template_renditions:
+        new_images += get_rendition_names(upload_response['original_filename'])
+    return new_images
+
+
+def fail_image_job(job, record, upload_response, img_path, replace, template_renditions, info):
+    """
+    Mark job failed and remove the upload and the images made by job
+    A new record (replace=False) is deleted with its images, record is None when the record
+    of job was deleted or changed while processing
+    """
+    job.status = 'failed'
+    job.info = info
+    job.save()
+    if replace or (record is None):
+        remove_images(img_path, get_job_images(upload_response, template_renditions))
+    else:
+        record.delete_all(img_path)
+    if os.path.exists(upload_response['upload_file']):
+        os.remove(upload_response['upload_file'])
+
+
+def submit_image_job(site, record, upload_response, img_path, replace=False, template_renditions=False):
+    """
+    Make renditions of upload_response in the image pool
+    New records have ready=False and are marked ready when the job is done
+    Records with replaced images (replace=True) change to the new images and have
+    the old images removed when the job is done
+    template_renditions=True also makes the renditions declared by templates
+    When the job is not submitted it is returned failed, with the upload removed
+    :return Job created
+    """
+    profiles = []
+    if template_renditions:
+        profiles = get_rendition_profiles(img_path, upload_response['original_filename'])
+    job = Job.create(site=site, record_type=record._meta.db_table, record_id=record.get_id())
+    try:
+        future = submit_to_image_pool(process_image, upload_response['upload_file'], upload_response['renditions'],
+                                      profiles)
+    except (BrokenProcessPool, RuntimeError) as exp:
+        print("Image job %d not submitted:" % job.get_id(), exp)
+        fail_image_job(job, record, upload_response, img_path, replace, template_renditions,
+                       'Não foi possivel processar imagem')
+        return job
+
+    # The record is identified by its id and its original image when submitted, so a job
+    # never changes a record that replaced the deleted one with the same id
+    future.add_done_callback(partial(finish_image_job, job.get_id(), type(record), record.get_id(),
+                                     record.original_image, upload_response, img_path, replace,
+                                     template_renditions))
+    return job
+
+
+def finish_image_job(job_id, model, record_id, record_image, upload_response, img_path, replace, template_renditions,
+                     future):
+    """
+    Update job and record when the renditions are made
+    This function runs in a thread of the process that submitted the job
+    """
+    new_images = get_job_images(upload_response, template_renditions)
+    try:
+        job = Job.get(Job.id == job_id)
+        try:
+            record = model.get(model.id == record_id, model.original_image == record_image)
+        except model.DoesNotExist:
+            # Record deleted or its images changed while processing
+            fail_image_job(job, None, upload_response, img_path, replace, template_renditions,
+                           'Registro apagado durante o processamento')
+            return
+
+        if future.exception() is not None:
+            fail_image_job(job, record, upload_response, img_path, replace, template_renditions,
+                           'Não foi possivel criar imagem')
+            return
+
+        # Change record to new images
+        old_images = [record.original_image, record.normalized_image, record.thumbnail_image]
+        if template_renditions:
+            old_images += get_rendition_names(record.original_image)
+        record.original_image, record.normalized_image, record.thumbnail_image = new_images[:3]
+        record.set_image_sizes(future.result())
+        record.save_ready()
+        if replace:
+            remove_images(img_path, [image for image in old_images if image not in new_images])
+        job.status = 'done'
+        job.info = 'Imagem processada com sucesso'
+        job.save()
+    except Exception as exp:
+        print("Image job %d fail:" % job_id, exp)
@@ -0,0 +1,431 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+import posixpath
+import shutil
+import sys
+import time
+
+# Change working directory so relative paths (database and data) work again
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+from peewee import IntegrityError, fn
+from PIL import Image
+
+from cache import content_version
+from migrations import MIGRATIONS, get_applied_versions, run_migrations
+from models import Portfolio, Picture, Site, db
+from renditions import get_rendition_names, get_rendition_profiles
+from settings import IMAGE_PATH, NORM_SIZE, THUMB_SIZE, IMAGE_WORKERS, IMAGE_STORAGE, DATABASE_AUTO_MIGRATE
+from storage import image_storage
+from utils import get_image_size, get_versioned_image_key, get_webp_name, is_profile_current, \
+    regenerate_image_profiles, remove_images
+
+
+__author__ = 'João Neto'
+
+
+def site_domain(args):
+    """
+    Show or change the domain of a site
+    """
+    try:
+        site = Site.get(Site.id == args.site_id)
+    except Site.DoesNotExist:
+        print('Site %d not found' % args.site_id)
+        return -1
+
+    if args.domain is not None:
+        site.domain = args.domain or None
+        try:
+            site.save()
+        except IntegrityError as exp:
+            print('Site %d domain not changed: %s' % (args.site_id, exp))
+            return -1
+
+    print('Site %d domain: %s' % (site.get_id(), site.domain))
+    return 0
+
+
+def get_image_profiles(img_path, image_names, template_renditions):
+    """
+    :return Profiles (file, size, crop, quality) of normalized and thumbnail images of image_names
+    (original, normalized, thumbnail), with the renditions declared by templates when template_renditions=True
+    """
+    original_image, normalized_image, thumbnail_image = image_names
+    profiles = [(os.path.join(img_path, normalized_image), NORM_SIZE, False, None),
+                (os.path.join(img_path, thumbnail_image), THUMB_SIZE, False, None)]
+    if template_renditions:
+        profiles += get_rendition_profiles(img_path, original_image)
+    return profiles
+
+
+def get_record_image_names(record):
+    """
+    :return Names of original, normalized and thumbnail images of record
+    """
+    return [record.original_image, record.normalized_image, record.thumbnail_image]
+
+
+def get_all_image_names(image_names, template_renditions):
+    """
+    :return image_names (original, normalized, thumbnail) with the names of renditions declared by templates
+    when template_renditions=True
+    """
+    if template_renditions:
+        return image_names + get_rendition_names(image_names[0])
+    return image_names
+
+
+def get_new_image_names(image_names):
+    """
+    :return New names of image_names (original, normalized, thumbnail), with a new version in their key
+    """
+    old_key = image_storage.get_image_key(image_names[0])
+    new_key = get_versioned_image_key(old_key)
+    return [image_storage.get_image_name(new_key, posixpath.basename(image_name).replace(old_key, new_key, 1))
+            for image_name in image_names]
+
+
+def update_image_sizes(record, img_path):
+    """
+    Read sizes of record images from their files and update them in database
+    Files are read before the update, which is a single statement, so the database is not locked
+    while images are read, and record is not changed when its images were replaced meanwhile
+    :return True if record was changed
+    """
+    model = type(record)
+    record.set_image_sizes([get_image_size(os.path.join(img_path, getattr(record, '%s_image' % image_name)))
+                            for image_name in record.image_names])
+    image_sizes = dict((field_name, getattr(record, field_name)) for field_name in record.image_size_fields)
+    query = model.update(**image_sizes).where(model.id == record.get_id(),
+                                              model.original_image == record.original_image)
+    return query.execute() > 0
+
+
+def update_image_names(record, img_path, new_names):
+    """
+    Change images of record to new_names (original, normalized, thumbnail) with their sizes read from their files
+    Record is not changed when its images were replaced meanwhile
+    :return True if record was changed
+    """
+    model = type(record)
+    old_original_image = record.original_image
+    record.original_image, record.normalized_image, record.thumbnail_image = new_names
+    record.set_image_sizes([get_image_size(os.path.join(img_path, image_name)) for image_name in new_names])
+    fields = dict((field_name, getattr(record, field_name))
+                  for field_name in ('original_image', 'normalized_image', 'thumbnail_image') + record.image_size_fields)
+    query = model.update(**fields).where(model.id == record.get_id(), model.original_image == old_original_image)
+    return query.execute() > 0
+
+
+def regenerate_renditions(args):
+    """
+    Make again the normalized and thumbnail images of portfolios and pictures, and the renditions
+    declared by templates for portfolio images, from their original images
+    Urls of images are cached as immutable, so images are never rewritten: records with renditions
+    to make get new image names, the original and up-to-date renditions are linked in the new names,
+    the other renditions are made by a pool of processes and the old files are removed after the
+    record is changed
+    Records with up-to-date renditions are skipped unless --force is used, so the command can be
+    stopped and run again
+    """
+    portfolios = Portfolio.select(Portfolio, Site).join(Site).where(Portfolio.ready == True).order_by(Portfolio.id)
+    pictures = Picture.select(Picture, Site).join(Site).where(Picture.ready == True).order_by(Picture.id)
+    if args.site_id is not None:
+        portfolios = portfolios.where(Portfolio.site == args.site_id)
+        pictures = pictures.where(Picture.site == args.site_id)
+
+    start = time.perf_counter()
+    made = skipped = failed = 0
+    futures = {}
+    old_images = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for records, template_renditions in ((portfolios, True), (pictures, False)):
+            for record in records:
+                record_name = '%s %d' % (record._meta.db_table, record.get_id())
+                img_path = record.site.get_image_path(IMAGE_PATH)
+                image_file = os.path.join(img_path, record.original_image)
+                try:
+                    with open(image_file, 'rb') as f:
+                        image_size = Image.open(f).size
+                except IOError as exp:
+                    print('%s original image not read: %s' % (record_name, exp))
+                    failed += 1
+                    continue
+
+                # Skip records with up-to-date renditions
+                old_names = get_record_image_names(record)
+                old_profiles = get_image_profiles(img_path, old_names, template_renditions)
+                current = [(not args.force) and is_profile_current(image_file, image_size, *profile[:3])
+                           for profile in old_profiles]
+                if all(current):
+                    skipped += len(current)
+                    continue
+
+                # Link original and up-to-date renditions in the new names, make the other renditions
+                new_names = get_new_image_names(old_names)
+                new_profiles = get_image_profiles(img_path, new_names, template_renditions)
+                new_file = os.path.join(img_path, new_names[0])
+                image_storage.make_image_dir(img_path, new_names[0])
+                link_images(image_file, new_file)
+                profiles = []
+                for old_profile, new_profile, profile_current in zip(old_profiles, new_profiles, current):
+                    if profile_current:
+                        link_images(old_profile[0], new_profile[0])
+                        skipped += 1
+                    else:
+                        profiles.append(new_profile)
+                future = pool.submit(regenerate_image_profiles, new_file, profiles)
+                futures[future] = (record_name, record, img_path, template_renditions, new_names)
+
+        for future in as_completed(futures):
+            record_name, record, img_path, template_renditions, new_names = futures[future]
+            old_names = get_record_image_names(record)
+            try:
+                count = future.result()
+                if update_image_names(record, img_path, new_names):
+                    made += count
+                    old_images.append((img_path, get_all_image_names(old_names, template_renditions)))
+                    continue
+                print('%s renditions not saved: images replaced meanwhile' % record_name)
+            except (IOError, ValueError) as exp:
+                print('%s renditions not made: %s' % (record_name, exp))
+                failed += 1
+            remove_images(img_path, get_all_image_names(new_names, template_renditions))
+
+    # Rendered pages use the new renditions, then old images are removed
+    if made:
+        content_version.bump()
+    for img_path, image_names in old_images:
+        remove_images(img_path, image_names)
+    elapsed = time.perf_counter() - start
+    print('Renditions made: %d, up to date: %d, images failed: %d' % (made, skipped, failed))
+    print('Elapsed: %.1f s, %.1f renditions/s with %d workers' % (elapsed, made / elapsed if elapsed else 0,
+                                                                  args.workers))
+    return 0 if not failed else -1
+
+
+def backfill_image_sizes(args):
+    """
+    Read sizes of portfolio and picture images made before image sizes were stored
+    Images with known sizes are skipped unless --force is used
+    """
+    updated = failed = 0
+    for model in (Portfolio, Picture):
+        records = model.select(model, Site).join(Site).where(model.ready == True).order_by(model.id)
+        if args.site_id is not None:
+            records = records.where(model.site == args.site_id)
+        if not args.force:
+            records = records.where(model.original_width == 0)
+        for record in records:
+            try:
+                if update_image_sizes(record, record.site.get_image_path(IMAGE_PATH)):
+                    updated += 1
+            except IOError as exp:
+                print('%s %d image sizes not read: %s' % (model._meta.db_table, record.get_id(), exp))
+                failed += 1
+
+    # Rendered pages use the new sizes
+    if updated:
+        content_version.bump()
+    print('Image sizes updated: %d, failed: %d' % (updated, failed))
+    return 0 if not failed else -1
+
+
+def link_image(old_file, new_file):
+    """
+    Link old_file to new_file, files are copied on file systems without hard links
+    """
+    try:
+        os.link(old_file, new_file)
+    except OSError:
+        shutil.copy2(old_file, new_file)
+
+
+def link_images(old_file, new_file):
+    """
+    Link image old_file and its WebP copy to new_file
+    """
+    for old_image, new_image in ((old_file, new_file), (get_webp_name(old_file), get_webp_name(new_file))):
+        if os.path.exists(old_image) and not os.path.exists(new_image):
+            link_image(old_image, new_image)
+
+
+def migrate_storage(args):
+    """
+    Move images of portfolios and pictures to the layout of IMAGE_STORAGE and change their names
+    New files are linked before the record is saved and old files are removed after it, so images
+    are served during the migration and the command can be stopped and run again
+    """
+    migrated = linked = 0
+    for model, template_renditions in ((Portfolio, True), (Picture, False)):
+        records = model.select(model, Site).join(Site).where(model.ready == True).order_by(model.id)
+        if args.site_id is not None:
+            records = records.where(model.site == args.site_id)
+        for record in records:
+            if not record.original_image:
+                continue
+            img_path = record.site.get_image_path(IMAGE_PATH)
+            image_key = image_storage.get_image_key(record.original_image)
+            old_names = [record.original_image, record.normalized_image, record.thumbnail_image]
+            if template_renditions:
+                old_names += get_rendition_names(record.original_image)
+            new_names = [image_storage.get_image_name(image_key, posixpath.basename(name)) for name in old_names]
+            if new_names == old_names:
+                continue
+
+            # Link images and their WebP copies in the new names
+            for old_name, new_name in zip(old_names, new_names):
+                for old_image, new_image in ((old_name, new_name), (get_webp_name(old_name), get_webp_name(new_name))):
+                    old_file = os.path.join(img_path, old_image)
+                    new_file = os.path.join(img_path, new_image)
+                    if os.path.exists(old_file) and not os.path.exists(new_file):
+                        image_storage.make_image_dir(img_path, new_image)
+                        link_image(old_file, new_file)
+                        linked += 1
+
+            # Record changes to the new names, then the old files are removed
+            # Record is not changed when its images were replaced meanwhile, only the new links are removed
+            query = model.update(original_image=new_names[0], normalized_image=new_names[1],
+                                 thumbnail_image=new_names[2])
+            if query.where(model.id == record.get_id(), model.original_image == old_names[0]).execute() == 0:
+                print('%s %d images replaced meanwhile' % (model._meta.db_table, record.get_id()))
+                remove_images(img_path, new_names)
+                continue
+            remove_images(img_path, old_names)
+            migrated += 1
+
+    print('Images migrated to %s storage: %d, files moved: %d' % (IMAGE_STORAGE, migrated, linked))
+    return 0
+
+
+def repair_picture_counts(args):
+    """
+    Count again the ready pictures of portfolios and fix the wrong picture counts
+    """
+    repaired = Portfolio.repair_picture_counts(args.site_id)
+    print('Picture counts repaired: %d' % repaired)
+    return 0
+
+
+def migrate_database(args):
+    """
+    Show migrations of database and apply the migrations not applied yet
+    """
+    applied_versions = get_applied_versions()
+    for version, name, function in MIGRATIONS:
+        print('%s %d %s' % ('[X]' if version in applied_versions else '[ ]', version, name))
+    if args.list:
+        return 0
+    applied = run_migrations(verbose=True)
+    print('Migrations applied: %d' % applied)
+    return 0
+
+
+def get_hot_queries(site):
+    """
+    :return Queries (name, query) done on every page render and upload of site
+    """
+    return (
+        ('Portfolios of site', site.get_ordered_portfolios().where(Portfolio.ready == True)),
+        ('Pictures of site', Picture.select().where(Picture.site == site, Picture.ready == True)
+            .order_by(Picture.position, Picture.id)),
+        ('Pictures of portfolio', Picture.select().where(Picture.portfolio == 0).order_by(Picture.position, Picture.id)),
+        ('Next position of portfolio', Picture.select(fn.MAX(Picture.position)).where(Picture.portfolio == 0)),
+        ('Last portfolio of site', site.portfolios.order_by(Portfolio.id.desc()).limit(1)),
+        ('Last picture of site', site.pictures.order_by(Picture.id.desc()).limit(1)),
+    )
+
+
+def explain_queries(args):
+    """
+    Show EXPLAIN QUERY PLAN of hot queries and check that they use indexes
+    Full table scans and temporary b-trees for sorting are reported as failures
+    """
+    try:
+        site = Site.get(Site.id == args.site_id)
+    except Site.DoesNotExist:
+        print('Site %d not found' % args.site_id)
+        return -1
+
+    failed = 0
+    for name, query in get_hot_queries(site):
+        sql, params = query.sql()
+        print(name)
+        for row in db.execute_sql('EXPLAIN QUERY PLAN %s' % sql, params).fetchall():
+            detail = row[-1]
+            ok = not ((detail.startswith('SCAN') and 'USING' not in detail) or ('TEMP B-TREE' in detail))
+            if not ok:
+                failed += 1
+            print('    %s %s' % ('OK  ' if ok else 'FAIL', detail))
+    print('Query plans failed: %d' % failed)
+    return 0 if not failed else -1
+
+
+def main():
+    """
+    Main routine
+    """
+    parser = argparse.ArgumentParser(description='opcms management commands')
+    subparsers = parser.add_subparsers(dest='command')
+
+    # site_domain command
+    domain_parser = subparsers.add_parser('site_domain', help='Show or change the domain of a site')
+    domain_parser.add_argument('site_id', type=int, help='Site id')
+    domain_parser.add_argument('domain', nargs='?', help='New domain, empty string removes the domain')
+    domain_parser.set_defaults(function=site_domain)
+
+    # regenerate_renditions command
+    regenerate_parser = subparsers.add_parser('regenerate_renditions',
+                                              help='Make again the renditions of portfolio and picture images')
+    regenerate_parser.add_argument('--site', dest='site_id', type=int, help='Only images of this site')
+    regenerate_parser.add_argument('--force', action='store_true', help='Make again up-to-date renditions')
+    regenerate_parser.add_argument('--workers', type=int, default=IMAGE_WORKERS, help='Processes making renditions')
+    regenerate_parser.set_defaults(function=regenerate_renditions)
+
+    # backfill_image_sizes command
+    backfill_parser = subparsers.add_parser('backfill_image_sizes',
+                                            help='Read sizes of images uploaded before image sizes were stored')
+    backfill_parser.add_argument('--site', dest='site_id', type=int, help='Only images of this site')
+    backfill_parser.add_argument('--force', action='store_true', help='Read again known image sizes')
+    backfill_parser.set_defaults(function=backfill_image_sizes)
+
+    # migrate_storage command
+    migrate_parser = subparsers.add_parser('migrate_storage',
+                                           help='Move images to the layout of IMAGE_STORAGE setting')
+    migrate_parser.add_argument('--site', dest='site_id', type=int, help='Only images of this site')
+    migrate_parser.set_defaults(function=migrate_storage)
+
+    # repair_picture_counts command
+    repair_parser = subparsers.add_parser('repair_picture_counts',
+                                          help='Count again the pictures of portfolios and fix wrong counts')
+    repair_parser.add_argument('--site', dest='site_id', type=int, help='Only portfolios of this site')
+    repair_parser.set_defaults(function=repair_picture_counts)
+
+    # migrate command
+    migrate_database_parser = subparsers.add_parser('migrate', help='Apply migrations to the database')
+    migrate_database_parser.add_argument('--list', action='store_true', help='Only show migrations')
+    migrate_database_parser.set_defaults(function=migrate_database)
+
+    # explain_queries command
+    explain_parser = subparsers.add_parser('explain_queries', help='Check query plans of hot queries')
+    explain_parser.add_argument('--site', dest='site_id', type=int, default=1, help='Site of queries')
+    explain_parser.set_defaults(function=explain_queries)
+
+    args = parser.parse_args()
+    if not args.command:
+        parser.print_help()
+        return -1
+    if DATABASE_AUTO_MIGRATE and (args.command != 'migrate'):
+        run_migrations()
+    return args.function(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
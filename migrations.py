@@ -0,0 +1,175 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+from datetime import datetime
+
+from peewee import Model, CharField, DateTimeField, IntegerField
+from playhouse.migrate import SqliteMigrator, migrate
+
+from database import db
+from models import User, Site, Portfolio, Picture, Job
+
+
+__author__ = 'João Neto'
+
+
+"""
+Schema migrations
+Each migration changes the schema of existing databases and runs once in its own transaction,
+applied versions are recorded in schema_migration table
+New migrations are appended to MIGRATIONS with the next version, migrations check the
+schema before changing it because tables of new databases are created with all columns
+"""
+
+
+class SchemaMigration(Model):
+    version = IntegerField(primary_key=True,
+                           verbose_name='Versão',
+                           help_text='Versão da migração')
+    name = CharField(verbose_name='Nome',
+                     help_text='Nome da migração')
+    applied_date = DateTimeField(default=datetime.now,
+                                 verbose_name='Data aplicação',
+                                 help_text='Indica data de aplicação da migração')
+
+    class Meta:
+        database = db
+        db_table = 'schema_migration'
+
+
+def get_columns(model):
+    """
+    :return Column names of model table
+    """
+    return [column.name for column in db.get_columns(model._meta.db_table)]
+
+
+def create_tables(migrator):
+    db.create_tables([User, Site, Portfolio, Picture, Job], safe=True)
+
+
+def add_site_domain(migrator):
+    site_table = Site._meta.db_table
+    if 'domain' not in get_columns(Site):
+        migrate(migrator.add_column(site_table, 'domain', Site.domain),
+                migrator.add_index(site_table, ('domain',), True))
+
+
+def add_image_ready(migrator):
+    for model in (Portfolio, Picture):
+        if 'ready' not in get_columns(model):
+            migrate(migrator.add_column(model._meta.db_table, 'ready', model.ready))
+
+
+def add_image_sizes(migrator):
+    for model in (Portfolio, Picture):
+        columns = get_columns(model)
+        for field_name in model.image_size_fields:
+            if field_name not in columns:
+                migrate(migrator.add_column(model._meta.db_table, field_name, model._meta.fields[field_name]))
+
+
+def create_index(model, fields, unique=False):
+    """
+    Create index of model fields if it does not exist, with the name given by peewee
+    """
+    table = model._meta.db_table
+    columns = [model._meta.fields[field_name].db_column for field_name in fields]
+    if db.compiler().index_name(table, columns) not in [index.name for index in db.get_indexes(table)]:
+        db.create_index(model, fields, unique)
+
+
+def create_model_indexes(migrator):
+    """
+    Create the indexes declared in Meta.indexes of portfolios and pictures
+    Indexes of columns added by later migrations are created by those migrations
+    """
+    for model in (Portfolio, Picture):
+        columns = get_columns(model)
+        for fields, unique in model._meta.indexes:
+            if all(model._meta.fields[field_name].db_column in columns for field_name in fields):
+                create_index(model, fields, unique)
+
+
+def convert_dates(migrator):
+    """
+    Convert dates stored as '%d/%m/%Y %H:%M:%S' strings to datetime values and index them
+    Converted values are sortable 'YYYY-MM-DD HH:MM:SS' text, the storage of datetime in SQLite
+    """
+    for model in (User, Site, Portfolio, Picture, Job):
+        for field_name in ('created_date', 'modified_date'):
+            db.execute_sql('UPDATE "{table}" SET "{column}" = substr("{column}", 7, 4) || \'-\' || '
+                           'substr("{column}", 4, 2) || \'-\' || substr("{column}", 1, 2) || \' \' || '
+                           'substr("{column}", 12, 8) '
+                           'WHERE "{column}" LIKE \'__/__/____ __:__:__\''.format(table=model._meta.db_table,
+                                                                                   column=field_name))
+            create_index(model, (field_name,))
+
+
+def add_picture_count(migrator):
+    """
+    Add picture_count column of portfolios and count their ready pictures
+    """
+    if 'picture_count' not in get_columns(Portfolio):
+        migrate(migrator.add_column(Portfolio._meta.db_table, 'picture_count', Portfolio.picture_count))
+    Portfolio.repair_picture_counts()
+
+
+def add_positions(migrator):
+    """
+    Add position column of portfolios and pictures, positions start in id order (the order shown before),
+    create the indexes in position order and drop the indexes by site and ready state they replace
+    """
+    for model in (Portfolio, Picture):
+        table = model._meta.db_table
+        if 'position' not in get_columns(model):
+            migrate(migrator.add_column(table, 'position', model.position))
+            model.update(position=model.id).execute()
+        db.execute_sql('DROP INDEX IF EXISTS "%s"' % db.compiler().index_name(table, ['site_id', 'ready']))
+    create_model_indexes(migrator)
+
+
+MIGRATIONS = (
+    (1, 'Create tables', create_tables),
+    (2, 'Site domain', add_site_domain),
+    (3, 'Portfolio and picture ready', add_image_ready),
+    (4, 'Portfolio and picture image sizes', add_image_sizes),
+    (5, 'Portfolio and picture indexes', create_model_indexes),
+    (6, 'Created and modified dates as datetime', convert_dates),
+    (7, 'Portfolio picture count', add_picture_count),
+    (8, 'Portfolio and picture positions', add_positions),
+)
+
+
+def get_applied_versions():
+    """
+    :return Versions of applied migrations
+    """
+    db.create_tables([SchemaMigration], safe=True)
+    return set(migration.version for migration in SchemaMigration.select())
+
+
+def run_migrations(verbose=False):
+    """
+    Apply migrations not applied yet, in version order, the write lock of each transaction
+    makes processes starting together apply each migration once
+    :return Number of migrations applied
+    """
+    migrator = SqliteMigrator(db)
+    applied_versions = get_applied_versions()
+    applied = 0
+    for version, name, function in MIGRATIONS:
+        if version in applied_versions:
+            continue
+        with db.transaction():
+            # Other process may have applied it while this process waited for the write lock
+            if SchemaMigration.select().where(SchemaMigration.version == version).exists():
+                continue
+            function(migrator)
+            SchemaMigration.create(version=version, name=name)
+        applied += 1
+        if verbose:
+            print('Migration %d applied: %s' % (version, name))
+    return applied
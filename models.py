@@ -4,23 +4,21 @@ https://github.com/jfmedeirosneto/opcms
 Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
 """
 from datetime import datetime
+from functools import partial
 from hashlib import sha256
 import os
 
-from peewee import SqliteDatabase, Model, BooleanField, CharField, ForeignKeyField, IntegrityError, \
-    TextField
+from peewee import Model, BooleanField, CharField, DateTimeField, ForeignKeyField, IntegerField, \
+    IntegrityError, TextField, fn
 
-from utils import Regex
+from cache import content_version, site_version
+from database import db
+from renditions import get_rendition_names
+from utils import Regex, remove_images
 
 
 __author__ = 'João Neto'
 
-# Database
-# To configure database check peewee documentation
-# http://docs.peewee-orm.com/en/latest/peewee/database.html
-db = SqliteDatabase('database.sqlite')
-
-
 # Print all queries of peewee to stderr.
 # import logging
 # logger = logging.getLogger('peewee')
@@ -32,15 +30,17 @@ class BaseModel(Model):
     active = BooleanField(default=False,
                           verbose_name='Registro ativo',
                           help_text='Indica se registro está ativo')
-    created_date = CharField(default=datetime.now().strftime('%d/%m/%Y %H:%M:%S'),
-                             verbose_name='Data criação',
-                             help_text='Indica data de criação desse registro')
-    modified_date = CharField(default=datetime.now().strftime('%d/%m/%Y %H:%M:%S'),
-                              verbose_name='Data modificação',
-                              help_text='Indica data de modificação desse registro')
+    created_date = DateTimeField(default=datetime.now,
+                                 index=True,
+                                 verbose_name='Data criação',
+                                 help_text='Indica data de criação desse registro')
+    modified_date = DateTimeField(default=datetime.now,
+                                  index=True,
+                                  verbose_name='Data modificação',
+                                  help_text='Indica data de modificação desse registro')
 
     def save(self, force_insert=False, only=None):
-        self.modified_date = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
+        self.modified_date = datetime.now()
         super(BaseModel, self).save(force_insert, only)
 
     def get_dictionary(self):
@@ -49,6 +49,8 @@ class BaseModel(Model):
             field_name = field.name
             if isinstance(field, ForeignKeyField):
                 data[field_name] = getattr(self, field_name).get_id()
+            elif isinstance(field, DateTimeField):
+                data[field_name] = getattr(self, field_name).isoformat()
             else:
                 data[field_name] = getattr(self, field_name)
         return data
@@ -78,6 +80,7 @@ class User(BaseModel):
         str_hash = self.email + datetime.now().strftime('%d/%m/%Y %H:%M:%S')
         self.user_hash = sha256(str_hash.encode()).hexdigest()
         super(User, self).save(force_insert, only)
+        db.after_commit(site_version.bump)
 
     def __str__(self):
         return '\'%s\' <%s>' % (self.name, self.email)
@@ -92,6 +95,10 @@ class Site(BaseModel):
                            default='',
                            verbose_name='Email do site',
                            help_text='Coloque o email do site')
+    domain = CharField(null=True,
+                       unique=True,
+                       verbose_name='Domínio do site',
+                       help_text='Domínio usado para acessar o site (sem www)')
     site_owner = CharField(default='Minha Nova Empresa',
                            verbose_name='Nome da empresa/profissional',
                            help_text='Coloque o nome da sua empresa/profissional')
@@ -134,20 +141,54 @@ class Site(BaseModel):
                             help_text='Coloque uma URL do perfil do Twitter')
 
 
-    def get_image_path(self, img_path):
+    def get_image_path(self, img_path, create=True):
         """
         :return Path of site images
+        Use create=False when only reading images, avoiding a file system check
         """
         img_user_dir = 'site%d' % self.get_id()
         site_img_path = os.path.join(img_path, img_user_dir)
-        if not os.path.exists(site_img_path):
-            os.makedirs(site_img_path)
+        if create and not os.path.exists(site_img_path):
+            os.makedirs(site_img_path, exist_ok=True)
         return site_img_path
 
+    def get_portfolios(self):
+        """
+        :return Portfolios of site with pictures already loaded
+        Only portfolios and pictures with ready images are returned
+        Portfolios and pictures are loaded in two queries, the pictures are grouped by
+        portfolio in picture_list, the pictures query is skipped when no portfolio has pictures
+        Portfolios and pictures are in position order
+        """
+        portfolios = list(self.get_ordered_portfolios().where(Portfolio.ready == True))
+
+        # Group all pictures of site by portfolio
+        portfolio_pictures = {}
+        if any(portfolio.picture_count > 0 for portfolio in portfolios):
+            pictures = Picture.select().where(Picture.site == self, Picture.ready == True)
+            pictures = pictures.order_by(Picture.position, Picture.id)
+            for picture in pictures:
+                portfolio_pictures.setdefault(picture.portfolio_id, []).append(picture)
+
+        for portfolio in portfolios:
+            portfolio.picture_list = portfolio_pictures.get(portfolio.get_id(), [])
+        return portfolios
+
+    def get_ordered_portfolios(self):
+        """
+        :return Query of all portfolios of site in position order
+        """
+        return self.portfolios.order_by(Portfolio.position, Portfolio.id)
 
     def save(self, force_insert=False, only=None):
         if not Regex.email(self.site_email):
             raise IntegrityError('Email inválido')
+        if self.domain is not None:
+            self.domain = self.domain.lower()
+            if self.domain.startswith('www.'):
+                self.domain = self.domain[4:]
+            if not Regex.domain(self.domain):
+                raise IntegrityError('Domínio inválido')
         if not Regex.map_url(self.map_url):
             raise IntegrityError('URL do endereço inválido')
         if not Regex.phone_number(self.phones):
@@ -159,9 +200,118 @@ class Site(BaseModel):
         if not Regex.twitter_url(self.twitter_url):
             raise IntegrityError('Twitter inválido')
         super(Site, self).save(force_insert, only)
+        db.after_commit(site_version.bump)
+        db.after_commit(content_version.bump)
+
+
+class ImageModel(BaseModel):
+    """
+    Base model of records with original, normalized and thumbnail images
+    Image sizes are 0 until the images are made (or scanned by manage.py backfill_image_sizes)
+    Records are shown in position order, records with the same position in id order
+    """
+    position = IntegerField(default=0,
+                            verbose_name='Posição',
+                            help_text='Posição de exibição do registro')
+    original_width = IntegerField(default=0,
+                                  verbose_name='Largura da imagem original',
+                                  help_text='Largura em pixels da imagem original')
+    original_height = IntegerField(default=0,
+                                   verbose_name='Altura da imagem original',
+                                   help_text='Altura em pixels da imagem original')
+    original_bytes = IntegerField(default=0,
+                                  verbose_name='Tamanho da imagem original',
+                                  help_text='Tamanho em bytes da imagem original')
+    normalized_width = IntegerField(default=0,
+                                    verbose_name='Largura da imagem normalizada',
+                                    help_text='Largura em pixels da imagem normalizada')
+    normalized_height = IntegerField(default=0,
+                                     verbose_name='Altura da imagem normalizada',
+                                     help_text='Altura em pixels da imagem normalizada')
+    normalized_bytes = IntegerField(default=0,
+                                    verbose_name='Tamanho da imagem normalizada',
+                                    help_text='Tamanho em bytes da imagem normalizada')
+    thumbnail_width = IntegerField(default=0,
+                                   verbose_name='Largura da imagem reduzida',
+                                   help_text='Largura em pixels da imagem reduzida')
+    thumbnail_height = IntegerField(default=0,
+                                    verbose_name='Altura da imagem reduzida',
+                                    help_text='Altura em pixels da imagem reduzida')
+    thumbnail_bytes = IntegerField(default=0,
+                                   verbose_name='Tamanho da imagem reduzida',
+                                   help_text='Tamanho em bytes da imagem reduzida')
+
+    image_names = ('original', 'normalized', 'thumbnail')
+    image_size_fields = tuple('%s_%s' % (image_name, size_name) for image_name in image_names
+                              for size_name in ('width', 'height', 'bytes'))
+
+    # Fields of images, changed only by save_ready when the image job is done and by update queries
+    image_fields = ('ready', 'original_image', 'normalized_image', 'thumbnail_image') + image_size_fields
+
+    # Fields changed only by update queries (position by set_positions) and image fields, saving
+    # a record loaded before one of these changes (edited title) does not lose the change
+    update_only_fields = ('position',) + image_fields
+
+    def set_image_sizes(self, image_sizes):
+        """
+        Set sizes (width, height, bytes) of original, normalized and thumbnail images
+        """
+        for image_name, (width, height, size_bytes) in zip(self.image_names, image_sizes):
+            setattr(self, '%s_width' % image_name, width)
+            setattr(self, '%s_height' % image_name, height)
+            setattr(self, '%s_bytes' % image_name, size_bytes)
 
+    def get_image_size(self, image_name):
+        """
+        :return Size (width, height) of image_name ('original', 'normalized' or 'thumbnail'),
+        None while the size is not known
+        """
+        width = getattr(self, '%s_width' % image_name)
+        height = getattr(self, '%s_height' % image_name)
+        if not (width and height):
+            return None
+        return width, height
+
+    def save(self, force_insert=False, only=None):
+        if (only is None) and (self.get_id() is not None) and (not force_insert):
+            only = [field for field in self._meta.sorted_fields if field.name not in self.update_only_fields]
+        super(ImageModel, self).save(force_insert, only)
+
+    def save_ready(self):
+        """
+        Save record with its images ready, only image fields are saved
+        """
+        self.ready = True
+        self.save(only=[self._meta.fields[field_name] for field_name in self.image_fields])
+
+    @classmethod
+    def get_next_position(cls, records):
+        """
+        :return Position after the last of records (portfolios of a site or pictures of a portfolio)
+        """
+        last_position = records.select(fn.MAX(cls.position)).scalar()
+        return (last_position or 0) + 1
 
-class Portfolio(BaseModel):
+    @classmethod
+    def set_positions(cls, records, record_ids):
+        """
+        Set positions of records in the order of record_ids, updates are done in one transaction
+        record_ids must have the ids of all records, an order made before a record was added
+        or deleted is refused
+        :return True if positions were set
+        """
+        with db.atomic():
+            positions = dict(records.select(cls.id, cls.position).tuples())
+            if (len(record_ids) != len(positions)) or (set(record_ids) != set(positions)):
+                return False
+            for position, record_id in enumerate(record_ids, 1):
+                if positions[record_id] != position:
+                    cls.update(position=position).where(cls.id == record_id).execute()
+        db.after_commit(content_version.bump)
+        return True
+
+
+class Portfolio(ImageModel):
     site = ForeignKeyField(Site,
                            related_name='portfolios',
                            verbose_name='Site do portfólio',
@@ -181,32 +331,77 @@ class Portfolio(BaseModel):
     thumbnail_image = CharField(unique=True,
                                 verbose_name='Imagem reduzida',
                                 help_text='Imagem reduzida')
+    ready = BooleanField(default=True,
+                         verbose_name='Imagens prontas',
+                         help_text='Indica se as imagens já foram processadas')
+    picture_count = IntegerField(default=0,
+                                 verbose_name='Quantidade de imagens',
+                                 help_text='Quantidade de imagens prontas do portfólio')
+
+    # picture_count is changed by add_picture_count and repair_picture_counts
+    update_only_fields = ImageModel.update_only_fields + ('picture_count',)
 
     def delete_all(self, site_img_path):
-        # Delete pictures data
-        for picture in self.pictures:
-            picture.delete_all(site_img_path)
-
-        # Delete own data
-        if self.original_image:
-            original_file = os.path.join(site_img_path, self.original_image)
-            if os.path.exists(original_file):
-                os.remove(original_file)
-        if self.normalized_image:
-            normalized_file = os.path.join(site_img_path, self.normalized_image)
-            if os.path.exists(normalized_file):
-                os.remove(normalized_file)
-        if self.thumbnail_image:
-            thumbnail_file = os.path.join(site_img_path, self.thumbnail_image)
-            if os.path.exists(thumbnail_file):
-                os.remove(thumbnail_file)
-        super(Portfolio, self).delete_instance()
+        with db.atomic():
+            # Delete pictures data
+            for picture in self.pictures:
+                picture.delete_all(site_img_path)
+
+            # Delete own data, images are removed after the commit
+            image_names = [self.original_image, self.normalized_image, self.thumbnail_image]
+            if self.original_image:
+                image_names += get_rendition_names(self.original_image)
+            super(Portfolio, self).delete_instance()
+            db.after_commit(partial(remove_images, site_img_path, image_names))
+        db.after_commit(content_version.bump)
+
+    @classmethod
+    def add_picture_count(cls, portfolio_id, count):
+        """
+        Add count (negative to subtract) to picture_count of portfolio, in the database
+        so concurrent changes are not lost, callers run it in the transaction changing the pictures
+        """
+        cls.update(picture_count=cls.picture_count + count).where(cls.id == portfolio_id).execute()
+
+    @classmethod
+    def repair_picture_counts(cls, site_id=None):
+        """
+        Count again the ready pictures of portfolios and fix the wrong picture_count
+        :return Number of portfolios fixed
+        """
+        repaired = 0
+        with db.atomic():
+            pictures = Picture.select(Picture.portfolio, fn.COUNT(Picture.id)).where(Picture.ready == True)
+            portfolios = cls.select(cls.id, cls.picture_count)
+            if site_id is not None:
+                pictures = pictures.where(Picture.site == site_id)
+                portfolios = portfolios.where(cls.site == site_id)
+            counts = dict(pictures.group_by(Picture.portfolio).tuples())
+            for portfolio_id, picture_count in portfolios.tuples():
+                count = counts.get(portfolio_id, 0)
+                if picture_count != count:
+                    cls.update(picture_count=count).where(cls.id == portfolio_id).execute()
+                    repaired += 1
+        if repaired:
+            db.after_commit(content_version.bump)
+        return repaired
+
+    def get_ordered_pictures(self):
+        """
+        :return Query of all pictures of portfolio in position order
+        """
+        return self.pictures.order_by(Picture.position, Picture.id)
 
     def save(self, force_insert=False, only=None):
         super(Portfolio, self).save(force_insert, only)
+        db.after_commit(content_version.bump)
+
+    class Meta:
+        # Portfolios of site in position order
+        indexes = ((('site', 'position', 'id'), False),)
 
 
-class Picture(BaseModel):
+class Picture(ImageModel):
     site = ForeignKeyField(Site,
                            related_name='pictures',
                            verbose_name='Site da imagem',
@@ -230,26 +425,56 @@ class Picture(BaseModel):
     thumbnail_image = CharField(unique=True,
                                 verbose_name='Imagem reduzida',
                                 help_text='Imagem reduzida')
+    ready = BooleanField(default=True,
+                         verbose_name='Imagens prontas',
+                         help_text='Indica se as imagens já foram processadas')
 
     def delete_all(self, site_img_path):
-        if self.original_image:
-            original_file = os.path.join(site_img_path, self.original_image)
-            if os.path.exists(original_file):
-                os.remove(original_file)
-        if self.normalized_image:
-            normalized_file = os.path.join(site_img_path, self.normalized_image)
-            if os.path.exists(normalized_file):
-                os.remove(normalized_file)
-        if self.thumbnail_image:
-            thumbnail_file = os.path.join(site_img_path, self.thumbnail_image)
-            if os.path.exists(thumbnail_file):
-                os.remove(thumbnail_file)
-        super(Picture, self).delete_instance()
+        with db.atomic():
+            # Ready state is read by the delete, a ready picture is uncounted only by the request that deleted it
+            if Picture.delete().where(Picture.id == self.get_id(), Picture.ready == True).execute():
+                Portfolio.add_picture_count(self.portfolio_id, -1)
+            else:
+                Picture.delete().where(Picture.id == self.get_id()).execute()
+
+            # Images are removed after the commit
+            image_names = [self.original_image, self.normalized_image, self.thumbnail_image]
+            db.after_commit(partial(remove_images, site_img_path, image_names))
+        db.after_commit(content_version.bump)
+
+    def save_ready(self):
+        """
+        Save picture with its images ready and count it in picture_count of its portfolio
+        in the same transaction, a picture already ready is not counted again
+        """
+        with db.atomic():
+            query = Picture.update(ready=True).where(Picture.id == self.get_id(), Picture.ready == False)
+            if query.execute():
+                Portfolio.add_picture_count(self.portfolio_id, 1)
+            super(Picture, self).save_ready()
 
     def save(self, force_insert=False, only=None):
         super(Picture, self).save(force_insert, only)
+        db.after_commit(content_version.bump)
 
+    class Meta:
+        # Pictures of site and of portfolio in position order
+        indexes = ((('site', 'position', 'id'), False),
+                   (('portfolio', 'position', 'id'), False))
 
-# Connect to db and create tables
-db.connect()
-db.create_tables([User, Site, Portfolio, Picture], safe=True)
\ No newline at end of file
+
+class Job(BaseModel):
+    site = ForeignKeyField(Site,
+                           related_name='jobs',
+                           verbose_name='Site do processamento',
+                           help_text='Indica o site desse processamento')
+    record_type = CharField(verbose_name='Tipo do registro',
+                            help_text='Tipo do registro processado (portfolio ou picture)')
+    record_id = IntegerField(verbose_name='Registro',
+                             help_text='Indica o registro processado')
+    status = CharField(default='pending',
+                       verbose_name='Estado do processamento',
+                       help_text='Estado do processamento (pending, done ou failed)')
+    info = CharField(default='Processando imagem',
+                     verbose_name='Informação do processamento',
+                     help_text='Informação do processamento')
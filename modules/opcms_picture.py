@@ -9,10 +9,12 @@ from bottle import request, route, view, abort, template
 from peewee import IntegrityError
 
 from decorators import require_site_registered, require_site_activated, require_csrf, \
-    require_logged_in, require_permissions
-from models import Portfolio, Picture, db
-from settings import IMAGE_DIR, IMAGE_PATH, ORIG_SIZE, NORM_SIZE, THUMB_SIZE
-from utils import upload_new_image, upload_image
+    require_logged_in, require_permissions, require_body_size
+from jobs import submit_image_job
+from models import Portfolio, Picture, Job, db
+from settings import IMAGE_DIR, IMAGE_PATH, ORIG_SIZE, NORM_SIZE, THUMB_SIZE, BATCH_UPLOAD_MAX_FILES, \
+    UPLOAD_MAX_SIZE, BATCH_UPLOAD_MAX_SIZE
+from utils import get_upload_title, upload_new_image, upload_new_image_file
 
 
 __author__ = 'João Neto'
@@ -81,6 +83,7 @@ def picture_get(site, host, netloc, site_id, user_id, portfolio_id, picture_id):
 
 
 @route('/picture/add/', method='POST')
+@require_body_size(UPLOAD_MAX_SIZE, json_response=True)
 @require_site_registered(json_response=True)
 @require_site_activated(json_response=True)
 @require_csrf(token_id='csrf_pictures', json_response=True)
@@ -132,11 +135,13 @@ def picture_add(site, host, netloc, csrf, logged_in, user_id_logged_in):
         try:
             picture_created = Picture.create(site=site,
                                              portfolio=portfolio,
+                                             position=Picture.get_next_position(portfolio.pictures),
                                              title=title,
                                              description=description,
                                              original_image=original_image,
                                              normalized_image=normalized_image,
-                                             thumbnail_image=thumbnail_image)
+                                             thumbnail_image=thumbnail_image,
+                                             ready=False)
         except IntegrityError as exp:
             if picture_created:
                 picture_created.delete_instance(IMAGE_PATH)
@@ -154,9 +159,16 @@ def picture_add(site, host, netloc, csrf, logged_in, user_id_logged_in):
                     thumbnail_file = os.path.join(site_img_path, thumbnail_image)
                     if os.path.exists(thumbnail_file):
                         os.remove(thumbnail_file)
+            if os.path.exists(upload_response['upload_file']):
+                os.remove(upload_response['upload_file'])
             # Return error
             return dict(status=False, info='%s' % exp)
 
+    # Make images in image pool
+    job = submit_image_job(site, picture_created, upload_response, img_path)
+    if job.status == 'failed':
+        return dict(status=False, info=job.info)
+
     # Lista de pictures atualizada
     try:
         picture_list = template('pictures_admin_list.html', site=site, host=host, csrf=csrf,
@@ -166,10 +178,114 @@ def picture_add(site, host, netloc, csrf, logged_in, user_id_logged_in):
 
     # Return OK
     return dict(status=True, info='Adicionada com sucesso', picture_id=picture_created.get_id(),
+                job_id=job.get_id(), job_url='%s/picture/job/%d/' % (host, job.get_id()),
                 original=original_url, normalized=normalized_url, thumbnail=thumbnail_url,
                 picture_list=picture_list)
 
 
+@route('/picture/add/batch/', method='POST')
+@require_body_size(BATCH_UPLOAD_MAX_SIZE, json_response=True)
+@require_site_registered(json_response=True)
+@require_site_activated(json_response=True)
+@require_csrf(token_id='csrf_pictures', json_response=True)
+@require_logged_in(json_response=True)
+@require_permissions(json_response=True)
+def picture_add_batch(site, host, netloc, csrf, logged_in, user_id_logged_in):
+    """
+    Add many pictures post url
+    All uploads are saved, the pictures are created in one transaction and
+    the images of all pictures are made in parallel by image pool
+    """
+
+    # POST parameters
+    site_id = int(request.POST.get('site'))
+    user_id = int(request.POST.get('user'))
+    portfolio_id = int(request.POST.get('portfolio'))
+    uploads = request.files.getall('uploads')
+    if not uploads:
+        return dict(status=False, info='Nenhuma imagem enviada')
+    if len(uploads) > BATCH_UPLOAD_MAX_FILES:
+        return dict(status=False, info='Envie no máximo %d imagens' % BATCH_UPLOAD_MAX_FILES)
+
+    # Portfolio
+    try:
+        portfolio = Portfolio.get(Portfolio.id == portfolio_id, Portfolio.site == site)
+    except Portfolio.DoesNotExist:
+        return dict(status=False, info='Portfólio não encontrado')
+
+    # Upload picture images, each upload starts on a new index so names never repeat
+    start_index = 1
+    try:
+        pictures = site.pictures.order_by(Picture.id.desc())
+        last_picture = pictures.get()
+        start_index = last_picture.id + 1
+    except Picture.DoesNotExist:
+        pass
+    img_path = site.get_image_path(IMAGE_PATH)
+    img_url = '%s/%s/' % (host, IMAGE_DIR)
+    upload_responses = []
+    for index, upload in enumerate(uploads):
+        upload_response = upload_new_image_file(upload, 'picture', start_index + index, img_path, img_url,
+                                                ORIG_SIZE, NORM_SIZE, THUMB_SIZE)
+        upload_response['filename'] = upload.filename
+        upload_response['title'] = get_upload_title(upload)
+        upload_responses.append(upload_response)
+    uploaded = [upload_response for upload_response in upload_responses if upload_response['status']]
+
+    # Create Pictures
+    pictures_created = []
+    try:
+        with db.atomic():
+            position = Picture.get_next_position(portfolio.pictures)
+            for index, upload_response in enumerate(uploaded):
+                title = upload_response['title']
+                pictures_created.append(Picture.create(site=site,
+                                                       portfolio=portfolio,
+                                                       position=position + index,
+                                                       title=title,
+                                                       description=title,
+                                                       original_image=upload_response['original_filename'],
+                                                       normalized_image=upload_response['normalized_filename'],
+                                                       thumbnail_image=upload_response['thumbnail_filename'],
+                                                       ready=False))
+    except IntegrityError as exp:
+        for upload_response in uploaded:
+            if os.path.exists(upload_response['upload_file']):
+                os.remove(upload_response['upload_file'])
+        # Return error
+        return dict(status=False, info='%s' % exp)
+
+    # Make images in image pool
+    files = []
+    pictures_created = iter(pictures_created)
+    for upload_response in upload_responses:
+        file_data = dict(filename=upload_response['filename'], status=upload_response['status'],
+                         info=upload_response['info'])
+        if upload_response['status']:
+            picture_created = next(pictures_created)
+            job = submit_image_job(site, picture_created, upload_response, img_path)
+            if job.status == 'failed':
+                file_data.update(status=False, info=job.info)
+            else:
+                file_data.update(info='Adicionada com sucesso', picture_id=picture_created.get_id(),
+                                 job_id=job.get_id(), job_url='%s/picture/job/%d/' % (host, job.get_id()),
+                                 original=upload_response['original_url'],
+                                 normalized=upload_response['normalized_url'],
+                                 thumbnail=upload_response['thumbnail_url'])
+        files.append(file_data)
+
+    # Lista de pictures atualizada
+    try:
+        picture_list = template('pictures_admin_list.html', site=site, host=host, csrf=csrf,
+                                portfolio=portfolio, img_url=img_url)
+    except Exception as exp:
+        return dict(status=False, info='%s' % exp)
+
+    # Return OK
+    return dict(status=True, info='%d de %d imagens adicionadas' % (len(uploaded), len(uploads)),
+                files=files, picture_list=picture_list)
+
+
 @route('/picture/delete/', method='POST')
 @require_site_registered(json_response=True)
 @require_site_activated(json_response=True)
@@ -217,7 +333,53 @@ def picture_delete(site, host, netloc, csrf, logged_in, user_id_logged_in):
     return dict(status=True, info='Apagado com sucesso', picture_id=picture_id, picture_list=picture_list)
 
 
+@route('/picture/reorder/', method='POST')
+@require_site_registered(json_response=True)
+@require_site_activated(json_response=True)
+@require_csrf(token_id='csrf_pictures', json_response=True)
+@require_logged_in(json_response=True)
+@require_permissions(json_response=True)
+def picture_reorder(site, host, netloc, csrf, logged_in, user_id_logged_in):
+    """
+    Reorder pictures post url
+    pictures has the ids of all pictures of portfolio in the new order, separated by comma
+    """
+
+    # POST parameters
+    site_id = int(request.POST.get('site'))
+    user_id = int(request.POST.get('user'))
+    portfolio_id = int(request.POST.get('portfolio'))
+    try:
+        picture_ids = [int(picture_id) for picture_id in request.POST.get('pictures', '').split(',')]
+    except ValueError:
+        return dict(status=False, info='Ordem inválida')
+
+    # Portfolio
+    try:
+        portfolio = Portfolio.get(Portfolio.id == portfolio_id, Portfolio.site == site)
+    except Portfolio.DoesNotExist:
+        return dict(status=False, info='Portfólio não encontrado')
+
+    # Set positions of all pictures
+    if not Picture.set_positions(portfolio.pictures, picture_ids):
+        return dict(status=False, info='Ordem desatualizada, recarregue a página')
+
+    # Images url
+    img_url = '%s/%s/' % (host, IMAGE_DIR)
+
+    # Lista de pictures atualizada
+    try:
+        picture_list = template('pictures_admin_list.html', site=site, host=host, csrf=csrf,
+                                portfolio=portfolio, img_url=img_url)
+    except Exception as exp:
+        return dict(status=False, info='%s' % exp)
+
+    # Return OK
+    return dict(status=True, info='Ordem atualizada com sucesso', picture_list=picture_list)
+
+
 @route('/picture/update/', method='POST')
+@require_body_size(UPLOAD_MAX_SIZE, json_response=True)
 @require_site_registered(json_response=True)
 @require_site_activated(json_response=True)
 @require_csrf(token_id='csrf_pictures', json_response=True)
@@ -248,13 +410,15 @@ def picture_update(site, host, netloc, csrf, logged_in, user_id_logged_in):
     except Picture.DoesNotExist:
         return dict(status=False, info='Imagem não encontrada')
 
-    # Update upload picture image
+    # Images url
+    img_url = '%s/%s/' % (host, IMAGE_DIR)
+
+    # Update upload picture image with new file names
+    # Images are changed and old images are removed when the job is done
+    upload_response = None
     if request.files.get('upload'):
         img_path = site.get_image_path(IMAGE_PATH)
-        original_file = os.path.join(img_path, picture.original_image)
-        normalized_file = os.path.join(img_path, picture.normalized_image)
-        thumbnail_file = os.path.join(img_path, picture.thumbnail_image)
-        upload_response = upload_image(request, original_file, normalized_file, thumbnail_file, ORIG_SIZE, NORM_SIZE, THUMB_SIZE)
+        upload_response = upload_new_image(request, 'picture', picture.get_id(), img_path, img_url, ORIG_SIZE, NORM_SIZE, THUMB_SIZE)
         if not upload_response['status']:
             return upload_response
 
@@ -264,10 +428,19 @@ def picture_update(site, host, netloc, csrf, logged_in, user_id_logged_in):
     picture.save()
 
     # Images data
-    img_url = '%s/%s/' % (host, IMAGE_DIR)
-    original_url = img_url + picture.original_image
-    normalized_url = img_url + picture.normalized_image
-    thumbnail_url = img_url + picture.thumbnail_image
+    job_data = {}
+    if upload_response:
+        job = submit_image_job(site, picture, upload_response, img_path, replace=True)
+        if job.status == 'failed':
+            return dict(status=False, info=job.info)
+        job_data = dict(job_id=job.get_id(), job_url='%s/picture/job/%d/' % (host, job.get_id()))
+        original_url = upload_response['original_url']
+        normalized_url = upload_response['normalized_url']
+        thumbnail_url = upload_response['thumbnail_url']
+    else:
+        original_url = img_url + picture.original_image
+        normalized_url = img_url + picture.normalized_image
+        thumbnail_url = img_url + picture.thumbnail_image
 
     # Lista de pictures atualizada
     try:
@@ -279,4 +452,42 @@ def picture_update(site, host, netloc, csrf, logged_in, user_id_logged_in):
     # Return OK
     return dict(status=True, info='Atualizada com sucesso', picture_id=picture.get_id(),
                 original=original_url, normalized=normalized_url, thumbnail=thumbnail_url,
-                picture_list=picture_list)
+                picture_list=picture_list, **job_data)
+
+
+@route('/picture/job/<job_id:int>/', method='GET')
+@require_site_registered(json_response=True)
+@require_site_activated(json_response=True)
+@require_logged_in(json_response=True)
+def picture_job(site, host, netloc, logged_in, user_id_logged_in, job_id):
+    """
+    Image job status url
+    """
+
+    # Job
+    try:
+        job = Job.get(Job.id == job_id, Job.site == site)
+    except Job.DoesNotExist:
+        return dict(status=False, info='Processamento não encontrado')
+    if job.status == 'failed':
+        return dict(status=False, info=job.info, job_id=job.get_id(), job_status=job.status)
+    job_data = dict(job_id=job.get_id(), job_status=job.status, record_type=job.record_type, record_id=job.record_id)
+    if job.status == 'pending':
+        return dict(status=True, info=job.info, **job_data)
+
+    # Record of job
+    model = Portfolio if job.record_type == Portfolio._meta.db_table else Picture
+    try:
+        record = model.get(model.id == job.record_id, model.site == site)
+    except model.DoesNotExist:
+        return dict(status=False, info='Registro não encontrado', job_id=job.get_id(), job_status=job.status)
+
+    # Images data
+    img_url = '%s/%s/' % (host, IMAGE_DIR)
+    original_url = img_url + record.original_image
+    normalized_url = img_url + record.normalized_image
+    thumbnail_url = img_url + record.thumbnail_image
+
+    # Return OK
+    return dict(status=True, info=job.info, original=original_url, normalized=normalized_url, thumbnail=thumbnail_url,
+                **job_data)
@@ -9,10 +9,11 @@ from bottle import request, route, view, template
 from peewee import IntegrityError
 
 from decorators import require_site_registered, require_site_activated, require_csrf, \
-    require_logged_in, require_permissions
+    require_logged_in, require_permissions, require_body_size
+from jobs import submit_image_job
 from models import Portfolio, db
-from settings import IMAGE_DIR, IMAGE_PATH, ORIG_SIZE, NORM_SIZE, THUMB_SIZE
-from utils import upload_new_image, upload_image
+from settings import IMAGE_DIR, IMAGE_PATH, ORIG_SIZE, NORM_SIZE, THUMB_SIZE, UPLOAD_MAX_SIZE
+from utils import upload_new_image
 
 
 __author__ = 'João Neto'
@@ -69,6 +70,7 @@ def portfolio_get(site, host, netloc, site_id, user_id, portfolio_id):
 
 
 @route('/portfolio/add/', method='POST')
+@require_body_size(UPLOAD_MAX_SIZE, json_response=True)
 @require_site_registered(json_response=True)
 @require_site_activated(json_response=True)
 @require_csrf(token_id='csrf_portfolios', json_response=True)
@@ -112,11 +114,13 @@ def portfolio_add(site, host, netloc, csrf, logged_in, user_id_logged_in):
     with db.transaction():
         try:
             portfolio_created = Portfolio.create(site=site,
+                                                 position=Portfolio.get_next_position(site.portfolios),
                                                  title=title,
                                                  description=description,
                                                  original_image=original_image,
                                                  normalized_image=normalized_image,
-                                                 thumbnail_image=thumbnail_image)
+                                                 thumbnail_image=thumbnail_image,
+                                                 ready=False)
         except IntegrityError as exp:
             if portfolio_created:
                 portfolio_created.delete_instance(IMAGE_PATH)
@@ -134,9 +138,16 @@ def portfolio_add(site, host, netloc, csrf, logged_in, user_id_logged_in):
                     thumbnail_file = os.path.join(site_img_path, thumbnail_image)
                     if os.path.exists(thumbnail_file):
                         os.remove(thumbnail_file)
+            if os.path.exists(upload_response['upload_file']):
+                os.remove(upload_response['upload_file'])
             # Return error
             return dict(status=False, info='%s' % exp)
 
+    # Make images in image pool
+    job = submit_image_job(site, portfolio_created, upload_response, img_path, template_renditions=True)
+    if job.status == 'failed':
+        return dict(status=False, info=job.info)
+
     # Lista de portfolios atualizada
     try:
         portfolio_list = template('portfolios_admin_list.html', site=site, host=host, csrf=csrf, img_url=img_url)
@@ -145,6 +156,7 @@ def portfolio_add(site, host, netloc, csrf, logged_in, user_id_logged_in):
 
     # Return OK
     return dict(status=True, info='Adicionado com sucesso', portfolio_id=portfolio_created.get_id(),
+                job_id=job.get_id(), job_url='%s/picture/job/%d/' % (host, job.get_id()),
                 original=original_url, normalized=normalized_url, thumbnail=thumbnail_url,
                 portfolio_list=portfolio_list)
 
@@ -189,6 +201,7 @@ def portfolio_delete(site, host, netloc, csrf, logged_in, user_id_logged_in):
 
 
 @route('/portfolio/update/', method='POST')
+@require_body_size(UPLOAD_MAX_SIZE, json_response=True)
 @require_site_registered(json_response=True)
 @require_site_activated(json_response=True)
 @require_csrf(token_id='csrf_portfolios', json_response=True)
@@ -212,13 +225,15 @@ def portfolio_update(site, host, netloc, csrf, logged_in, user_id_logged_in):
     except Portfolio.DoesNotExist:
         return dict(status=False, info='Portfólio não encontrado')
 
-    # Update upload portfolio image
+    # Images url
+    img_url = '%s/%s/' % (host, IMAGE_DIR)
+
+    # Update upload portfolio image with new file names
+    # Images are changed and old images are removed when the job is done
+    upload_response = None
     if request.files.get('upload'):
         img_path = site.get_image_path(IMAGE_PATH)
-        original_file = os.path.join(img_path, portfolio.original_image)
-        normalized_file = os.path.join(img_path, portfolio.normalized_image)
-        thumbnail_file = os.path.join(img_path, portfolio.thumbnail_image)
-        upload_response = upload_image(request, original_file, normalized_file, thumbnail_file, ORIG_SIZE, NORM_SIZE, THUMB_SIZE)
+        upload_response = upload_new_image(request, 'portfolio', portfolio.get_id(), img_path, img_url, ORIG_SIZE, NORM_SIZE, THUMB_SIZE)
         if not upload_response['status']:
             return upload_response
 
@@ -228,10 +243,19 @@ def portfolio_update(site, host, netloc, csrf, logged_in, user_id_logged_in):
     portfolio.save()
 
     # Images data
-    img_url = '%s/%s/' % (host, IMAGE_DIR)
-    original_url = img_url + portfolio.original_image
-    normalized_url = img_url + portfolio.normalized_image
-    thumbnail_url = img_url + portfolio.thumbnail_image
+    job_data = {}
+    if upload_response:
+        job = submit_image_job(site, portfolio, upload_response, img_path, replace=True, template_renditions=True)
+        if job.status == 'failed':
+            return dict(status=False, info=job.info)
+        job_data = dict(job_id=job.get_id(), job_url='%s/picture/job/%d/' % (host, job.get_id()))
+        original_url = upload_response['original_url']
+        normalized_url = upload_response['normalized_url']
+        thumbnail_url = upload_response['thumbnail_url']
+    else:
+        original_url = img_url + portfolio.original_image
+        normalized_url = img_url + portfolio.normalized_image
+        thumbnail_url = img_url + portfolio.thumbnail_image
 
     # Lista de portfolios atualizada
     try:
@@ -242,4 +266,41 @@ def portfolio_update(site, host, netloc, csrf, logged_in, user_id_logged_in):
     # Return OK
     return dict(status=True, info='Atualizado com sucesso', portfolio_id=portfolio.get_id(),
                 original=original_url, normalized=normalized_url, thumbnail=thumbnail_url,
-                portfolio_list=portfolio_list)
+                portfolio_list=portfolio_list, **job_data)
+
+
+@route('/portfolio/reorder/', method='POST')
+@require_site_registered(json_response=True)
+@require_site_activated(json_response=True)
+@require_csrf(token_id='csrf_portfolios', json_response=True)
+@require_logged_in(json_response=True)
+@require_permissions(json_response=True)
+def portfolio_reorder(site, host, netloc, csrf, logged_in, user_id_logged_in):
+    """
+    Reorder portfolios post url
+    portfolios has the ids of all portfolios of site in the new order, separated by comma
+    """
+
+    # POST parameters
+    site_id = int(request.POST.get('site'))
+    user_id = int(request.POST.get('user'))
+    try:
+        portfolio_ids = [int(portfolio_id) for portfolio_id in request.POST.get('portfolios', '').split(',')]
+    except ValueError:
+        return dict(status=False, info='Ordem inválida')
+
+    # Set positions of all portfolios
+    if not Portfolio.set_positions(site.portfolios, portfolio_ids):
+        return dict(status=False, info='Ordem desatualizada, recarregue a página')
+
+    # Images url
+    img_url = '%s/%s/' % (host, IMAGE_DIR)
+
+    # Lista de portfolios atualizada
+    try:
+        portfolio_list = template('portfolios_admin_list.html', site=site, host=host, csrf=csrf, img_url=img_url)
+    except Exception as exp:
+        return dict(status=False, info='%s' % exp)
+
+    # Return OK
+    return dict(status=True, info='Ordem atualizada com sucesso', portfolio_list=portfolio_list)
@@ -3,17 +3,24 @@ opcms One Page Content Management System
 https://github.com/jfmedeirosneto/opcms
 Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
 """
+from functools import partial
 import sys
 from hashlib import md5
 
-from bottle import route, static_file, view, template, default_app, run, request
+from bottle import route, view, template, default_app, run, request
 from beaker.middleware import SessionMiddleware
 from peewee import IntegrityError
 
-from decorators import require_site_registered, require_site_activated, require_csrf
+from assets import AssetMiddleware, asset_app
+from cache import PageCache, content_version
+from database import install_request_connections
+from decorators import require_site_registered, require_site_activated, require_csrf, require_logged_in
+from migrations import run_migrations
 from models import User, Site, db
-from settings import STATIC_URL, STATIC_PATH, IMAGE_DIR, IMAGE_URL, IMAGE_PATH, MODULES_PATH, TEMPLATES_PATH, \
-    TEMPLATES_DIR, TEMPLATES_URL, session_opts, MAIN_EMAIL, MAIN_PASSWORD, MAIN_NAME
+from renditions import get_rendition_url, get_picture_markup, get_srcset
+from sessions import get_session_opts, start_session_sweeper
+from settings import IMAGE_DIR, IMAGE_PATH, MODULES_PATH, TEMPLATES_PATH, TEMPLATES_DIR, MAIN_EMAIL, MAIN_PASSWORD, MAIN_NAME, \
+    PAGE_CACHE_SIZE, DATABASE_AUTO_MIGRATE
 from utils import import_modules, import_templates, send_contact_email
 
 
@@ -26,6 +33,18 @@ Dinamic data
 modules_list = None
 templates_dict = None
 
+"""
+Rendered pages cache
+"""
+page_cache = PageCache(PAGE_CACHE_SIZE)
+CSRF_PLACEHOLDER = '__opcms_csrf__'
+
+"""
+Database schema, migrations are applied before the first query
+"""
+if DATABASE_AUTO_MIGRATE:
+    run_migrations()
+
 """
 Create Main Site Data
 """
@@ -56,10 +75,44 @@ if (not MAIN_USER) or (not MAIN_SITE):
     sys.exit(-1)
 
 
+def render_page(site, host, template_name):
+    """
+    Render main page of site with template_name or default template
+    The csrf token is rendered as CSRF_PLACEHOLDER
+    """
+
+    # Images url
+    img_url = '%s/%s/' % (host, IMAGE_DIR)
+
+    # Portfolios with pictures loaded in a fixed number of queries
+    portfolios = site.get_portfolios()
+
+    # Default template
+    if template_name is None:
+        return template('index.html', site=site, host=host, csrf=CSRF_PLACEHOLDER, img_url=img_url,
+                        portfolios=portfolios)
+
+    # Custom template
+    tpl_module = templates_dict[template_name]
+    tpl_url = '%s/%s/%s/' % (host, TEMPLATES_DIR, tpl_module.dir_name)
+    original_tpl = '%s%s' % (tpl_url, tpl_module.original_file_name)
+
+    # Url of renditions declared by template, rendition_url(portfolio, rendition_name)
+    # <picture> markup of renditions, picture(portfolio, rendition_name, class_='img-responsive')
+    # srcset of images, srcset(picture)
+    site_img_path = site.get_image_path(IMAGE_PATH, create=False)
+    rendition_url = partial(get_rendition_url, site_img_path, img_url, tpl_module.short_name)
+    picture = partial(get_picture_markup, site_img_path, img_url, tpl_module.short_name)
+    srcset = partial(get_srcset, img_url)
+    return template(tpl_module.file_path, site=site, host=host, csrf=CSRF_PLACEHOLDER, img_url=img_url,
+                    portfolios=portfolios, tpl_url=tpl_url, original_tpl=original_tpl, tpl_module=tpl_module,
+                    rendition_url=rendition_url, picture=picture, srcset=srcset)
+
+
 @route('/', method='GET')
 @require_site_registered()
 @require_site_activated()
-@require_csrf(token_id='csrf_index')
+@require_csrf(token_id='csrf_index', stateless=True)
 def index_page(site, host, netloc, csrf):
     """
     Main page url
@@ -72,29 +125,25 @@ def index_page(site, host, netloc, csrf):
     # Preview argument or template name from site
     template_name = request.GET.get('preview', template_name)
 
-    # Images url
-    img_url = '%s/%s/' % (host, IMAGE_DIR)
-
-    # Default template
-    tpl = template('index.html', site=site, host=host, csrf=csrf, img_url=img_url)
+    # Unknown templates are rendered with default template
+    if (not templates_dict) or (template_name not in templates_dict):
+        template_name = None
 
-    # Load custom template
-    if templates_dict:
-        if template_name in templates_dict:
-            tpl_module = templates_dict[template_name]
-            tpl_url = '%s/%s/%s/' % (host, TEMPLATES_DIR, tpl_module.dir_name)
-            original_tpl = '%s%s' % (tpl_url, tpl_module.original_file_name)
-            tpl = template(tpl_module.file_path, site=site, host=host, csrf=csrf, img_url=img_url,
-                           tpl_url=tpl_url, original_tpl=original_tpl, tpl_module=tpl_module)
+    # Rendered page from cache, only the csrf token changes between visitors
+    page_key = (site.get_id(), host, template_name, content_version.get())
+    tpl = page_cache.get(page_key)
+    if tpl is None:
+        tpl = render_page(site, host, template_name)
+        page_cache.set(page_key, tpl)
 
     # Return template
-    return tpl
+    return tpl.replace(CSRF_PLACEHOLDER, csrf)
 
 
 @route('/contact/', method='POST')
 @require_site_registered(json_response=True)
 @require_site_activated(json_response=True)
-@require_csrf(token_id='csrf_index', json_response=True)
+@require_csrf(token_id='csrf_index', json_response=True, stateless=True)
 def contact(site, host, netloc, csrf):
     """
     Contact form post url
@@ -121,72 +170,16 @@ def contact(site, host, netloc, csrf):
     return dict(status=True, info='Obrigado! Mensagem enviada com sucesso')
 
 
-@route(STATIC_URL)
-@require_site_registered()
-def server_static(site, host, netloc, file_path):
-    """
-    Serving static files
-    """
-
-    # Response static
-    response_static = static_file(file_path, root=STATIC_PATH)
-
-    # Non-cache static
-    non_cache = []
-
-    # Verify non_cache files
-    if file_path in non_cache:
-        response_static.set_header("Cache-Control", "no-cache, no-store, must-revalidate")
-        response_static.set_header("Pragma", "no-cache")
-        response_static.set_header("Expires", "0")
-    else:
-        response_static.set_header("Cache-Control", "max-age=86400, public")
-
-    # Return static files
-    return response_static
-
-
-@route(IMAGE_URL)
-@require_site_registered()
-@require_site_activated()
-def server_static(site, host, netloc, file_path):
-    """
-    Serving image files
-    Images files is served by site according get_image_path function
-    """
-
-    # Response static
-    response_static = static_file(file_path, root=site.get_image_path(IMAGE_PATH))
-
-    # Force Brownser check a fresh static "If-Modified-Since"
-    # response_static.set_header("Cache-Control", "max-age=86400, must-revalidate")
-    # response_static.set_header("Expires", "-1")
-
-    # Non-cache for images
-    response_static.set_header("Cache-Control", "no-cache, no-store, must-revalidate")
-    response_static.set_header("Pragma", "no-cache")
-    response_static.set_header("Expires", "0")
-
-    # Return files files
-    return response_static
-
-
-@route(TEMPLATES_URL)
-@require_site_registered()
-@require_site_activated()
-def server_template(site, host, netloc, file_path):
+@route('/cache/stats/', method='GET')
+@require_site_registered(json_response=True)
+@require_site_activated(json_response=True)
+@require_logged_in(json_response=True)
+def cache_stats(site, host, netloc, logged_in, user_id_logged_in):
     """
-    Serving template files
+    Rendered pages cache statistics url
+    Each server process has its own cache, statistics are of the process serving the request
     """
-
-    # Response static
-    response_static = static_file(file_path, root=TEMPLATES_PATH)
-
-    # Cache all template files
-    response_static.set_header("Cache-Control", "max-age=86400, public")
-
-    # Return static files
-    return response_static
+    return dict(status=True, info='Estatísticas do cache de páginas', **page_cache.get_stats())
 
 
 def get_opcms_app(modules_path, templates_path):
@@ -201,11 +194,18 @@ def get_opcms_app(modules_path, templates_path):
     # Import all modules from modules_path
     templates_dict = import_templates(templates_path)
 
-    # SessionMiddleware
-    session_app = SessionMiddleware(default_app(), session_opts)
+    # SessionMiddleware with configured backend and its sweeper of expired sessions
+    session_app = SessionMiddleware(default_app(), get_session_opts())
+    start_session_sweeper()
+
+    # Database connection of each request is closed at its end
+    install_request_connections(default_app(), asset_app)
+
+    # Asset files are served ahead of SessionMiddleware
+    opcms_app = AssetMiddleware(asset_app, session_app)
 
     # Return app
-    return session_app
+    return opcms_app
 
 
 def main():
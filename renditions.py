@@ -0,0 +1,138 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+import os
+
+from bottle import html_escape
+
+from settings import TEMPLATES_PATH, ORIG_SIZE, NORM_SIZE, THUMB_SIZE
+from utils import import_templates, get_fit_size, get_webp_name
+
+
+__author__ = 'João Neto'
+
+
+"""
+Template renditions
+Each template declares in template.py the renditions of portfolio images it shows:
+    renditions = {
+        'tile': dict(size=(720, 520), crop=True, quality=85),
+    }
+size is the max size of rendition, crop=True crops the image to the exact size and
+quality is the JPEG quality of rendition
+Renditions of all templates are made on upload, so sites can change template anytime
+"""
+RENDITION_DEFAULTS = dict(crop=False, quality=85)
+
+templates_renditions = None
+
+
+def get_templates_renditions():
+    """
+    :return Dictionary of renditions declared by each template
+    """
+    global templates_renditions
+    if templates_renditions is None:
+        templates_dict = import_templates(TEMPLATES_PATH)
+        templates_renditions = {}
+        for short_name, tpl_module in templates_dict.items():
+            renditions = {}
+            for rendition_name, rendition in getattr(tpl_module, 'renditions', {}).items():
+                renditions[rendition_name] = dict(RENDITION_DEFAULTS, **rendition)
+            templates_renditions[short_name] = renditions
+    return templates_renditions
+
+
+def get_rendition_name(image_name, template_name, rendition_name):
+    """
+    :return File name of rendition of image
+    """
+    name, ext = os.path.splitext(image_name)
+    return '%s_%s_%s%s' % (name, template_name, rendition_name, ext)
+
+
+def get_rendition_names(image_name):
+    """
+    :return File names of renditions of image for all templates
+    """
+    rendition_names = []
+    for template_name, renditions in sorted(get_templates_renditions().items()):
+        for rendition_name in sorted(renditions):
+            rendition_names.append(get_rendition_name(image_name, template_name, rendition_name))
+    return rendition_names
+
+
+def get_rendition_profiles(img_path, image_name):
+    """
+    :return Profiles (file, size, crop, quality) of renditions of image for all templates
+    """
+    profiles = []
+    for template_name, renditions in sorted(get_templates_renditions().items()):
+        for rendition_name, rendition in sorted(renditions.items()):
+            rendition_file = os.path.join(img_path, get_rendition_name(image_name, template_name, rendition_name))
+            profiles.append((rendition_file, tuple(rendition['size']), rendition['crop'], rendition['quality']))
+    return profiles
+
+
+def get_rendition_image(img_path, template_name, record, rendition_name):
+    """
+    :return Name and size (width, height) of rendition of record image, size is None when not known
+    While the rendition was not made (images uploaded before the template declared it)
+    the normalized or original image covering the rendition size is returned
+    """
+    rendition = get_templates_renditions()[template_name][rendition_name]
+    rendition_file = get_rendition_name(record.original_image, template_name, rendition_name)
+    if os.path.exists(os.path.join(img_path, rendition_file)):
+        if rendition['crop']:
+            return rendition_file, tuple(rendition['size'])
+        original_size = record.get_image_size('original')
+        if original_size is None:
+            return rendition_file, None
+        return rendition_file, get_fit_size(original_size, rendition['size'])
+    width, height = rendition['size']
+    if (width <= NORM_SIZE[0]) and (height <= NORM_SIZE[1]):
+        return record.normalized_image, record.get_image_size('normalized')
+    return record.original_image, record.get_image_size('original')
+
+
+def get_rendition_url(img_path, img_url, template_name, record, rendition_name):
+    """
+    :return Url of rendition of record image
+    """
+    return img_url + get_rendition_image(img_path, template_name, record, rendition_name)[0]
+
+
+def get_srcset(img_url, record):
+    """
+    :return srcset attribute of record images, thumbnail, normalized and original with their widths
+    (max widths while the sizes are not known), images of small originals with the same width are listed once
+    """
+    srcset = []
+    widths = set()
+    for image_name, max_size in (('thumbnail', THUMB_SIZE), ('normalized', NORM_SIZE), ('original', ORIG_SIZE)):
+        width = (record.get_image_size(image_name) or max_size)[0]
+        if width not in widths:
+            widths.add(width)
+            srcset.append('%s%s %dw' % (img_url, getattr(record, '%s_image' % image_name), width))
+    return ', '.join(srcset)
+
+
+def get_picture_markup(img_path, img_url, template_name, record, rendition_name, **attributes):
+    """
+    :return <picture> markup of rendition of record image, with WebP source when the WebP copy exists
+    and <img> fallback with attributes, class_ is the class attribute
+    width and height of <img> are set when the size of rendition is known
+    """
+    rendition_file, rendition_size = get_rendition_image(img_path, template_name, record, rendition_name)
+    if rendition_size is not None:
+        attributes.setdefault('width', rendition_size[0])
+        attributes.setdefault('height', rendition_size[1])
+    img_attributes = ''.join(' %s="%s"' % (name.rstrip('_'), html_escape(str(value)))
+                             for name, value in sorted(attributes.items()))
+    img = '<img src="%s"%s>' % (html_escape(img_url + rendition_file), img_attributes)
+    webp_name = get_webp_name(rendition_file)
+    if not os.path.exists(os.path.join(img_path, webp_name)):
+        return img
+    return '<picture><source type="image/webp" srcset="%s">%s</picture>' % (html_escape(img_url + webp_name), img)
@@ -0,0 +1,237 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+from threading import Lock, Thread, local
+import os
+import pickle
+import sqlite3
+import time
+
+from beaker.container import NamespaceManager
+from beaker.synchronization import null_synchronizer
+
+from settings import SESSION_BACKEND, SESSION_TIMEOUT, SESSION_SWEEP_INTERVAL, SESSION_DATABASE, \
+    SECRET_KEY_FILE, session_opts
+from utils import get_secret_key
+
+
+__author__ = 'João Neto'
+
+
+class ExpiringMemoryNamespaceManager(NamespaceManager):
+    """
+    Sessions stored in memory of the process
+    Each session expires SESSION_TIMEOUT seconds after its last write
+    """
+    sessions = {}
+    lock = Lock()
+
+    def __init__(self, namespace, **kwargs):
+        NamespaceManager.__init__(self, namespace)
+
+    def get_creation_lock(self, key):
+        return null_synchronizer()
+
+    def __getitem__(self, key):
+        with self.lock:
+            expires, value = self.sessions[(self.namespace, key)]
+        if expires < time.time():
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.sessions[(self.namespace, key)] = (time.time() + SESSION_TIMEOUT, value)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __delitem__(self, key):
+        with self.lock:
+            self.sessions.pop((self.namespace, key), None)
+
+    def keys(self):
+        with self.lock:
+            return [key for namespace, key in self.sessions if namespace == self.namespace]
+
+    def do_remove(self):
+        for key in self.keys():
+            del self[key]
+
+    @classmethod
+    def sweep(cls):
+        """
+        Remove expired sessions
+        """
+        now = time.time()
+        with cls.lock:
+            expired = [key for key, (expires, value) in cls.sessions.items() if expires < now]
+            for key in expired:
+                del cls.sessions[key]
+        return len(expired)
+
+
+class SqliteNamespaceManager(NamespaceManager):
+    """
+    Sessions stored in a SQLite database shared by all processes
+    Each session expires SESSION_TIMEOUT seconds after its last write
+    """
+    connections = local()
+
+    def __init__(self, namespace, **kwargs):
+        NamespaceManager.__init__(self, namespace)
+
+    @classmethod
+    def get_connection(cls):
+        """
+        :return SQLite connection of current thread
+        """
+        connection = getattr(cls.connections, 'connection', None)
+        if connection is None:
+            session_dir = os.path.dirname(SESSION_DATABASE)
+            if not os.path.exists(session_dir):
+                os.makedirs(session_dir, exist_ok=True)
+            connection = sqlite3.connect(SESSION_DATABASE, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS session '
+                               '(namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, '
+                               'expires REAL NOT NULL, PRIMARY KEY (namespace, key))')
+            connection.execute('CREATE INDEX IF NOT EXISTS session_expires ON session (expires)')
+            cls.connections.connection = connection
+        return connection
+
+    def get_creation_lock(self, key):
+        return null_synchronizer()
+
+    def __getitem__(self, key):
+        row = self.get_connection().execute(
+            'SELECT value FROM session WHERE namespace = ? AND key = ? AND expires >= ?',
+            (self.namespace, key, time.time())).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return pickle.loads(row[0])
+
+    def __setitem__(self, key, value):
+        self.get_connection().execute(
+            'INSERT OR REPLACE INTO session (namespace, key, value, expires) VALUES (?, ?, ?, ?)',
+            (self.namespace, key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), time.time() + SESSION_TIMEOUT))
+
+    def __contains__(self, key):
+        row = self.get_connection().execute(
+            'SELECT 1 FROM session WHERE namespace = ? AND key = ? AND expires >= ?',
+            (self.namespace, key, time.time())).fetchone()
+        return row is not None
+
+    def __delitem__(self, key):
+        self.get_connection().execute(
+            'DELETE FROM session WHERE namespace = ? AND key = ?', (self.namespace, key))
+
+    def keys(self):
+        rows = self.get_connection().execute(
+            'SELECT key FROM session WHERE namespace = ?', (self.namespace,)).fetchall()
+        return [row[0] for row in rows]
+
+    def do_remove(self):
+        self.get_connection().execute('DELETE FROM session WHERE namespace = ?', (self.namespace,))
+
+    @classmethod
+    def sweep(cls):
+        """
+        Remove expired sessions
+        """
+        cursor = cls.get_connection().execute('DELETE FROM session WHERE expires < ?', (time.time(),))
+        return cursor.rowcount
+
+
+def sweep_file_sessions():
+    """
+    Remove file sessions not written for SESSION_TIMEOUT seconds
+    """
+    removed = 0
+    expires = time.time() - SESSION_TIMEOUT
+    data_dir = session_opts['session.data_dir']
+    for dir_name in ('container_file', 'container_file_lock'):
+        for root, dirs, files in os.walk(os.path.join(data_dir, dir_name)):
+            for file_name in files:
+                file_path = os.path.join(root, file_name)
+                try:
+                    if os.path.getmtime(file_path) < expires:
+                        os.remove(file_path)
+                        removed += 1
+                except OSError:
+                    # Removed by other process
+                    pass
+    return removed
+
+
+"""
+Session backends
+Each backend has beaker options and a sweep function for expired sessions
+"""
+SESSION_BACKENDS = {
+    'file': (dict(session_opts), sweep_file_sessions),
+    'memory': ({'session.type': 'memory',
+                'session.namespace_class': ExpiringMemoryNamespaceManager},
+               ExpiringMemoryNamespaceManager.sweep),
+    'sqlite': ({'session.type': 'sqlite',
+                'session.namespace_class': SqliteNamespaceManager},
+               SqliteNamespaceManager.sweep),
+    'cookie': ({'session.type': 'cookie',
+                'session.data_serializer': 'json',
+                'session.httponly': True},
+               None),
+}
+
+
+def get_session_opts(backend=SESSION_BACKEND):
+    """
+    :return Beaker options of session backend
+    """
+    backend_opts, sweep_function = SESSION_BACKENDS[backend]
+    opts = {
+        'session.cookie_expires': session_opts['session.cookie_expires'],
+        'session.auto': session_opts['session.auto'],
+        'session.timeout': SESSION_TIMEOUT,
+    }
+    opts.update(backend_opts)
+    if backend == 'cookie':
+        opts['session.validate_key'] = get_secret_key(SECRET_KEY_FILE).decode()
+    return opts
+
+
+class SessionSweeper(Thread):
+    """
+    Background thread removing expired sessions every SESSION_SWEEP_INTERVAL seconds
+    """
+
+    def __init__(self, sweep_function, interval=SESSION_SWEEP_INTERVAL):
+        Thread.__init__(self, name='opcms-session-sweeper', daemon=True)
+        self.sweep_function = sweep_function
+        self.interval = interval
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sweep_function()
+            except Exception as exp:
+                print("Session sweep fail:", exp)
+
+
+def start_session_sweeper(backend=SESSION_BACKEND):
+    """
+    Start the sweeper thread of session backend, if it needs one
+    """
+    backend_opts, sweep_function = SESSION_BACKENDS[backend]
+    if sweep_function is None:
+        return None
+    sweeper = SessionSweeper(sweep_function)
+    sweeper.start()
+    return sweeper
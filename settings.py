@@ -25,6 +25,10 @@ MAIN_PASSWORD = '1234'
 MAIN_NAME = 'John Smith'
 DEFAULT_SENDER = formataddr((MAIN_NAME, MAIN_EMAIL), 'UTF-8')
 
+# Site served to hosts without a site registered with its domain
+# Use None to serve only sites registered with domain
+DEFAULT_SITE_ID = 1
+
 # Path of installation of opcms
 BASE_PATH = os.path.abspath(os.path.dirname(__file__))
 
@@ -43,11 +47,98 @@ IMAGE_DIR = 'img'
 IMAGE_URL = '/%s/<file_path:path>' % IMAGE_DIR
 IMAGE_PATH = os.path.join(BASE_PATH, IMAGE_DIR)
 
+# Encoding of JPEG images, quality of template renditions is declared by templates
+IMAGE_ENCODING = dict(quality=85, progressive=True, optimize=True)
+
+# Keep EXIF metadata of uploaded images, when False EXIF is removed and orientation is
+# applied on pixels (ICC color profile is always kept)
+IMAGE_KEEP_METADATA = False
+
+# Save WebP copies of images (requires Pillow with WebP support)
+IMAGE_WEBP = True
+IMAGE_WEBP_ENCODING = dict(quality=80, method=4)
+
+# Image renditions of size presets, made on demand by IMAGE_PRESET_URL
+IMAGE_PRESET_URL = '/%s/<width:int>x<height:int>/<file_path:path>' % IMAGE_DIR
+IMAGE_PRESETS = ((360, 360), (720, 720))
+
+# Cache-Control of served files, browsers revalidate files with ETag and Last-Modified
+# Image file names are versioned by content, so images never change and are cached for one year
+STATIC_CACHE_CONTROL = 'public, max-age=86400'
+IMAGE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+TEMPLATES_CACHE_CONTROL = 'public, max-age=86400'
+
+# Display format of dates, dates are stored as datetime in database
+DATETIME_FORMAT = '%d/%m/%Y %H:%M:%S'
+
 # Image size
 ORIG_SIZE = (1440, 1440)
 NORM_SIZE = (480, 480)
 THUMB_SIZE = (240, 240)
 
+# Upload limits, request bodies are checked before they are read and images by their
+# header before they are decoded
+UPLOAD_MAX_SIZE = 32 * 1024 * 1024
+BATCH_UPLOAD_MAX_SIZE = 256 * 1024 * 1024
+IMAGE_MAX_PIXELS = 100 * 1000 * 1000
+
+# Data path
+DATA_DIR = 'data'
+DATA_PATH = os.path.join(BASE_PATH, DATA_DIR)
+
+# Layout of site image files, 'sharded' spreads images in directories named by hash
+# (IMAGE_STORAGE_LEVELS directories deep) and 'flat' keeps all images in one directory
+# Existing images are moved to the current layout with: python manage.py migrate_storage
+IMAGE_STORAGE = 'sharded'
+IMAGE_STORAGE_LEVELS = 2
+
+# Database file and pragmas set on each connection
+# WAL journal lets pages be read while admin pages write, busy_timeout (ms) waits for locks
+# cache_size is in KB when negative and mmap_size in bytes
+DATABASE_FILE = 'database.sqlite'
+DATABASE_PRAGMAS = (
+    ('journal_mode', 'wal'),
+    ('synchronous', 'normal'),
+    ('cache_size', -16000),
+    ('mmap_size', 64 * 1024 * 1024),
+    ('busy_timeout', 10000),
+)
+
+# Apply migrations of database on start of server and management commands, when False
+# migrations are applied with: python manage.py migrate
+DATABASE_AUTO_MIGRATE = True
+
+# Pool of database connections shared by server threads, 0 uses one connection per thread
+# The pool size must be at least the number of server threads, requests fail when it is full
+# Connections unused for DATABASE_POOL_TIMEOUT seconds are closed
+DATABASE_POOL_SIZE = 0
+DATABASE_POOL_TIMEOUT = 300
+
+# Uploaded images wait in upload path until their renditions are made by the image pool
+UPLOAD_PATH = os.path.join(DATA_PATH, 'upload')
+
+# Processes of image pool making renditions of uploaded images
+IMAGE_WORKERS = os.cpu_count() or 1
+
+# Max images sent in one batch upload
+BATCH_UPLOAD_MAX_FILES = 50
+
+# Cache of preset renditions, least recently used renditions are removed above max size (bytes)
+RENDITION_CACHE_PATH = os.path.join(DATA_PATH, 'rendition')
+RENDITION_CACHE_SIZE = 256 * 1024 * 1024
+
+# Shared versions path (cache invalidation between processes)
+VERSION_PATH = os.path.join(DATA_PATH, 'version')
+
+# Secret key file, the key is created on first run and signs csrf tokens of public pages
+SECRET_KEY_FILE = os.path.join(DATA_PATH, 'secret_key')
+
+# Max age of csrf tokens of public pages (seconds)
+CSRF_TOKEN_AGE = 86400
+
+# Rendered pages cache size (number of pages)
+PAGE_CACHE_SIZE = 128
+
 # Modules path
 MODULES_DIR = 'modules'
 MODULES_PATH = os.path.join(BASE_PATH, MODULES_DIR)
@@ -69,7 +160,23 @@ TEMPLATES_PATH = os.path.join(BASE_PATH, TEMPLATES_DIR)
 #         locale.setlocale(locale.LC_ALL, '')
 
 
-# SessionMiddleware opts
+# Session backend
+# 'sqlite': sessions in a SQLite database shared by all processes
+# 'memory': sessions in memory, only for servers with a single process
+# 'cookie': sessions signed in cookies of browser (small data only)
+# 'file': sessions in files of session.data_dir
+SESSION_BACKEND = 'sqlite'
+
+# Sessions expire after this time without access (seconds)
+SESSION_TIMEOUT = 86400
+
+# Interval between removals of expired sessions (seconds)
+SESSION_SWEEP_INTERVAL = 600
+
+# Session database of 'sqlite' backend
+SESSION_DATABASE = os.path.join(DATA_PATH, 'session.sqlite')
+
+# SessionMiddleware opts ('file' backend)
 session_opts = {
     'session.type': 'file',
     'session.cookie_expires': True,
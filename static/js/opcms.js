@@ -83,21 +83,61 @@ function defaultUploadFilesSubmit(formId, formData, resultId, showImgId, formSub
         var data = $.isFunction(formData) ? formData() : formData;
         var fileInputs = $("input[type='file']", $(this));
         defaultAjaxUploadFiles(formSubmitUrl, data, fileInputs, function(json) {
-            if (json.status) {
+            if (json.status && json.job_url) {
+                // Images are processed in background, image is shown when the job is done
                 results.removeClass("alert-success alert-danger").addClass("alert-success").html(json.info).show();
-                showImg.html(
-                    "<img src='" + json.thumbnail + "?timestamp=" + new Date().getTime() + "' class='img-thumbnail center-block' width='200' height='200'/>"
-                ).fadeIn(2500);
+                waitImageJob(json.job_url, function(job) {
+                    showUploadResult(results, showImg, job);
+                    showJobImage(job);
+                });
             } else {
-                results.removeClass("alert-success alert-danger").addClass("alert-danger").html(json.info).show();
+                showUploadResult(results, showImg, json);
             }
-            setTimeout( function() { results.fadeOut(1500); }, 1500 );
             callbackFunction(json);
         }, false);
         return false;
     });
 };
 
+function showUploadResult(results, showImg, json) {
+    if (json.status) {
+        results.removeClass("alert-success alert-danger").addClass("alert-success").html(json.info).show();
+        showImg.html(
+            "<img src='" + json.thumbnail + "' class='img-thumbnail center-block' width='200' height='200'/>"
+        ).fadeIn(2500);
+    } else {
+        results.removeClass("alert-success alert-danger").addClass("alert-danger").html(json.info).show();
+    }
+    setTimeout( function() { results.fadeOut(1500); }, 1500 );
+};
+
+function waitImageJob(url, callbackFunction) {
+    $.ajax({
+        url : url,
+        type : "GET",
+        dataType : "json",
+        cache : false,
+        timeout : 5000,
+        success : function(job, textStatus, jqXHR) {
+            if (job.status && (job.job_status == "pending")) {
+                setTimeout( function() { waitImageJob(url, callbackFunction); }, 1000 );
+            } else {
+                callbackFunction(job);
+            }
+        },
+        error : function(jqXHR, textStatus, errorThrown) {
+            callbackFunction({ status : false, info : "Erro de comunicação " + url });
+        }
+    });
+};
+
+function showJobImage(job) {
+    if (job.status) {
+        $("#id_" + job.record_type + "_img" + job.record_id).attr("src", job.thumbnail).show();
+        $("#id_" + job.record_type + "_processing" + job.record_id).hide();
+    }
+};
+
 function defaultClickSubmit(btnId, resultId, btnSubmitUrl, callbackFunction, showError, showConfirm, showConfirmName) {
     var results = $(resultId);
     $(btnId).bind( "click", function(event) {
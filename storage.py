@@ -0,0 +1,105 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+from hashlib import sha1
+import os
+import posixpath
+
+from settings import IMAGE_STORAGE, IMAGE_STORAGE_LEVELS
+
+
+__author__ = 'João Neto'
+
+
+"""
+Image storage
+Image names stored in database are paths relative to the site image path, so urls and
+files of images do not depend on the storage layout and old names keep working
+All renditions of an image are stored in the directory of its original image
+"""
+
+
+class FlatStorage(object):
+    """
+    All images of a site in the site image path
+    """
+
+    def get_image_dir(self, image_key):
+        """
+        :return Directory of images of image_key, relative to the site image path
+        """
+        return ''
+
+    def get_image_name(self, image_key, file_name):
+        """
+        :return Name of image file_name of image_key, stored in database and used in urls
+        """
+        return posixpath.join(self.get_image_dir(image_key), file_name)
+
+    def get_image_key(self, image_name):
+        """
+        :return Image key of original image name
+        """
+        return posixpath.splitext(posixpath.basename(image_name))[0]
+
+    def make_image_dir(self, img_path, image_name):
+        """
+        Create directory of image_name in site image path
+        """
+        image_dir = os.path.dirname(os.path.join(img_path, image_name))
+        if not os.path.exists(image_dir):
+            os.makedirs(image_dir, exist_ok=True)
+
+    def remove_image_dir(self, img_path, image_name):
+        """
+        Remove directory of image_name and its parents up to site image path when they are empty
+        """
+        img_path = os.path.abspath(img_path)
+        image_dir = os.path.dirname(os.path.abspath(os.path.join(img_path, image_name)))
+        while image_dir.startswith(img_path + os.sep):
+            try:
+                os.rmdir(image_dir)
+            except OSError:
+                # Not empty or already removed
+                break
+            image_dir = os.path.dirname(image_dir)
+
+    def get_image_file(self, img_path, image_name):
+        """
+        :return Path of image_name in site image path or None if image_name is outside of it
+        """
+        img_path = os.path.abspath(img_path)
+        image_file = os.path.abspath(os.path.join(img_path, image_name.strip('/\\')))
+        if not image_file.startswith(img_path + os.sep):
+            return None
+        return image_file
+
+
+class ShardedStorage(FlatStorage):
+    """
+    Images of a site spread in directories named by the hash of their key, for example
+    3f/a2/portfolio12_0e77a2f63bd84507.jpg, so no directory holds too many files
+    """
+
+    def __init__(self, levels):
+        self.levels = levels
+
+    def get_image_dir(self, image_key):
+        digest = sha1(image_key.encode()).hexdigest()
+        return '/'.join(digest[level * 2:level * 2 + 2] for level in range(self.levels))
+
+
+def get_image_storage(storage_name):
+    """
+    :return Image storage of IMAGE_STORAGE setting
+    """
+    if storage_name == 'flat':
+        return FlatStorage()
+    elif storage_name == 'sharded':
+        return ShardedStorage(IMAGE_STORAGE_LEVELS)
+    raise ValueError('Image storage %s not supported' % storage_name)
+
+
+image_storage = get_image_storage(IMAGE_STORAGE)
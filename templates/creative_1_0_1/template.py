@@ -10,6 +10,11 @@ link = 'http://startbootstrap.com/template-overviews/creative/'
 file_name = 'template.html'
 original_file_name = 'index.html'
 
+# Renditions of portfolio images shown by template (size, crop mode and JPEG quality)
+renditions = {
+    'tile': dict(size=(650, 350), crop=True, quality=85),
+}
+
 # Template dirs and paths (default implementation)
 base_path = os.path.abspath(os.path.dirname(__file__))
 file_path = os.path.join(base_path, file_name)
@@ -11,6 +11,11 @@ link = 'http://startbootstrap.com/template-overviews/freelancer/'
 file_name = 'template.html'
 original_file_name = 'index.html'
 
+# Renditions of portfolio images shown by template (size, crop mode and JPEG quality)
+renditions = {
+    'tile': dict(size=(720, 520), crop=True, quality=85),
+}
+
 # Template dirs and paths (default implementation)
 base_path = os.path.abspath(os.path.dirname(__file__))
 file_path = os.path.join(base_path, file_name)
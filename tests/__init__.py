@@ -0,0 +1,35 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+import atexit
+import os
+import shutil
+import tempfile
+
+import settings
+
+
+__author__ = 'João Neto'
+
+
+"""
+Tests of opcms
+Tests run on a temporary database, data and image paths, this package changes
+the settings before the modules of opcms are imported
+Run with: python -m pytest tests
+"""
+TEST_PATH = tempfile.mkdtemp(prefix='opcms-tests-')
+atexit.register(shutil.rmtree, TEST_PATH, True)
+
+settings.DATABASE_FILE = os.path.join(TEST_PATH, 'database.sqlite')
+settings.IMAGE_PATH = os.path.join(TEST_PATH, 'img')
+settings.DATA_PATH = os.path.join(TEST_PATH, 'data')
+settings.UPLOAD_PATH = os.path.join(settings.DATA_PATH, 'upload')
+settings.VERSION_PATH = os.path.join(settings.DATA_PATH, 'version')
+settings.SECRET_KEY_FILE = os.path.join(settings.DATA_PATH, 'secret_key')
+settings.SESSION_DATABASE = os.path.join(settings.DATA_PATH, 'session.sqlite')
+settings.session_opts['session.data_dir'] = os.path.join(settings.DATA_PATH, 'session')
+settings.IMAGE_WORKERS = 2
+settings.RENDITION_CACHE_PATH = os.path.join(settings.DATA_PATH, 'rendition')
@@ -0,0 +1,250 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+from http.cookies import SimpleCookie
+from io import BytesIO
+import json
+import logging
+import re
+import time
+from urllib.parse import urlencode, urlsplit
+import uuid
+from wsgiref.headers import Headers
+from wsgiref.util import setup_testing_defaults
+
+from PIL import Image
+
+from settings import MAIN_EMAIL, MAIN_PASSWORD, MODULES_PATH, TEMPLATES_PATH
+
+
+__author__ = 'João Neto'
+
+
+"""
+Test support
+Client of the opcms WSGI app with cookies and login, helpers creating records and logging the queries of peewee
+"""
+opcms_app = None
+
+
+def get_app():
+    """
+    :return opcms WSGI app, created once for all tests
+    """
+    global opcms_app
+    if opcms_app is None:
+        import opcms
+        opcms_app = opcms.get_opcms_app(MODULES_PATH, TEMPLATES_PATH)
+    return opcms_app
+
+
+def get_main_site():
+    """
+    :return Main site, created by opcms
+    """
+    get_app()
+    from models import Site
+    return Site.get(Site.id == 1)
+
+
+def create_portfolio(site=None, **fields):
+    """
+    :return Portfolio created in database with image names not used by other records
+    Its image files do not exist, so it is not ready
+    """
+    from models import Portfolio
+    site = site or get_main_site()
+    image_key = uuid.uuid4().hex
+    fields.setdefault('ready', False)
+    fields.setdefault('position', Portfolio.get_next_position(site.portfolios))
+    return Portfolio.create(site=site, original_image='%s.jpg' % image_key,
+                            normalized_image='%s_norm.jpg' % image_key, thumbnail_image='%s_thumb.jpg' % image_key,
+                            **fields)
+
+
+def create_picture(portfolio, **fields):
+    """
+    :return Picture of portfolio created in database with image names not used by other records
+    Its image files do not exist, so it is not ready
+    """
+    from models import Picture
+    image_key = uuid.uuid4().hex
+    fields.setdefault('ready', False)
+    fields.setdefault('position', Picture.get_next_position(portfolio.pictures))
+    return Picture.create(site=portfolio.site, portfolio=portfolio, original_image='%s.jpg' % image_key,
+                          normalized_image='%s_norm.jpg' % image_key, thumbnail_image='%s_thumb.jpg' % image_key,
+                          **fields)
+
+
+def make_jpeg(size=(1600, 1200), color=(10, 120, 200), **options):
+    """
+    :return JPEG bytes of image with size and color
+    """
+    data = BytesIO()
+    Image.new('RGB', size, color).save(data, 'JPEG', **options)
+    return data.getvalue()
+
+
+class QueryLog(logging.Handler):
+    """
+    Queries done by peewee in with block
+    """
+
+    def __init__(self):
+        super(QueryLog, self).__init__(logging.DEBUG)
+        self.queries = []
+        self.logger = logging.getLogger('peewee')
+        self.logger_level = self.logger.level
+
+    def emit(self, record):
+        self.queries.append(record.msg[0])
+
+    def __enter__(self):
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.logger.removeHandler(self)
+        self.logger.setLevel(self.logger_level)
+
+
+class Response(object):
+    """
+    Response of client, names of headers are case insensitive
+    """
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.status_code = int(status.split()[0])
+        self.headers = Headers(list(headers))
+        self.body = body
+
+    @property
+    def text(self):
+        return self.body.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class Client(object):
+    """
+    Client calling the WSGI app with the cookies of previous responses
+    """
+
+    def __init__(self, app=None, host='localhost'):
+        self.app = app or get_app()
+        self.host = host
+        self.cookies = SimpleCookie()
+
+    def request(self, method, url, body=b'', content_type=None, headers=None):
+        """
+        :return Response of request
+        """
+        url_parts = urlsplit(url)
+        environ = {'REQUEST_METHOD': method, 'PATH_INFO': url_parts.path, 'QUERY_STRING': url_parts.query,
+                   'HTTP_HOST': self.host, 'SERVER_NAME': self.host, 'wsgi.input': BytesIO(body)}
+        if body or (method == 'POST'):
+            environ['CONTENT_LENGTH'] = str(len(body))
+        if content_type:
+            environ['CONTENT_TYPE'] = content_type
+        if self.cookies:
+            environ['HTTP_COOKIE'] = '; '.join('%s=%s' % (name, morsel.value) for name, morsel in self.cookies.items())
+        for name, value in (headers or {}).items():
+            key = name.upper().replace('-', '_')
+            if key not in ('CONTENT_LENGTH', 'CONTENT_TYPE'):
+                key = 'HTTP_' + key
+            if value is None:
+                environ.pop(key, None)
+            else:
+                environ[key] = value
+        setup_testing_defaults(environ)
+
+        response = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = response_headers
+
+        result = self.app(environ, start_response)
+        try:
+            body = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        for name, value in response['headers']:
+            if name.lower() == 'set-cookie':
+                self.cookies.load(value)
+        return Response(response['status'], response['headers'], body)
+
+    def get(self, url, headers=None):
+        return self.request('GET', url, headers=headers)
+
+    def post(self, url, data=None, files=(), headers=None):
+        """
+        :return Response of post of data, files are (name, file_name, content) sent as multipart
+        """
+        data = data or {}
+        if not files:
+            body = urlencode(data).encode('utf-8')
+            return self.request('POST', url, body, 'application/x-www-form-urlencoded', headers)
+        boundary = uuid.uuid4().hex
+        parts = []
+        for name, value in data.items():
+            parts.append(('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' %
+                          (boundary, name, value)).encode('utf-8'))
+        for name, file_name, content in files:
+            parts.append(('--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                          'Content-Type: image/jpeg\r\n\r\n' % (boundary, name, file_name)).encode('utf-8'))
+            parts.append(content + b'\r\n')
+        parts.append(('--%s--\r\n' % boundary).encode('utf-8'))
+        return self.request('POST', url, b''.join(parts), 'multipart/form-data; boundary=%s' % boundary, headers)
+
+    def login(self, email=MAIN_EMAIL, password=MAIN_PASSWORD):
+        """
+        Login in admin pages
+        :return Response of login
+        """
+        page = self.get('/login/')
+        csrf = re.search(r'name="csrf" value="([^"]+)"', page.text).group(1)
+        return self.post('/login/', dict(csrf=csrf, email=email, password=password, redirect_url='/'))
+
+    def get_csrf(self, url):
+        """
+        :return csrf token of admin page
+        """
+        return re.search(r'"csrf" : "([^"]+)"', self.get(url).text).group(1)
+
+    def add_portfolio(self, upload=None, title='Portfólio', csrf=None, headers=None):
+        """
+        Add portfolio with upload JPEG bytes
+        :return Response of portfolio add
+        """
+        csrf = csrf or self.get_csrf('/portfolios/admin/')
+        data = dict(site='1', user='1', title=title, description=title, csrf=csrf)
+        return self.post('/portfolio/add/', data, [('upload', 'upload.jpg', upload or make_jpeg())], headers)
+
+    def add_picture(self, portfolio, upload=None, title='Imagem', csrf=None, headers=None):
+        """
+        Add picture to portfolio with upload JPEG bytes
+        :return Response of picture add
+        """
+        csrf = csrf or self.get_csrf('/pictures/admin/1/1/%d/' % portfolio.get_id())
+        data = dict(site='1', user='1', portfolio=str(portfolio.get_id()), title=title, description=title, csrf=csrf)
+        return self.post('/picture/add/', data, [('upload', 'upload.jpg', upload or make_jpeg())], headers)
+
+    def wait_job(self, response_json, timeout=30):
+        """
+        Wait the image job of response
+        :return Job status response
+        """
+        job_url = urlsplit(response_json['job_url']).path
+        start = time.time()
+        while True:
+            job = self.get(job_url).json()
+            if (job.get('job_status') != 'pending') or (time.time() - start > timeout):
+                return job
+            time.sleep(0.05)
@@ -0,0 +1,189 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+from io import BytesIO
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from PIL import Image
+
+from tests.support import Client, QueryLog, get_main_site, make_jpeg
+
+
+__author__ = 'João Neto'
+
+
+STATIC_FILE = '/static/css/bootstrap-theme.min.css'
+
+
+class AssetAppTest(unittest.TestCase):
+    """
+    Asset files served without session and database queries
+    """
+
+    def test_static_file_without_session_and_queries(self):
+        client = Client()
+        client.login()
+        client.get(STATIC_FILE)
+        with QueryLog() as query_log:
+            response = client.get(STATIC_FILE)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.body)
+        self.assertNotIn('Set-Cookie', response.headers)
+        self.assertEqual(query_log.queries, [])
+
+    def test_unknown_asset_is_not_found(self):
+        self.assertEqual(Client().get('/static/css/desconhecido.css').status_code, 404)
+
+
+class ConditionalGetTest(unittest.TestCase):
+    """
+    Unchanged files answered with 304 to conditional requests
+    """
+
+    def setUp(self):
+        self.client = Client()
+        self.response = self.client.get(STATIC_FILE)
+        self.etag = self.response.headers['ETag']
+
+    def test_validators_are_sent(self):
+        self.assertRegex(self.etag, r'^"[0-9a-f]+-[0-9a-f]+"$')
+        self.assertIn('Last-Modified', self.response.headers)
+        self.assertEqual(self.response.headers['Cache-Control'], 'public, max-age=86400')
+
+    def test_matching_etag(self):
+        for if_none_match in (self.etag, 'W/%s' % self.etag, '"outra", %s' % self.etag, '*'):
+            response = self.client.get(STATIC_FILE, headers={'If-None-Match': if_none_match})
+            self.assertEqual(response.status_code, 304, if_none_match)
+            self.assertEqual(response.body, b'')
+            self.assertEqual(response.headers['ETag'], self.etag)
+
+    def test_changed_etag(self):
+        # If-None-Match has precedence over If-Modified-Since
+        headers = {'If-None-Match': '"outra"', 'If-Modified-Since': self.response.headers['Last-Modified']}
+        response = self.client.get(STATIC_FILE, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.body, self.response.body)
+
+    def test_not_modified_since(self):
+        response = self.client.get(STATIC_FILE, headers={'If-Modified-Since': self.response.headers['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+
+
+class ImageFileTest(unittest.TestCase):
+    """
+    Images with versioned names cached as immutable
+    """
+
+    def setUp(self):
+        from settings import IMAGE_PATH
+        img_path = get_main_site().get_image_path(IMAGE_PATH)
+        self.image_name = 'ab/cd/teste1_0123456789abcdef.jpg'
+        image_file = os.path.join(img_path, self.image_name)
+        os.makedirs(os.path.dirname(image_file), exist_ok=True)
+        with open(image_file, 'wb') as f:
+            f.write(make_jpeg((32, 32)))
+        self.addCleanup(os.remove, image_file)
+
+    def test_image_is_immutable(self):
+        response = Client().get('/img/%s' % self.image_name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Type'], 'image/jpeg')
+        self.assertEqual(response.headers['Cache-Control'], 'public, max-age=31536000, immutable')
+
+    def test_files_outside_image_path_are_refused(self):
+        self.assertEqual(Client().get('/img/ab/../../../data/secret_key').status_code, 403)
+
+
+class ImagePresetTest(unittest.TestCase):
+    """
+    Renditions of image size presets made on first request and served from rendition cache
+    """
+
+    def setUp(self):
+        from settings import IMAGE_PATH
+        img_path = get_main_site().get_image_path(IMAGE_PATH)
+        self.image_name = 'ef/01/teste2_0123456789abcdef.jpg'
+        image_file = os.path.join(img_path, self.image_name)
+        os.makedirs(os.path.dirname(image_file), exist_ok=True)
+        with open(image_file, 'wb') as f:
+            f.write(make_jpeg((1600, 1200)))
+        self.addCleanup(os.remove, image_file)
+
+    def test_rendition_is_cached(self):
+        from assets import rendition_cache
+        rendition_name = os.path.join('site1', '360x360', self.image_name)
+        self.assertIsNone(rendition_cache.get(rendition_name))
+
+        # Cache miss makes the rendition
+        response = Client().get('/img/360x360/%s' % self.image_name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Type'], 'image/jpeg')
+        self.assertEqual(response.headers['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(Image.open(BytesIO(response.body)).size, (360, 270))
+        rendition_file = rendition_cache.get(rendition_name)
+        self.assertIsNotNone(rendition_file)
+
+        # Cache hit serves the same file
+        mtime = os.stat(rendition_file).st_mtime_ns
+        response = Client().get('/img/360x360/%s' % self.image_name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(os.stat(rendition_file).st_mtime_ns, mtime)
+
+    def test_sizes_not_in_presets_are_refused(self):
+        from assets import rendition_cache
+        response = Client().get('/img/361x361/%s' % self.image_name)
+        self.assertEqual(response.status_code, 404)
+        self.assertIsNone(rendition_cache.get(os.path.join('site1', '361x361', self.image_name)))
+
+    def test_missing_image_is_not_found(self):
+        self.assertEqual(Client().get('/img/720x720/ef/01/desconhecida.jpg').status_code, 404)
+
+
+class FileCacheTest(unittest.TestCase):
+    """
+    Least recently used files removed when the file cache is full
+    """
+
+    def setUp(self):
+        from cache import FileCache
+        self.cache_path = tempfile.mkdtemp(prefix='opcms-file-cache-')
+        self.addCleanup(shutil.rmtree, self.cache_path, True)
+        self.cache = FileCache(self.cache_path, 3500)
+
+    def set(self, file_name, atime):
+        """
+        Cache file of 1000 bytes used at atime
+        """
+        def write_function(temp_file):
+            with open(temp_file, 'wb') as f:
+                f.write(b'0' * 1000)
+        file_path = self.cache.set(file_name, write_function)
+        os.utime(file_path, ns=(atime, os.stat(file_path).st_mtime_ns))
+
+    def test_miss_and_hit(self):
+        self.assertIsNone(self.cache.get('a/1.jpg'))
+        self.set('a/1.jpg', int(time.time() * 1e9))
+        self.assertEqual(self.cache.get('a/1.jpg'), os.path.join(self.cache_path, 'a', '1.jpg'))
+
+    def test_least_recently_used_are_evicted(self):
+        now = int(time.time() * 1e9)
+        self.set('a/1.jpg', now - 40 * 10 ** 9)
+        self.set('a/2.jpg', now - 30 * 10 ** 9)
+        self.set('b/3.jpg', now - 20 * 10 ** 9)
+
+        # Use of the oldest file is marked, so the second one is evicted
+        old_atime = now - 300 * 10 ** 9
+        os.utime(os.path.join(self.cache_path, 'a', '1.jpg'), ns=(old_atime, old_atime))
+        self.cache.get('a/1.jpg')
+        self.set('b/4.jpg', now)
+        self.assertIsNotNone(self.cache.get('a/1.jpg'))
+        self.assertIsNone(self.cache.get('a/2.jpg'))
+        self.assertIsNotNone(self.cache.get('b/3.jpg'))
+        self.assertIsNotNone(self.cache.get('b/4.jpg'))
+        self.assertEqual(self.cache.size, 3000)
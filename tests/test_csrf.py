@@ -0,0 +1,64 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+import re
+import time
+import unittest
+from unittest import mock
+
+from tests.support import Client, get_main_site
+
+
+__author__ = 'João Neto'
+
+
+class StatelessCsrfTest(unittest.TestCase):
+    """
+    Anonymous pages with signed csrf tokens and no session
+    """
+
+    def setUp(self):
+        self.site_id = get_main_site().get_id()
+
+    def get_page_csrf(self, response):
+        return re.search(r'name="csrf" value="([^"]+)"', response.text).group(1)
+
+    def test_anonymous_page_has_no_session(self):
+        response = Client().get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Set-Cookie', response.headers)
+
+    def test_cached_page_has_new_token(self):
+        client = Client()
+        first_csrf = self.get_page_csrf(client.get('/'))
+        second_csrf = self.get_page_csrf(client.get('/'))
+        self.assertNotEqual(first_csrf, second_csrf)
+        from decorators import verify_stateless_csrf
+        self.assertTrue(verify_stateless_csrf(second_csrf, 'csrf_index', self.site_id))
+
+    def test_token_is_verified(self):
+        from decorators import make_stateless_csrf, verify_stateless_csrf
+        csrf = make_stateless_csrf('csrf_index', self.site_id)
+        self.assertTrue(verify_stateless_csrf(csrf, 'csrf_index', self.site_id))
+        self.assertFalse(verify_stateless_csrf(csrf, 'csrf_other', self.site_id))
+        self.assertFalse(verify_stateless_csrf(csrf, 'csrf_index', self.site_id + 1))
+        timestamp, nonce, signature = csrf.split('.')
+        self.assertFalse(verify_stateless_csrf('%d.%s.%s' % (int(timestamp) + 1, nonce, signature), 'csrf_index',
+                                               self.site_id))
+        for invalid_csrf in ('', 'csrf', '1.2', 'a.b.c'):
+            self.assertFalse(verify_stateless_csrf(invalid_csrf, 'csrf_index', self.site_id))
+
+    def test_expired_token_is_refused(self):
+        from decorators import make_stateless_csrf, verify_stateless_csrf
+        from settings import CSRF_TOKEN_AGE
+        with mock.patch('time.time', return_value=time.time() - CSRF_TOKEN_AGE - 60):
+            csrf = make_stateless_csrf('csrf_index', self.site_id)
+        self.assertFalse(verify_stateless_csrf(csrf, 'csrf_index', self.site_id))
+
+    def test_post_with_invalid_token_is_refused(self):
+        data = dict(csrf='0.0.0', site_id=str(self.site_id), name='Nome', email='nome@exemplo.com.br',
+                    subject='Assunto', message='Mensagem')
+        response = Client().post('/contact/', data).json()
+        self.assertFalse(response['status'])
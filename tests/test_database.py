@@ -0,0 +1,95 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+import sqlite3
+import unittest
+
+from tests.support import Client, create_portfolio, get_main_site
+
+
+__author__ = 'João Neto'
+
+
+class CommitCallbacksTest(unittest.TestCase):
+    """
+    Shared versions bumped after the commit of the transaction changing the content
+    """
+
+    def setUp(self):
+        get_main_site()
+
+    def get_title_seen_by_other_connection(self, portfolio):
+        from settings import DATABASE_FILE
+        conn = sqlite3.connect(DATABASE_FILE)
+        try:
+            return conn.execute('SELECT title FROM portfolio WHERE id = ?', (portfolio.get_id(),)).fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_version_is_bumped_after_commit(self):
+        from cache import content_version
+        from database import db
+        portfolio = create_portfolio(title='Antes')
+        titles_seen = []
+        version = content_version.get()
+        with db.atomic():
+            portfolio.title = 'Depois'
+            portfolio.save()
+            db.after_commit(lambda: titles_seen.append(self.get_title_seen_by_other_connection(portfolio)))
+            with db.atomic():
+                # Nested transaction of Picture.delete_all in Portfolio.delete_all
+                portfolio.save()
+            self.assertEqual(content_version.get(), version)
+        self.assertNotEqual(content_version.get(), version)
+        self.assertEqual(titles_seen, ['Depois'])
+
+    def test_version_is_not_bumped_on_rollback(self):
+        from cache import content_version
+        from database import db
+        portfolio = create_portfolio()
+        version = content_version.get()
+        with self.assertRaises(ValueError):
+            with db.atomic():
+                portfolio.save()
+                raise ValueError('rollback')
+        self.assertEqual(content_version.get(), version)
+        db.after_commit(content_version.bump)
+        self.assertNotEqual(content_version.get(), version)
+
+
+class ConnectionTest(unittest.TestCase):
+    """
+    Connections configured by DATABASE_PRAGMAS and closed at the end of requests
+    """
+
+    def setUp(self):
+        get_main_site()
+
+    def test_pragmas(self):
+        from database import db
+        from settings import DATABASE_PRAGMAS
+        for name, value in DATABASE_PRAGMAS:
+            result = db.execute_sql('PRAGMA %s' % name).fetchone()[0]
+            if name == 'journal_mode':
+                self.assertEqual(result, value)
+            elif isinstance(value, int):
+                self.assertEqual(result, value, name)
+
+    def test_transactions_take_write_lock(self):
+        from database import db
+        from settings import DATABASE_FILE
+        conn = sqlite3.connect(DATABASE_FILE, timeout=0)
+        try:
+            with db.atomic():
+                with self.assertRaises(sqlite3.OperationalError):
+                    conn.execute('BEGIN IMMEDIATE')
+        finally:
+            conn.close()
+
+    def test_connection_is_closed_after_request(self):
+        from database import db
+        db.get_conn()
+        self.assertEqual(Client().get('/').status_code, 200)
+        self.assertTrue(db.is_closed())
@@ -0,0 +1,113 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+from io import BytesIO
+import os
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image
+
+from settings import ORIG_SIZE, NORM_SIZE, THUMB_SIZE
+from tests.support import make_jpeg
+from utils import get_image_version, get_versioned_image_key, regenerate_image_profiles, save_image_renditions, \
+    write_atomic
+
+
+__author__ = 'João Neto'
+
+
+class ImageTestCase(unittest.TestCase):
+    """
+    Test case with a temporary image path
+    """
+
+    def setUp(self):
+        self.img_path = tempfile.mkdtemp(prefix='opcms-images-')
+        self.addCleanup(shutil.rmtree, self.img_path, True)
+
+    def get_renditions(self):
+        return [(os.path.join(self.img_path, 'image.jpg'), ORIG_SIZE),
+                (os.path.join(self.img_path, 'image_norm.jpg'), NORM_SIZE),
+                (os.path.join(self.img_path, 'image_thumb.jpg'), THUMB_SIZE)]
+
+    def get_size(self, image_file):
+        with open(image_file, 'rb') as f:
+            return Image.open(f).size
+
+
+class RenditionsTest(ImageTestCase):
+    """
+    Renditions made from a single decode
+    """
+
+    def test_large_upload_is_drafted_once(self):
+        # thumbnail() drafting again the drafted image crashed Pillow 3.3 with uploads of 3000x2000 or larger
+        im = Image.open(BytesIO(make_jpeg((4000, 3000))))
+        image_sizes = save_image_renditions(im, self.get_renditions(), webp=False)
+        self.assertEqual([image_size[:2] for image_size in image_sizes], [(1440, 1080), (480, 360), (240, 180)])
+        for (rendition_file, rendition_size), image_size in zip(self.get_renditions(), image_sizes):
+            self.assertEqual(self.get_size(rendition_file), image_size[:2])
+            self.assertEqual(os.path.getsize(rendition_file), image_size[2])
+
+    def test_profiles_are_made_from_largest_rendition(self):
+        profiles = [(os.path.join(self.img_path, 'image_tile.jpg'), (720, 520), True, 85),
+                    (os.path.join(self.img_path, 'image_wide.jpg'), (1000, 1000), False, 85)]
+        im = Image.open(BytesIO(make_jpeg((4000, 3000))))
+        save_image_renditions(im, self.get_renditions(), profiles, webp=False)
+        self.assertEqual(self.get_size(profiles[0][0]), (720, 520))
+        self.assertEqual(self.get_size(profiles[1][0]), (1000, 750))
+
+    def test_regenerated_profiles_of_large_image(self):
+        image_file = os.path.join(self.img_path, 'large.jpg')
+        with open(image_file, 'wb') as f:
+            f.write(make_jpeg((4000, 3000)))
+        profiles = [(os.path.join(self.img_path, 'large_norm.jpg'), NORM_SIZE, False, None),
+                    (os.path.join(self.img_path, 'large_tile.jpg'), (720, 520), True, 85)]
+        self.assertEqual(regenerate_image_profiles(image_file, profiles), 2)
+        self.assertEqual(self.get_size(profiles[0][0]), (480, 360))
+        self.assertEqual(self.get_size(profiles[1][0]), (720, 520))
+
+
+class WriteAtomicTest(ImageTestCase):
+    """
+    Files replaced only when completely written
+    """
+
+    def write(self, content):
+        def write_function(temp_file):
+            with open(temp_file, 'w') as f:
+                f.write(content)
+        return write_function
+
+    def fail(self, temp_file):
+        with open(temp_file, 'w') as f:
+            f.write('metade')
+        raise IOError('disk full')
+
+    def test_file_is_replaced(self):
+        file_path = os.path.join(self.img_path, 'file.txt')
+        write_atomic(file_path, self.write('primeiro'))
+        write_atomic(file_path, self.write('segundo'))
+        with open(file_path) as f:
+            self.assertEqual(f.read(), 'segundo')
+        self.assertEqual(os.listdir(self.img_path), ['file.txt'])
+
+    def test_failed_write_keeps_file(self):
+        file_path = os.path.join(self.img_path, 'file.txt')
+        write_atomic(file_path, self.write('primeiro'))
+        with self.assertRaises(IOError):
+            write_atomic(file_path, self.fail)
+        with open(file_path) as f:
+            self.assertEqual(f.read(), 'primeiro')
+        self.assertEqual(os.listdir(self.img_path), ['file.txt'])
+
+    def test_image_names_are_unique(self):
+        versions = set(get_image_version() for index in range(1000))
+        self.assertEqual(len(versions), 1000)
+        image_key = get_versioned_image_key('portfolio1_0123456789abcdef')
+        self.assertRegex(image_key, r'^portfolio1_[0-9a-f]{16}$')
+        self.assertNotEqual(image_key, 'portfolio1_0123456789abcdef')
@@ -0,0 +1,127 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+import os
+import unittest
+from unittest import mock
+
+from tests.support import Client, create_portfolio, create_picture, get_main_site
+
+
+__author__ = 'João Neto'
+
+
+class ImageJobTest(unittest.TestCase):
+    """
+    Images made by jobs of image pool
+    """
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login()
+        self.portfolio = create_portfolio()
+
+    def get_upload_files(self):
+        from settings import UPLOAD_PATH
+        return os.listdir(UPLOAD_PATH) if os.path.exists(UPLOAD_PATH) else []
+
+    def test_job_marks_picture_ready(self):
+        from models import Picture
+        from settings import IMAGE_PATH
+        response = self.client.add_picture(self.portfolio).json()
+        self.assertTrue(response['status'])
+        self.assertFalse(Picture.get(Picture.id == response['picture_id']).ready)
+
+        job = self.client.wait_job(response)
+        self.assertEqual(job['job_status'], 'done')
+        picture = Picture.get(Picture.id == response['picture_id'])
+        self.assertTrue(picture.ready)
+        self.assertEqual(picture.get_image_size('original'), (1440, 1080))
+        img_path = get_main_site().get_image_path(IMAGE_PATH)
+        for image_name in (picture.original_image, picture.normalized_image, picture.thumbnail_image):
+            self.assertTrue(os.path.exists(os.path.join(img_path, image_name)))
+        self.assertEqual(self.get_upload_files(), [])
+
+    def test_broken_pool_is_replaced(self):
+        import jobs
+        from models import Picture
+        broken_future = jobs.get_image_pool().submit(os._exit, 1)
+        self.assertIsInstance(broken_future.exception(timeout=30), BrokenProcessPool)
+
+        response = self.client.add_picture(self.portfolio).json()
+        self.assertTrue(response['status'])
+        self.assertEqual(self.client.wait_job(response)['job_status'], 'done')
+        self.assertTrue(Picture.get(Picture.id == response['picture_id']).ready)
+
+    def test_failed_submit_leaves_nothing_behind(self):
+        from models import Job, Picture
+        pictures = Picture.select().count()
+        with mock.patch('jobs.submit_to_image_pool', side_effect=BrokenProcessPool('broken')):
+            response = self.client.add_picture(self.portfolio).json()
+        self.assertFalse(response['status'])
+        self.assertEqual(Picture.select().count(), pictures)
+        self.assertEqual(Job.select().order_by(Job.id.desc()).get().status, 'failed')
+        self.assertEqual(self.get_upload_files(), [])
+
+    def test_job_does_not_change_record_reusing_id(self):
+        import jobs
+        from models import Job, Picture
+        from settings import IMAGE_PATH
+        img_path = get_main_site().get_image_path(IMAGE_PATH)
+        picture = create_picture(self.portfolio)
+        upload_response = dict(original_filename='job.jpg', normalized_filename='job_norm.jpg',
+                               thumbnail_filename='job_thumb.jpg', upload_file=os.path.join(img_path, 'job.upload'))
+        for image_name in ('job.jpg', 'job_norm.jpg', 'job_thumb.jpg'):
+            open(os.path.join(img_path, image_name), 'wb').close()
+        job = Job.create(site=get_main_site(), record_type='picture', record_id=picture.get_id())
+        future = Future()
+        future.set_result([(1440, 1080, 1), (480, 360, 1), (240, 180, 1)])
+
+        # Job of a deleted record with the same id as picture
+        jobs.finish_image_job(job.get_id(), Picture, picture.get_id(), 'deleted.jpg', upload_response, img_path,
+                              False, False, future)
+        self.assertEqual(Job.get(Job.id == job.get_id()).status, 'failed')
+        picture = Picture.get(Picture.id == picture.get_id())
+        self.assertFalse(picture.ready)
+        self.assertNotEqual(picture.original_image, 'job.jpg')
+        self.assertFalse(os.path.exists(os.path.join(img_path, 'job.jpg')))
+
+    def test_edit_keeps_images_of_job_done_meanwhile(self):
+        import jobs
+        from models import Job, Picture
+        from settings import IMAGE_PATH
+        img_path = get_main_site().get_image_path(IMAGE_PATH)
+        picture = create_picture(self.portfolio)
+        upload_response = dict(original_filename='edit.jpg', normalized_filename='edit_norm.jpg',
+                               thumbnail_filename='edit_thumb.jpg', upload_file=os.path.join(img_path, 'edit.upload'))
+        job = Job.create(site=get_main_site(), record_type='picture', record_id=picture.get_id())
+        future = Future()
+        future.set_result([(1440, 1080, 1), (480, 360, 1), (240, 180, 1)])
+        # Images of job are not made, picture is not left ready for other tests
+        self.addCleanup(Picture.update(ready=False).where(Picture.id == picture.get_id()).execute)
+
+        # Job done after the edit loaded the picture and before it is saved
+        picture_save = Picture.save
+
+        def save(record, *args, **kwargs):
+            if Job.get(Job.id == job.get_id()).status != 'done':
+                jobs.finish_image_job(job.get_id(), Picture, picture.get_id(), picture.original_image,
+                                      upload_response, img_path, True, False, future)
+            picture_save(record, *args, **kwargs)
+
+        csrf = self.client.get_csrf('/pictures/admin/1/1/%d/' % self.portfolio.get_id())
+        data = dict(site='1', user='1', portfolio=str(self.portfolio.get_id()), picture=str(picture.get_id()),
+                    title='Editada', description='Editada', csrf=csrf)
+        with mock.patch.object(Picture, 'save', save):
+            response = self.client.post('/picture/update/', data).json()
+        self.assertTrue(response['status'])
+        self.assertEqual(Job.get(Job.id == job.get_id()).status, 'done')
+        picture = Picture.get(Picture.id == picture.get_id())
+        self.assertEqual(picture.title, 'Editada')
+        self.assertTrue(picture.ready)
+        self.assertEqual(picture.original_image, 'edit.jpg')
+        self.assertEqual(picture.get_image_size('original'), (1440, 1080))
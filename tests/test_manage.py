@@ -0,0 +1,151 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+from argparse import Namespace
+import os
+import unittest
+from unittest import mock
+
+from tests.support import Client, get_main_site
+from utils import get_webp_name
+
+
+__author__ = 'João Neto'
+
+
+class PortfolioImagesTestCase(unittest.TestCase):
+    """
+    Test case with the images of a new portfolio
+    """
+
+    def setUp(self):
+        from models import Portfolio
+        from settings import IMAGE_PATH
+        client = Client()
+        client.login()
+        response = client.add_portfolio().json()
+        self.assertEqual(client.wait_job(response)['job_status'], 'done')
+        self.portfolio = Portfolio.get(Portfolio.id == response['portfolio_id'])
+        self.img_path = get_main_site().get_image_path(IMAGE_PATH)
+
+
+class RegenerateRenditionsTest(PortfolioImagesTestCase):
+    """
+    Renditions made again with new image names
+    """
+
+    def get_image_names(self, portfolio):
+        from renditions import get_rendition_names
+        return ([portfolio.original_image, portfolio.normalized_image, portfolio.thumbnail_image] +
+                get_rendition_names(portfolio.original_image))
+
+    def regenerate(self, force):
+        import manage
+        from models import Portfolio
+        args = Namespace(site_id=get_main_site().get_id(), force=force, workers=1)
+        self.assertEqual(manage.regenerate_renditions(args), 0)
+        return Portfolio.get(Portfolio.id == self.portfolio.get_id())
+
+    def test_images_get_new_names(self):
+        old_names = self.get_image_names(self.portfolio)
+        portfolio = self.regenerate(force=True)
+        new_names = self.get_image_names(portfolio)
+        self.assertFalse(set(old_names) & set(new_names))
+        for old_name, new_name in zip(old_names, new_names):
+            self.assertFalse(os.path.exists(os.path.join(self.img_path, old_name)))
+            self.assertTrue(os.path.exists(os.path.join(self.img_path, new_name)))
+        self.assertEqual(portfolio.get_image_size('original'), self.portfolio.get_image_size('original'))
+        self.assertEqual(portfolio.get_image_size('thumbnail'), self.portfolio.get_image_size('thumbnail'))
+
+    def test_stale_rendition_is_made_with_new_names(self):
+        thumbnail_file = os.path.join(self.img_path, self.portfolio.thumbnail_image)
+        os.remove(thumbnail_file)
+        normalized_inode = os.stat(os.path.join(self.img_path, self.portfolio.normalized_image)).st_ino
+        portfolio = self.regenerate(force=False)
+        self.assertNotEqual(portfolio.original_image, self.portfolio.original_image)
+        self.assertTrue(os.path.exists(os.path.join(self.img_path, portfolio.thumbnail_image)))
+        # Up-to-date renditions are linked in the new names
+        self.assertEqual(os.stat(os.path.join(self.img_path, portfolio.normalized_image)).st_ino, normalized_inode)
+
+    def test_up_to_date_images_keep_their_names(self):
+        portfolio = self.regenerate(force=False)
+        self.assertEqual(self.get_image_names(portfolio), self.get_image_names(self.portfolio))
+
+
+class MigrateStorageTest(PortfolioImagesTestCase):
+    """
+    Images moved from flat to sharded storage
+    """
+
+    def setUp(self):
+        super().setUp()
+        from models import Portfolio
+        from renditions import get_rendition_names
+        # Move the images of portfolio to flat storage
+        self.sharded_names = [self.portfolio.original_image, self.portfolio.normalized_image,
+                              self.portfolio.thumbnail_image] + get_rendition_names(self.portfolio.original_image)
+        self.flat_names = [os.path.basename(image_name) for image_name in self.sharded_names]
+        for sharded_name, flat_name in zip(self.sharded_names, self.flat_names):
+            for image_name in (sharded_name, get_webp_name(sharded_name)):
+                if os.path.exists(os.path.join(self.img_path, image_name)):
+                    os.rename(os.path.join(self.img_path, image_name),
+                              os.path.join(self.img_path, os.path.basename(image_name)))
+        Portfolio.update(original_image=self.flat_names[0], normalized_image=self.flat_names[1],
+                         thumbnail_image=self.flat_names[2]).where(Portfolio.id == self.portfolio.get_id()).execute()
+
+    def migrate(self):
+        import manage
+        from models import Portfolio
+        self.assertEqual(manage.migrate_storage(Namespace(site_id=get_main_site().get_id())), 0)
+        return Portfolio.get(Portfolio.id == self.portfolio.get_id())
+
+    def test_images_are_moved(self):
+        portfolio = self.migrate()
+        self.assertEqual([portfolio.original_image, portfolio.normalized_image, portfolio.thumbnail_image],
+                         self.sharded_names[:3])
+        for sharded_name, flat_name in zip(self.sharded_names, self.flat_names):
+            self.assertTrue(os.path.exists(os.path.join(self.img_path, sharded_name)))
+            self.assertFalse(os.path.exists(os.path.join(self.img_path, flat_name)))
+
+    def test_images_replaced_meanwhile_are_kept(self):
+        import manage
+        from models import Portfolio
+
+        # Images of portfolio replaced while its files are linked, the replaced image does not exist
+        self.addCleanup(Portfolio.update(ready=False).where(Portfolio.id == self.portfolio.get_id()).execute)
+        def link_image(old_file, new_file):
+            Portfolio.update(original_image='substituida.jpg').where(Portfolio.id == self.portfolio.get_id()).execute()
+            link_image_function(old_file, new_file)
+
+        link_image_function = manage.link_image
+        with mock.patch('manage.link_image', link_image):
+            portfolio = self.migrate()
+        self.assertEqual(portfolio.original_image, 'substituida.jpg')
+        self.assertEqual(portfolio.normalized_image, self.flat_names[1])
+        for sharded_name, flat_name in zip(self.sharded_names, self.flat_names):
+            self.assertFalse(os.path.exists(os.path.join(self.img_path, sharded_name)))
+            self.assertTrue(os.path.exists(os.path.join(self.img_path, flat_name)))
+
+
+class BackfillImageSizesTest(PortfolioImagesTestCase):
+    """
+    Sizes of images read from their files
+    """
+
+    def test_unknown_sizes_are_read(self):
+        import manage
+        from models import Portfolio
+        sizes = dict((field_name, 0) for field_name in Portfolio.image_size_fields)
+        Portfolio.update(**sizes).where(Portfolio.id == self.portfolio.get_id()).execute()
+        portfolio = Portfolio.get(Portfolio.id == self.portfolio.get_id())
+        self.assertIsNone(portfolio.get_image_size('original'))
+
+        args = Namespace(site_id=get_main_site().get_id(), force=False)
+        self.assertEqual(manage.backfill_image_sizes(args), 0)
+        portfolio = Portfolio.get(Portfolio.id == self.portfolio.get_id())
+        for image_name in portfolio.image_names:
+            self.assertEqual(portfolio.get_image_size(image_name), self.portfolio.get_image_size(image_name))
+        self.assertEqual(portfolio.original_bytes,
+                         os.path.getsize(os.path.join(self.img_path, portfolio.original_image)))
@@ -0,0 +1,92 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+from datetime import datetime
+import unittest
+from unittest import mock
+
+from tests.support import create_portfolio, get_main_site
+
+
+__author__ = 'João Neto'
+
+
+class MigrationsTest(unittest.TestCase):
+    """
+    Schema migrations applied once in version order
+    """
+
+    def setUp(self):
+        get_main_site()
+
+    def test_all_migrations_are_applied(self):
+        from migrations import MIGRATIONS, get_applied_versions, run_migrations
+        versions = [version for version, name, function in MIGRATIONS]
+        self.assertEqual(versions, list(range(1, len(versions) + 1)))
+        self.assertTrue(set(versions) <= get_applied_versions())
+        self.assertEqual(run_migrations(), 0)
+
+    def test_new_migration_is_applied_once(self):
+        from migrations import MIGRATIONS, SchemaMigration, run_migrations
+        calls = []
+        migration = (MIGRATIONS[-1][0] + 1, 'Test', calls.append)
+        self.addCleanup(SchemaMigration.delete().where(SchemaMigration.version == migration[0]).execute)
+        with mock.patch('migrations.MIGRATIONS', MIGRATIONS + (migration,)):
+            self.assertEqual(run_migrations(), 1)
+            self.assertEqual(run_migrations(), 0)
+        self.assertEqual(len(calls), 1)
+
+    def test_failed_migration_is_rolled_back(self):
+        from migrations import MIGRATIONS, SchemaMigration, run_migrations
+        from models import Portfolio
+
+        def fail(migrator):
+            Portfolio.update(title='Migrado').execute()
+            raise ValueError('migration failed')
+
+        create_portfolio()
+        migration = (MIGRATIONS[-1][0] + 1, 'Test', fail)
+        with mock.patch('migrations.MIGRATIONS', MIGRATIONS + (migration,)):
+            with self.assertRaises(ValueError):
+                run_migrations()
+        self.assertFalse(SchemaMigration.select().where(SchemaMigration.version == migration[0]).exists())
+        self.assertFalse(Portfolio.select().where(Portfolio.title == 'Migrado').exists())
+
+    def test_indexes_of_models_exist(self):
+        from database import db
+        from models import Picture, Portfolio
+        for model in (Portfolio, Picture):
+            table = model._meta.db_table
+            index_names = [index.name for index in db.get_indexes(table)]
+            for fields, unique in model._meta.indexes:
+                columns = [model._meta.fields[field_name].db_column for field_name in fields]
+                self.assertIn(db.compiler().index_name(table, columns), index_names)
+
+    def test_indexes_by_ready_state_are_dropped(self):
+        from database import db
+        from migrations import add_positions
+        from models import Picture, Portfolio
+        for model in (Portfolio, Picture):
+            db.execute_sql('CREATE INDEX IF NOT EXISTS "{table}_site_id_ready" ON "{table}" ("site_id", "ready")'
+                           .format(table=model._meta.db_table))
+        with db.transaction():
+            add_positions(None)
+        for model in (Portfolio, Picture):
+            index_names = [index.name for index in db.get_indexes(model._meta.db_table)]
+            self.assertNotIn('%s_site_id_ready' % model._meta.db_table, index_names)
+            self.assertIn('%s_site_id_position_id' % model._meta.db_table, index_names)
+
+    def test_dates_are_converted(self):
+        from database import db
+        from migrations import convert_dates
+        from models import Portfolio
+        portfolio = create_portfolio()
+        db.execute_sql('UPDATE "portfolio" SET "created_date" = ? WHERE "id" = ?',
+                       ('25/12/2016 10:20:30', portfolio.get_id()))
+        with db.transaction():
+            convert_dates(None)
+        portfolio = Portfolio.get(Portfolio.id == portfolio.get_id())
+        self.assertEqual(portfolio.created_date, datetime(2016, 12, 25, 10, 20, 30))
+        self.assertEqual(Portfolio.select().order_by(Portfolio.created_date).get().get_id(), portfolio.get_id())
@@ -0,0 +1,65 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+import unittest
+
+from tests.support import QueryLog, create_picture, create_portfolio, get_main_site
+
+
+__author__ = 'João Neto'
+
+
+class ModelTestCase(unittest.TestCase):
+    """
+    Test case with the main site, records created by the test are deleted after it
+    """
+
+    def setUp(self):
+        self.site = get_main_site()
+
+    def create_portfolio(self, **fields):
+        portfolio = create_portfolio(self.site, **fields)
+        self.addCleanup(portfolio.delete_instance, recursive=True)
+        return portfolio
+
+    def create_picture(self, portfolio, **fields):
+        picture = create_picture(portfolio, **fields)
+        self.addCleanup(picture.delete_instance)
+        return picture
+
+
+class SitePortfoliosTest(ModelTestCase):
+    """
+    Portfolios of page loaded in a fixed number of queries
+    """
+
+    def test_pictures_are_loaded_in_one_query(self):
+        portfolios = [self.create_portfolio(ready=True, picture_count=2) for index in range(3)]
+        pictures = dict((portfolio.get_id(), [self.create_picture(portfolio, ready=True).get_id(),
+                                              self.create_picture(portfolio, ready=True).get_id()])
+                        for portfolio in portfolios)
+        self.create_picture(portfolios[0])
+
+        with QueryLog() as query_log:
+            page_portfolios = self.site.get_portfolios()
+            picture_ids = dict((portfolio.get_id(), [picture.get_id() for picture in portfolio.picture_list])
+                               for portfolio in page_portfolios if portfolio.get_id() in pictures)
+        self.assertEqual(picture_ids, pictures)
+        self.assertEqual(len(query_log.queries), 2)
+
+    def test_page_is_rendered_without_more_queries(self):
+        import opcms
+        portfolio = self.create_portfolio(ready=True, picture_count=1)
+        self.create_picture(portfolio, ready=True)
+        for template_name in [None] + sorted(opcms.templates_dict):
+            with QueryLog() as query_log:
+                opcms.render_page(self.site, 'http://localhost', template_name)
+            self.assertEqual(len(query_log.queries), 2, template_name)
+
+    def test_pictures_query_is_skipped_without_pictures(self):
+        self.create_portfolio(ready=True)
+        with QueryLog() as query_log:
+            self.site.get_portfolios()
+        self.assertEqual(len(query_log.queries), 1)
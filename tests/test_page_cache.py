@@ -0,0 +1,59 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+import unittest
+
+from tests.support import Client
+
+
+__author__ = 'João Neto'
+
+
+class PageCacheTest(unittest.TestCase):
+    """
+    Rendered pages cache
+    """
+
+    def test_least_recently_used_pages_are_evicted(self):
+        from cache import PageCache
+        page_cache = PageCache(2)
+        page_cache.set('a', 'page a')
+        page_cache.set('b', 'page b')
+        self.assertEqual(page_cache.get('a'), 'page a')
+        page_cache.set('c', 'page c')
+        self.assertIsNone(page_cache.get('b'))
+        self.assertEqual(page_cache.get('c'), 'page c')
+        self.assertEqual(page_cache.get_stats(), dict(size=2, max_size=2, hits=2, misses=1, hit_ratio=2 / 3))
+
+    def test_page_is_rendered_again_after_content_change(self):
+        import opcms
+        from models import Site
+        client = Client()
+        client.get('/')
+        hits = opcms.page_cache.get_stats()['hits']
+        self.assertEqual(client.get('/').status_code, 200)
+        self.assertEqual(opcms.page_cache.get_stats()['hits'], hits + 1)
+
+        site = Site.get(Site.id == 1)
+        site.site_title = 'Site Alterado Pelo Teste'
+        site.save()
+        self.assertIn('Site Alterado Pelo Teste', client.get('/').text)
+
+    def test_pages_have_own_csrf_token(self):
+        client = Client()
+        first_page = client.get('/').text
+        second_page = client.get('/').text
+        self.assertNotIn('__opcms_csrf__', first_page)
+        self.assertNotEqual(first_page, second_page)
+
+    def test_stats_require_login(self):
+        client = Client()
+        self.assertFalse(client.get('/cache/stats/').json()['status'])
+        client.login()
+        client.get('/')
+        stats = client.get('/cache/stats/').json()
+        self.assertTrue(stats['status'])
+        self.assertGreaterEqual(stats['size'], 1)
+        self.assertIn('hit_ratio', stats)
@@ -0,0 +1,247 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+from io import BytesIO
+import os
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+from tests.support import Client, QueryLog, create_picture, create_portfolio, make_jpeg
+
+
+__author__ = 'João Neto'
+
+
+class PictureBatchTest(unittest.TestCase):
+    """
+    Many pictures added in one upload
+    """
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login()
+        self.portfolio = create_portfolio()
+
+    def add_batch(self, file_names, contents=None):
+        csrf = self.client.get_csrf('/pictures/admin/1/1/%d/' % self.portfolio.get_id())
+        data = dict(site='1', user='1', portfolio=str(self.portfolio.get_id()), csrf=csrf)
+        contents = contents or [make_jpeg() for file_name in file_names]
+        files = [('uploads', file_name, content) for file_name, content in zip(file_names, contents)]
+        return self.client.post('/picture/add/batch/', data, files).json()
+
+    def test_title_without_directory_and_extension(self):
+        from models import Picture
+        response = self.add_batch(['/home/joao/Fotos/Praia  São Paulo.jpg', 'C:\\Fotos\\Pôr do sol.JPG'])
+        self.assertTrue(response['status'])
+        titles = [Picture.get(Picture.id == file_data['picture_id']).title for file_data in response['files']]
+        self.assertEqual(titles, ['Praia São Paulo', 'Pôr do sol'])
+        self.assertEqual(response['files'][0]['filename'], 'Praia-Sao-Paulo.jpg')
+        for file_data in response['files']:
+            self.assertEqual(self.client.wait_job(file_data)['job_status'], 'done')
+
+    def test_only_valid_images_are_added(self):
+        from models import Picture, Portfolio
+        response = self.add_batch(['valida.jpg', 'pequena.jpg', 'texto.jpg'],
+                                  [make_jpeg(), make_jpeg((320, 240)), b'Texto sem imagem'])
+        self.assertTrue(response['status'])
+        valid, small, text = response['files']
+        self.assertEqual((valid['filename'], valid['status'], valid['info']),
+                         ('valida.jpg', True, 'Adicionada com sucesso'))
+        self.assertEqual((small['filename'], small['status']), ('pequena.jpg', False))
+        self.assertIn('Imagem deve ter largura', small['info'])
+        self.assertEqual((text['filename'], text['status'], text['info']),
+                         ('texto.jpg', False, 'Não foi possivel criar imagem'))
+        self.assertNotIn('picture_id', small)
+        self.assertNotIn('picture_id', text)
+        pictures = Picture.select().where(Picture.portfolio == self.portfolio)
+        self.assertEqual([picture.get_id() for picture in pictures], [valid['picture_id']])
+
+        # Picture is counted when its images are made
+        self.assertEqual(self.client.wait_job(valid)['job_status'], 'done')
+        self.assertEqual(Portfolio.get(Portfolio.id == self.portfolio.get_id()).picture_count, 1)
+
+
+class UploadSizeTest(unittest.TestCase):
+    """
+    Uploads refused before the body is read
+    """
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login()
+        self.portfolio = create_portfolio()
+
+    def test_chunked_upload_is_refused(self):
+        from models import Picture
+        pictures = Picture.select().count()
+        response = self.client.add_picture(self.portfolio, headers={'Content-Length': None,
+                                                                    'Transfer-Encoding': 'chunked'}).json()
+        self.assertFalse(response['status'])
+        self.assertIn('sem tamanho', response['info'])
+        self.assertEqual(Picture.select().count(), pictures)
+
+    def test_large_upload_is_refused(self):
+        from settings import UPLOAD_MAX_SIZE
+        response = self.client.add_picture(self.portfolio, headers={'Content-Length': str(UPLOAD_MAX_SIZE + 1)})
+        self.assertFalse(response.json()['status'])
+        self.assertIn('muito grande', response.json()['info'])
+
+    def test_image_with_too_many_pixels_is_refused(self):
+        from models import Picture
+        pictures = Picture.select().count()
+        with mock.patch('utils.IMAGE_MAX_PIXELS', 1000000):
+            response = self.client.add_picture(self.portfolio, make_jpeg((1600, 1200))).json()
+        self.assertFalse(response['status'])
+        self.assertIn('megapixels', response['info'])
+        self.assertEqual(Picture.select().count(), pictures)
+
+    def test_image_not_in_jpeg_format_is_refused(self):
+        from models import Picture
+        pictures = Picture.select().count()
+        png = BytesIO()
+        Image.new('RGB', (1600, 1200)).save(png, 'PNG')
+        response = self.client.add_picture(self.portfolio, png.getvalue()).json()
+        self.assertFalse(response['status'])
+        self.assertEqual(response['info'], 'Tipo de arquivo não suportado')
+        self.assertEqual(Picture.select().count(), pictures)
+
+    def test_large_image_is_not_decoded(self):
+        from utils import save_image_renditions
+        im = Image.open(BytesIO(make_jpeg((1600, 1200))))
+        with mock.patch('utils.IMAGE_MAX_PIXELS', 1000000):
+            with self.assertRaises(IOError):
+                save_image_renditions(im, [('never.jpg', (1440, 1080))])
+        self.assertIsNone(im.im)
+
+
+class PictureCountTest(unittest.TestCase):
+    """
+    Ready pictures counted in picture_count of portfolios
+    """
+
+    def setUp(self):
+        from settings import IMAGE_PATH
+        self.portfolio = create_portfolio()
+        self.img_path = self.portfolio.site.get_image_path(IMAGE_PATH)
+
+    def get_picture_count(self):
+        from models import Portfolio
+        return Portfolio.get(Portfolio.id == self.portfolio.get_id()).picture_count
+
+    def test_picture_is_counted_when_ready(self):
+        client = Client()
+        client.login()
+        response = client.add_picture(self.portfolio).json()
+        self.assertEqual(client.wait_job(response)['job_status'], 'done')
+        self.assertEqual(self.get_picture_count(), 1)
+
+        csrf = client.get_csrf('/pictures/admin/1/1/%d/' % self.portfolio.get_id())
+        data = dict(site='1', user='1', portfolio=str(self.portfolio.get_id()),
+                    picture=str(response['picture_id']), csrf=csrf)
+        self.assertTrue(client.post('/picture/delete/', data).json()['status'])
+        self.assertEqual(self.get_picture_count(), 0)
+
+    def test_picture_is_counted_once(self):
+        from models import Picture
+        picture = create_picture(self.portfolio)
+        picture.save_ready()
+        Picture.get(Picture.id == picture.get_id()).save_ready()
+        self.assertEqual(self.get_picture_count(), 1)
+
+        # Requests deleting the same picture
+        Picture.get(Picture.id == picture.get_id()).delete_all(self.img_path)
+        picture.delete_all(self.img_path)
+        self.assertEqual(self.get_picture_count(), 0)
+
+    def test_picture_made_ready_after_load_is_uncounted(self):
+        from models import Picture
+        picture = create_picture(self.portfolio)
+        Picture.get(Picture.id == picture.get_id()).save_ready()
+        picture.delete_all(self.img_path)
+        self.assertEqual(self.get_picture_count(), 0)
+
+    def test_images_are_removed_after_commit(self):
+        from models import Picture, db
+        picture = create_picture(self.portfolio)
+        image_file = os.path.join(self.img_path, picture.original_image)
+        open(image_file, 'wb').close()
+        with self.assertRaises(ValueError):
+            with db.atomic():
+                picture.delete_all(self.img_path)
+                self.assertTrue(os.path.exists(image_file))
+                raise ValueError('rollback')
+        self.assertTrue(os.path.exists(image_file))
+        self.assertTrue(Picture.select().where(Picture.id == picture.get_id()).exists())
+        picture.delete_all(self.img_path)
+        self.assertFalse(os.path.exists(image_file))
+
+    def test_picture_not_ready_is_not_counted(self):
+        create_picture(self.portfolio).delete_all(self.img_path)
+        self.assertEqual(self.get_picture_count(), 0)
+
+    def test_wrong_counts_are_repaired(self):
+        from models import Portfolio
+        # Picture without image files, not left ready for other tests
+        picture = create_picture(self.portfolio, ready=True)
+        self.addCleanup(picture.delete_instance)
+        Portfolio.update(picture_count=5).where(Portfolio.id == self.portfolio.get_id()).execute()
+        self.assertGreaterEqual(Portfolio.repair_picture_counts(self.portfolio.site.get_id()), 1)
+        self.assertEqual(self.get_picture_count(), 1)
+        self.assertEqual(Portfolio.repair_picture_counts(self.portfolio.site.get_id()), 0)
+
+
+class PictureReorderTest(unittest.TestCase):
+    """
+    Pictures shown in the order of their positions
+    """
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login()
+        self.portfolio = create_portfolio()
+        self.picture_ids = [create_picture(self.portfolio).get_id() for index in range(4)]
+
+    def get_picture_ids(self):
+        return [picture.get_id() for picture in self.portfolio.get_ordered_pictures()]
+
+    def reorder(self, picture_ids):
+        csrf = self.client.get_csrf('/pictures/admin/1/1/%d/' % self.portfolio.get_id())
+        data = dict(site='1', user='1', portfolio=str(self.portfolio.get_id()),
+                    pictures=','.join(str(picture_id) for picture_id in picture_ids), csrf=csrf)
+        return self.client.post('/picture/reorder/', data).json()
+
+    def test_new_pictures_are_last(self):
+        self.assertEqual(self.get_picture_ids(), self.picture_ids)
+
+    def test_pictures_are_reordered(self):
+        picture_ids = list(reversed(self.picture_ids))
+        self.assertTrue(self.reorder(picture_ids)['status'])
+        self.assertEqual(self.get_picture_ids(), picture_ids)
+
+    def test_outdated_order_is_refused(self):
+        from models import Picture
+        # Order made before a picture was added
+        create_picture(self.portfolio)
+        picture_ids = self.get_picture_ids()
+        self.assertFalse(self.reorder(list(reversed(self.picture_ids)))['status'])
+        self.assertFalse(self.reorder(self.picture_ids[:1] * 5)['status'])
+        self.assertEqual(self.get_picture_ids(), picture_ids)
+        self.assertFalse(Picture.set_positions(self.portfolio.pictures, list(reversed(self.picture_ids))))
+
+    def test_invalid_order_is_refused(self):
+        csrf = self.client.get_csrf('/pictures/admin/1/1/%d/' % self.portfolio.get_id())
+        data = dict(site='1', user='1', portfolio=str(self.portfolio.get_id()), pictures='1,a', csrf=csrf)
+        self.assertFalse(self.client.post('/picture/reorder/', data).json()['status'])
+        self.assertEqual(self.get_picture_ids(), self.picture_ids)
+
+    def test_only_changed_positions_are_updated(self):
+        picture_ids = self.picture_ids[1:2] + self.picture_ids[:1] + self.picture_ids[2:]
+        with QueryLog() as query_log:
+            self.reorder(picture_ids)
+        updates = [query for query in query_log.queries if query.startswith('UPDATE "picture"')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(self.get_picture_ids(), picture_ids)
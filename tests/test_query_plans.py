@@ -0,0 +1,53 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+import unittest
+
+from tests.support import create_picture, create_portfolio, get_main_site
+
+
+__author__ = 'João Neto'
+
+
+class QueryPlanTest(unittest.TestCase):
+    """
+    Listing queries of portfolios and pictures use indexes in position order
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.site = get_main_site()
+        cls.portfolio = create_portfolio()
+        for index in range(3):
+            create_picture(cls.portfolio)
+
+    def get_plan(self, query):
+        from database import db
+        sql, params = query.sql()
+        return [row[-1] for row in db.execute_sql('EXPLAIN QUERY PLAN %s' % sql, params).fetchall()]
+
+    def assertUsesIndex(self, query, index_name):
+        plan = self.get_plan(query)
+        self.assertTrue(any(('INDEX %s' % index_name) in detail for detail in plan), plan)
+        for detail in plan:
+            self.assertFalse(detail.startswith('SCAN') and 'USING' not in detail, plan)
+            self.assertNotIn('TEMP B-TREE', detail)
+
+    def test_portfolios_of_site(self):
+        from models import Portfolio
+        query = self.site.get_ordered_portfolios().where(Portfolio.ready == True)
+        self.assertUsesIndex(query, 'portfolio_site_id_position_id')
+
+    def test_pictures_of_site(self):
+        from models import Picture
+        query = Picture.select().where(Picture.site == self.site, Picture.ready == True)
+        self.assertUsesIndex(query.order_by(Picture.position, Picture.id), 'picture_site_id_position_id')
+
+    def test_pictures_of_portfolio(self):
+        self.assertUsesIndex(self.portfolio.get_ordered_pictures(), 'picture_portfolio_id_position_id')
+
+    def test_last_picture_of_site(self):
+        from models import Picture
+        self.assertUsesIndex(self.site.pictures.order_by(Picture.id.desc()).limit(1), 'picture_site_id')
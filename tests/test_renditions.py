@@ -0,0 +1,96 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+import os
+import unittest
+
+from PIL import Image
+
+from tests.support import Client, create_portfolio, get_main_site
+
+
+__author__ = 'João Neto'
+
+
+class PortfolioImagesTestCase(unittest.TestCase):
+    """
+    Test case with the images of a portfolio uploaded once
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        from models import Portfolio
+        from settings import IMAGE_PATH
+        client = Client()
+        client.login()
+        response = client.add_portfolio().json()
+        client.wait_job(response)
+        cls.portfolio = Portfolio.get(Portfolio.id == response['portfolio_id'])
+        cls.img_path = get_main_site().get_image_path(IMAGE_PATH)
+
+
+class TemplateRenditionsTest(PortfolioImagesTestCase):
+    """
+    Renditions declared by templates made with the portfolio images
+    """
+
+    def test_renditions_are_made_on_upload(self):
+        from renditions import get_rendition_name, get_templates_renditions
+        for template_name, renditions in get_templates_renditions().items():
+            for rendition_name, rendition in renditions.items():
+                rendition_file = os.path.join(self.img_path, get_rendition_name(self.portfolio.original_image,
+                                                                                template_name, rendition_name))
+                with open(rendition_file, 'rb') as f:
+                    rendition_size = Image.open(f).size
+                if rendition['crop']:
+                    self.assertEqual(rendition_size, tuple(rendition['size']), template_name)
+                else:
+                    self.assertLessEqual(rendition_size[0], rendition['size'][0], template_name)
+                    self.assertLessEqual(rendition_size[1], rendition['size'][1], template_name)
+
+    def test_rendition_of_template(self):
+        from renditions import get_rendition_image, get_templates_renditions
+        for template_name, renditions in get_templates_renditions().items():
+            rendition_file, rendition_size = get_rendition_image(self.img_path, template_name, self.portfolio, 'tile')
+            self.assertIn('_%s_tile' % template_name, rendition_file)
+            if renditions['tile']['crop']:
+                self.assertEqual(rendition_size, tuple(renditions['tile']['size']))
+
+    def test_images_without_renditions(self):
+        from renditions import get_rendition_image, get_templates_renditions
+        # Images uploaded before templates declared their renditions
+        portfolio = create_portfolio()
+        for template_name in get_templates_renditions():
+            rendition_file, rendition_size = get_rendition_image(self.img_path, template_name, portfolio, 'tile')
+            self.assertIn(rendition_file, (portfolio.normalized_image, portfolio.original_image))
+
+
+class ImageMarkupTest(PortfolioImagesTestCase):
+    """
+    Progressive JPEG images with WebP copies and responsive markup
+    """
+
+    def test_images_are_progressive_with_webp_copy(self):
+        from utils import get_webp_name, has_webp
+        for image_name in (self.portfolio.original_image, self.portfolio.normalized_image):
+            with open(os.path.join(self.img_path, image_name), 'rb') as f:
+                self.assertTrue(Image.open(f).info.get('progressive'))
+            if has_webp():
+                self.assertTrue(os.path.exists(os.path.join(self.img_path, get_webp_name(image_name))))
+
+    def test_picture_markup(self):
+        from renditions import get_picture_markup
+        from utils import has_webp
+        markup = get_picture_markup(self.img_path, '/img/', 'agency', self.portfolio, 'tile', class_='img-responsive')
+        self.assertIn('class="img-responsive"', markup)
+        self.assertIn('height="520" width="720"', markup)
+        if has_webp():
+            self.assertRegex(markup, r'^<picture><source type="image/webp" srcset="/img/[^"]+_agency_tile\.webp">')
+
+    def test_srcset(self):
+        from renditions import get_srcset
+        srcset = get_srcset('/img/', self.portfolio)
+        self.assertEqual(srcset, '/img/%s 240w, /img/%s 480w, /img/%s 1440w' % (
+            self.portfolio.thumbnail_image, self.portfolio.normalized_image, self.portfolio.original_image))
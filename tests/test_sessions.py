@@ -0,0 +1,84 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+import time
+import unittest
+from unittest import mock
+import uuid
+
+from settings import SESSION_TIMEOUT
+from tests.support import Client
+
+
+__author__ = 'João Neto'
+
+
+class NamespaceManagerTests(object):
+    """
+    Tests of session backends storing sessions in a namespace manager
+    """
+    namespace_class = None
+
+    def setUp(self):
+        self.namespace = self.namespace_class(uuid.uuid4().hex)
+
+    def test_session_is_stored(self):
+        self.namespace['session'] = dict(logged_in=True)
+        self.assertIn('session', self.namespace)
+        self.assertEqual(self.namespace['session'], dict(logged_in=True))
+        self.assertEqual(list(self.namespace.keys()), ['session'])
+        del self.namespace['session']
+        self.assertNotIn('session', self.namespace)
+
+    def test_expired_session_is_swept(self):
+        self.namespace['session'] = dict(logged_in=True)
+        with mock.patch('time.time', return_value=time.time() + SESSION_TIMEOUT + 60):
+            self.assertNotIn('session', self.namespace)
+            with self.assertRaises(KeyError):
+                self.namespace['session']
+            self.assertGreaterEqual(self.namespace_class.sweep(), 1)
+        self.assertEqual(list(self.namespace.keys()), [])
+
+
+class SqliteSessionTest(NamespaceManagerTests, unittest.TestCase):
+    """
+    Sessions in SQLite database shared by all processes
+    """
+
+    @property
+    def namespace_class(self):
+        from sessions import SqliteNamespaceManager
+        return SqliteNamespaceManager
+
+
+class MemorySessionTest(NamespaceManagerTests, unittest.TestCase):
+    """
+    Sessions in memory of the process
+    """
+
+    @property
+    def namespace_class(self):
+        from sessions import ExpiringMemoryNamespaceManager
+        return ExpiringMemoryNamespaceManager
+
+
+class SessionBackendTest(unittest.TestCase):
+    """
+    Session backends selected by SESSION_BACKEND
+    """
+
+    def test_backend_options(self):
+        from sessions import SESSION_BACKENDS, get_session_opts
+        for backend in SESSION_BACKENDS:
+            opts = get_session_opts(backend)
+            self.assertEqual(opts['session.timeout'], SESSION_TIMEOUT)
+            self.assertIn('session.type', opts)
+        self.assertTrue(get_session_opts('cookie')['session.validate_key'])
+
+    def test_login_is_kept_in_session(self):
+        client = Client()
+        self.assertIn('/login/', client.get('/portfolios/admin/').headers['Location'])
+        client.login()
+        self.assertEqual(client.get('/portfolios/admin/').status_code, 200)
@@ -0,0 +1,88 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+from hashlib import md5
+import unittest
+
+from tests.support import Client, QueryLog, get_main_site
+
+
+__author__ = 'João Neto'
+
+
+class SitesCacheTest(unittest.TestCase):
+    """
+    Registered sites kept in process and loaded again after changes of sites
+    """
+
+    def setUp(self):
+        self.site = get_main_site()
+
+    def test_sites_are_loaded_once(self):
+        from decorators import get_site
+        get_site('localhost')
+        with QueryLog() as query_log:
+            site = get_site('localhost')
+            self.assertIs(get_site('localhost'), site)
+        self.assertEqual(query_log.queries, [])
+
+    def test_sites_are_loaded_after_site_change(self):
+        from decorators import get_site
+        site_title = self.site.site_title
+        self.addCleanup(self.restore_title, site_title)
+        self.assertEqual(get_site('localhost').site_title, site_title)
+        self.site.site_title = 'Site Alterado'
+        self.site.save()
+        self.assertEqual(get_site('localhost').site_title, 'Site Alterado')
+
+    def test_request_site_is_a_copy(self):
+        from decorators import copy_site, get_site
+        site = copy_site(get_site('localhost'))
+        site.site_title = 'Site Copiado'
+        site.user.name = 'Usuário Copiado'
+        self.assertNotEqual(get_site('localhost').site_title, 'Site Copiado')
+        self.assertNotEqual(get_site('localhost').user.name, 'Usuário Copiado')
+
+    def restore_title(self, site_title):
+        self.site.site_title = site_title
+        self.site.save()
+
+
+class SiteDomainTest(unittest.TestCase):
+    """
+    Sites resolved by the domain of request host
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        from models import Site, User
+        get_main_site()
+        try:
+            cls.site = Site.get(Site.domain == 'exemplo.com.br')
+        except Site.DoesNotExist:
+            user = User.create(email='exemplo@exemplo.com.br', password=md5(b'exemplo').hexdigest(),
+                               name='Exemplo', active=True)
+            cls.site = Site.create(user=user, site_email='exemplo@exemplo.com.br', site_title='Site Exemplo',
+                                   domain='WWW.Exemplo.com.br', active=True)
+
+    def test_domain_is_normalized(self):
+        self.assertEqual(self.site.domain, 'exemplo.com.br')
+
+    def test_site_of_domain(self):
+        from decorators import get_site
+        for netloc in ('exemplo.com.br', 'EXEMPLO.com.br', 'exemplo.com.br:8080'):
+            self.assertEqual(get_site(netloc).get_id(), self.site.get_id(), netloc)
+        self.assertEqual(get_site('desconhecido.com.br').get_id(), get_main_site().get_id())
+
+    def test_page_of_domain(self):
+        self.assertIn('Site Exemplo', Client(host='www.exemplo.com.br').get('/').text)
+        self.assertNotIn('Site Exemplo', Client(host='desconhecido.com.br').get('/').text)
+
+    def test_invalid_domain_is_refused(self):
+        from models import IntegrityError
+        site = get_main_site()
+        site.domain = 'exemplo com br'
+        with self.assertRaises(IntegrityError):
+            site.save()
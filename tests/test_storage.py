@@ -0,0 +1,58 @@
+"""
+opcms One Page Content Management System
+https://github.com/jfmedeirosneto/opcms
+Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
+"""
+import os
+from unittest import mock
+
+from storage import FlatStorage, ShardedStorage
+from tests.test_images import ImageTestCase
+from utils import remove_images
+
+
+__author__ = 'João Neto'
+
+
+class ShardedStorageTest(ImageTestCase):
+    """
+    Images spread in directories named by hash of image key
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.storage = ShardedStorage(2)
+        patcher = mock.patch('utils.image_storage', self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_images(self, image_key):
+        image_names = [self.storage.get_image_name(image_key, '%s%s.jpg' % (image_key, suffix))
+                       for suffix in ('', '_norm', '_thumb')]
+        self.storage.make_image_dir(self.img_path, image_names[0])
+        for image_name in image_names:
+            open(os.path.join(self.img_path, image_name), 'wb').close()
+        return image_names
+
+    def test_image_names_are_sharded(self):
+        image_names = self.make_images('portfolio1_0e77a2f63bd84507')
+        image_dir = os.path.dirname(image_names[0])
+        self.assertRegex(image_dir, r'^[0-9a-f]{2}/[0-9a-f]{2}$')
+        self.assertEqual(self.storage.get_image_key(image_names[0]), 'portfolio1_0e77a2f63bd84507')
+        self.assertIsNone(self.storage.get_image_file(self.img_path, '../%s' % image_names[0]))
+
+    def test_empty_directories_are_removed(self):
+        image_names = self.make_images('portfolio1_0e77a2f63bd84507')
+        remove_images(self.img_path, image_names)
+        self.assertEqual(os.listdir(self.img_path), [])
+
+    def test_directories_in_use_are_kept(self):
+        image_names = self.make_images('portfolio1_0e77a2f63bd84507')
+        remove_images(self.img_path, image_names[1:])
+        self.assertTrue(os.path.exists(os.path.join(self.img_path, image_names[0])))
+        remove_images(self.img_path, image_names[:1])
+        self.assertEqual(os.listdir(self.img_path), [])
+
+    def test_site_image_path_is_kept(self):
+        FlatStorage().remove_image_dir(self.img_path, 'image.jpg')
+        self.assertTrue(os.path.isdir(self.img_path))
@@ -3,13 +3,17 @@ opcms One Page Content Management System
 https://github.com/jfmedeirosneto/opcms
 Copyright(c) 2016 João Neto <jfmedeirosneto@yahoo.com.br>
 """
+import binascii
+from functools import partial
 import os
 import sys
 import re
+import tempfile
 from importlib import import_module
 import smtplib
-from threading import Thread
-from PIL import Image
+from threading import Thread, get_ident
+from uuid import uuid4
+from PIL import Image, ImageOps
 
 from email.header import make_header
 from email.mime.multipart import MIMEMultipart
@@ -17,6 +21,9 @@ from email.mime.text import MIMEText
 from email.mime.image import MIMEImage
 from email.utils import formatdate, formataddr
 
+from settings import UPLOAD_PATH, IMAGE_MAX_PIXELS, IMAGE_ENCODING, IMAGE_KEEP_METADATA, IMAGE_WEBP, IMAGE_WEBP_ENCODING
+from storage import image_storage
+
 
 __author__ = 'João Neto'
 
@@ -56,6 +63,26 @@ def import_templates(templates_path):
     return templates_dict
 
 
+def get_secret_key(secret_key_file):
+    """
+    Get secret key shared by all processes
+    A random key is created in secret_key_file on first run
+    """
+    if not os.path.exists(secret_key_file):
+        secret_key_dir = os.path.dirname(secret_key_file)
+        if not os.path.exists(secret_key_dir):
+            os.makedirs(secret_key_dir, exist_ok=True)
+        try:
+            fd = os.open(secret_key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(binascii.hexlify(os.urandom(32)))
+        except FileExistsError:
+            # Created by other process
+            pass
+    with open(secret_key_file, 'rb') as f:
+        return f.read().strip()
+
+
 class Regex():
     user = lambda s: re.compile(
         "^[a-z0-9_]{3,32}$"
@@ -69,6 +96,10 @@ class Regex():
         "^(\([1-9]{2}\)[0-9]{4,5}-[0-9]{4}[,]?)+$"
     ).match(s) is not None
 
+    domain = lambda s: re.compile(
+        "^([a-z0-9]([a-z0-9-]*[a-z0-9])?\.)*[a-z0-9]([a-z0-9-]*[a-z0-9])?$"
+    ).match(s) is not None
+
     map_url = lambda s: re.compile(
         "^(http)[s]?://([\da-z])([\da-z\.-]+)\.([a-z]{2,6})(/[a-zA-Z0-9_\.-/?%&=]*)+$"
     ).match(s) is not None
@@ -176,97 +207,316 @@ def send_contact_email(host, name, email, site, subject_message, message):
     send_email(sender, receiver, subject, text, html, attachments)
 
 
-def upload_image(request, original_file, normalized_file, thumbnail_file, orig_size, norm_size, thumb_size):
-    # Upload image info
-    upload = request.files.get('upload')
-    name, ext = os.path.splitext(upload.filename.lower())
-    if ext not in ('.jpg', '.jpeg'):
-        return dict(status=False, info='Tipo de arquivo não suportado')
+def get_image_version():
+    """
+    :return Unique version of image file names, names of concurrent uploads never collide
+    and the content of an image url never changes
+    """
+    return uuid4().hex[:16]
+
+
+def get_versioned_image_key(image_key):
+    """
+    :return image_key with a new version, replacing the version of image_key when it has one
+    """
+    return '%s_%s' % (re.sub(r'_[0-9a-f]{16}$', '', image_key), get_image_version())
+
 
-    # Save original file
+def write_atomic(file_path, write_function):
+    """
+    Write file_path calling write_function with a temporary path renamed to file_path when done,
+    so readers never see a half-written file
+    Temporary files start with a dot in the same directory of file_path
+    """
+    file_dir, base_name = os.path.split(file_path)
+    temp_file = os.path.join(file_dir, '.%s.%d.%d' % (base_name, os.getpid(), get_ident()))
+
+    # Directory may be removed by remove_images when its last image is removed
+    if file_dir and not os.path.exists(file_dir):
+        os.makedirs(file_dir, exist_ok=True)
     try:
-        with upload.file as f:
-            im = Image.open(f)
-
-            # Check the original size
-            im_w, im_h = im.size
-            orig_w, orig_h = orig_size
-            if (im_w < orig_w) and (im_h < orig_h):
-                return dict(status=False, info='Imagem deve ter largura >= %d ou altura >= %d' % (orig_w, orig_h))
-
-            # Save original file with ANTIALIAS
-            im.thumbnail(orig_size, Image.ANTIALIAS)
-            im.save(original_file, "JPEG")
-    except IOError:
-        if os.path.exists(original_file):
-            os.remove(original_file)
-        if os.path.exists(normalized_file):
-            os.remove(normalized_file)
-        if os.path.exists(thumbnail_file):
-            os.remove(thumbnail_file)
-        return dict(status=False, info='Não foi possivel criar imagem')
+        write_function(temp_file)
+        os.replace(temp_file, file_path)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
 
-    # Resize and save normalized image
+def get_webp_name(file_name):
+    """
+    :return File name of WebP copy of image
+    """
+    return os.path.splitext(file_name)[0] + '.webp'
+
+
+def remove_images(img_path, file_names):
+    """
+    Remove image files of img_path with their WebP copies
+    Directories of image storage left empty are also removed
+    """
+    for file_name in file_names:
+        if file_name:
+            for image_name in (file_name, get_webp_name(file_name)):
+                file_path = os.path.join(img_path, image_name)
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+            if img_path:
+                image_storage.remove_image_dir(img_path, file_name)
+
+
+def load_draft(im, size):
+    """
+    Decode image with draft mode for size and load it
+    The image is loaded right after draft, thumbnail() drafting again an unloaded JPEG
+    crashes the process with Pillow 3.3
+    """
+    im.draft(im.mode, size)
+    im.load()
+
+
+# EXIF orientation tag and transpositions that show image upright
+EXIF_ORIENTATION = 274
+ORIENTATION_TRANSPOSE = {
+    2: (Image.FLIP_LEFT_RIGHT,),
+    3: (Image.ROTATE_180,),
+    4: (Image.FLIP_TOP_BOTTOM,),
+    5: (Image.ROTATE_90, Image.FLIP_TOP_BOTTOM),
+    6: (Image.ROTATE_270,),
+    7: (Image.ROTATE_270, Image.FLIP_TOP_BOTTOM),
+    8: (Image.ROTATE_90,),
+}
+
+
+def apply_orientation(im):
+    """
+    :return Image rotated by its EXIF orientation, EXIF is removed on save so
+    the orientation is applied on pixels
+    """
     try:
-        with open(original_file, "rb") as f:
-            im = Image.open(f)
-            im.thumbnail(norm_size, Image.ANTIALIAS)
-            im.save(normalized_file, "JPEG")
-    except IOError:
-        if os.path.exists(original_file):
-            os.remove(original_file)
-        if os.path.exists(normalized_file):
-            os.remove(normalized_file)
-        if os.path.exists(thumbnail_file):
-            os.remove(thumbnail_file)
-        return dict(status=False, info='Não foi possivel criar imagem')
+        exif = im._getexif() or {}
+    except (AttributeError, IndexError, KeyError, SyntaxError, ValueError):
+        exif = {}
+    for method in ORIENTATION_TRANSPOSE.get(exif.get(EXIF_ORIENTATION), ()):
+        im = im.transpose(method)
+    return im
 
-    # Resize and save thumbnail image
+
+def has_webp():
+    """
+    :return True if Pillow saves WebP images, Image.init() loads all plugins so WebP support is known
+    """
+    Image.init()
+    return 'WEBP' in Image.SAVE
+
+
+def save_image(im, image_file, quality=None, webp=IMAGE_WEBP):
+    """
+    Save JPEG image with IMAGE_ENCODING, metadata is removed unless IMAGE_KEEP_METADATA
+    and the ICC color profile is always kept
+    A WebP copy is also saved when webp=True and Pillow supports WebP
+    """
+    options = dict(IMAGE_ENCODING)
+    if quality is not None:
+        options['quality'] = quality
+    if im.info.get('icc_profile'):
+        options['icc_profile'] = im.info['icc_profile']
+    if IMAGE_KEEP_METADATA and im.info.get('exif'):
+        options['exif'] = im.info['exif']
+    write_atomic(image_file, partial(im.save, format="JPEG", **options))
+
+    # WebP copy
+    if webp and has_webp():
+        webp_im = im if im.mode in ('RGB', 'RGBA') else im.convert('RGB')
+        write_atomic(get_webp_name(image_file), partial(webp_im.save, format="WEBP", **IMAGE_WEBP_ENCODING))
+
+
+def check_image_pixels(im):
+    """
+    Raise IOError if image has more than IMAGE_MAX_PIXELS, only the image header is read
+    """
+    im_w, im_h = im.size
+    if im_w * im_h > IMAGE_MAX_PIXELS:
+        raise IOError('Image %dx%d exceeds %d pixels' % (im_w, im_h, IMAGE_MAX_PIXELS))
+
+
+def save_image_renditions(im, renditions, profiles=(), webp=IMAGE_WEBP):
+    """
+    Save renditions of image decoding it only once
+    renditions is a list of (file, size) from the largest to the smallest size, each
+    rendition is resized in memory from the previous one
+    profiles is a list of (file, size, crop, quality) made from the largest rendition
+    JPEG images are decoded with draft mode, downscaled by the decoder when possible, so
+    the full bitmap of large images is never in memory
+    Images above IMAGE_MAX_PIXELS are not decoded
+    :return Image sizes (width, height, bytes) of renditions
+    """
+    check_image_pixels(im)
+    load_draft(im, renditions[0][1])
+    image_sizes = []
+    for index, (rendition_file, rendition_size) in enumerate(renditions):
+        im.thumbnail(rendition_size, Image.ANTIALIAS)
+        if index == 0 and not IMAGE_KEEP_METADATA:
+            im = apply_orientation(im)
+        save_image(im, rendition_file, webp=webp)
+        image_sizes.append((im.size[0], im.size[1], os.path.getsize(rendition_file)))
+        if index == 0:
+            save_image_profiles(im, profiles, webp)
+    return image_sizes
+
+
+def get_image_size(image_file):
+    """
+    :return Image size (width, height, bytes) of image_file, only the image header is read
+    """
+    with open(image_file, "rb") as f:
+        width, height = Image.open(f).size
+    return width, height, os.path.getsize(image_file)
+
+
+def get_fit_size(image_size, size):
+    """
+    :return Size of image_size resized to fit in size keeping the aspect ratio, as made by thumbnail
+    """
+    image_w, image_h = image_size
+    scale = min(1.0, size[0] / image_w, size[1] / image_h)
+    return max(int(round(image_w * scale)), 1), max(int(round(image_h * scale)), 1)
+
+
+def save_image_profiles(im, profiles, webp=IMAGE_WEBP):
+    """
+    Save renditions of image with profiles (file, size, crop, quality)
+    Cropped renditions have the exact size, other renditions fit in size
+    """
+    for profile_file, profile_size, crop, quality in profiles:
+        if crop:
+            profile_im = ImageOps.fit(im, profile_size, Image.ANTIALIAS)
+        else:
+            profile_im = im.copy()
+            profile_im.thumbnail(profile_size, Image.ANTIALIAS)
+        save_image(profile_im, profile_file, quality, webp)
+
+
+def regenerate_image_profiles(image_file, profiles):
+    """
+    Make again profiles (file, size, crop, quality) of image_file, this function runs in processes of a pool
+    The image is decoded with draft mode for the largest profile
+    :return Number of profiles made
+    """
+    with open(image_file, "rb") as f:
+        im = Image.open(f)
+        load_draft(im, (max(profile[1][0] for profile in profiles), max(profile[1][1] for profile in profiles)))
+        save_image_profiles(im, profiles)
+    return len(profiles)
+
+
+def is_profile_current(image_file, image_size, profile_file, size, crop):
+    """
+    :return True if profile_file is newer than image_file and has the size of profile
+    Cropped profiles have the exact size, other profiles fit in size touching one side
+    (or keep the image size when the image is smaller), only the image header is read
+    """
     try:
-        with open(original_file, "rb") as f:
-            im = Image.open(f)
-            im.thumbnail(thumb_size, Image.ANTIALIAS)
-            im.save(thumbnail_file, "JPEG")
-    except IOError:
-        if os.path.exists(original_file):
-            os.remove(original_file)
-        if os.path.exists(normalized_file):
-            os.remove(normalized_file)
-        if os.path.exists(thumbnail_file):
-            os.remove(thumbnail_file)
-        return dict(status=False, info='Não foi possivel criar imagem')
+        if os.path.getmtime(profile_file) < os.path.getmtime(image_file):
+            return False
+        if IMAGE_WEBP and has_webp() and not os.path.exists(get_webp_name(profile_file)):
+            return False
+        with open(profile_file, "rb") as f:
+            profile_w, profile_h = Image.open(f).size
+    except (IOError, OSError):
+        return False
+    if crop:
+        return (profile_w, profile_h) == tuple(size)
+    if (profile_w > size[0]) or (profile_h > size[1]):
+        return False
+    if (image_size[0] <= size[0]) and (image_size[1] <= size[1]):
+        return (profile_w, profile_h) == tuple(image_size)
+    return (profile_w == size[0]) or (profile_h == size[1])
+
+
+def save_image_rendition(image_file, size, rendition_file):
+    """
+    Save rendition of image_file with size, without WebP copy
+    """
+    with open(image_file, "rb") as f:
+        save_image_renditions(Image.open(f), [(rendition_file, size)], webp=False)
 
-    # return OK
-    return dict(status=True, info='Imagem atualizada com sucesso')
+
+def process_image(upload_file, renditions, profiles=()):
+    """
+    Make renditions and profiles of upload_file, this function runs in processes of image pool
+    The upload file is removed when done and the renditions are removed on error
+    :return Image sizes (width, height, bytes) of renditions
+    """
+    try:
+        with open(upload_file, "rb") as f:
+            return save_image_renditions(Image.open(f), renditions, profiles)
+    except IOError:
+        remove_images('', [rendition[0] for rendition in list(renditions) + list(profiles)])
+        raise
+    finally:
+        if os.path.exists(upload_file):
+            os.remove(upload_file)
 
 
 def upload_new_image(request, img_prefix, start_index, img_path, img_url, orig_size, norm_size, thumb_size):
     # Upload image info
     upload = request.files.get('upload')
+    return upload_new_image_file(upload, img_prefix, start_index, img_path, img_url, orig_size, norm_size, thumb_size)
+
+
+def get_upload_title(upload, default='Imagem'):
+    """
+    :return Title of upload from the name of the file on the client, without directory and extension
+    """
+    file_name = re.split(r'[\\/]', upload.raw_filename or '')[-1]
+    title = ' '.join(os.path.splitext(file_name)[0].split())
+    return title if title and title.isprintable() else default
+
+
+def upload_new_image_file(upload, img_prefix, start_index, img_path, img_url, orig_size, norm_size, thumb_size):
+    """
+    Check and save upload with new file names for images
+    The renditions are made later by process_image
+    """
     name, ext = os.path.splitext(upload.filename.lower())
     if ext not in ('.jpg', '.jpeg'):
         return dict(status=False, info='Tipo de arquivo não suportado')
 
-    # Create new file names for images
-    index = start_index
-    original_file = os.path.join(img_path, "%s%d.jpg" % (img_prefix, index))
-    normalized_file = os.path.join(img_path, "%s%d_norm.jpg" % (img_prefix, index))
-    thumbnail_file = os.path.join(img_path, "%s%d_thumb.jpg" % (img_prefix, index))
-    while os.path.exists(original_file) or os.path.exists(thumbnail_file) or os.path.exists(normalized_file):
-        index += 1
-        original_file = os.path.join(img_path, "%s%d.jpg" % (img_prefix, index))
-        normalized_file = os.path.join(img_path, "%s%d_norm.jpg" % (img_prefix, index))
-        thumbnail_file = os.path.join(img_path, "%s%d_thumb.jpg" % (img_prefix, index))
-
-    # Upload images
-    upload_response = upload_image(request, original_file, normalized_file, thumbnail_file, orig_size, norm_size, thumb_size)
-    if not upload_response['status']:
-        return upload_response
+    # Check the format and the original size, only the image header is read
+    try:
+        im = Image.open(upload.file)
+        im_w, im_h = im.size
+    except IOError:
+        return dict(status=False, info='Não foi possivel criar imagem')
+    if im.format != 'JPEG':
+        return dict(status=False, info='Tipo de arquivo não suportado')
+    if im_w * im_h > IMAGE_MAX_PIXELS:
+        return dict(status=False, info='Imagem deve ter no máximo %d megapixels' % (IMAGE_MAX_PIXELS // 1000000))
+    orig_w, orig_h = orig_size
+    if (im_w < orig_w) and (im_h < orig_h):
+        return dict(status=False, info='Imagem deve ter largura >= %d ou altura >= %d' % (orig_w, orig_h))
+    upload.file.seek(0)
+
+    # Create new file names for images in the directory of image storage
+    # Names are versioned by a unique id, so no file is probed and the content of an image url never changes
+    image_key = "%s%d_%s" % (img_prefix, start_index, get_image_version())
+    original_filename = image_storage.get_image_name(image_key, "%s.jpg" % image_key)
+    normalized_filename = image_storage.get_image_name(image_key, "%s_norm.jpg" % image_key)
+    thumbnail_filename = image_storage.get_image_name(image_key, "%s_thumb.jpg" % image_key)
+    image_storage.make_image_dir(img_path, original_filename)
+    original_file = os.path.join(img_path, original_filename)
+    normalized_file = os.path.join(img_path, normalized_filename)
+    thumbnail_file = os.path.join(img_path, thumbnail_filename)
+
+    # Save upload, the renditions are made later by process_image
+    if not os.path.exists(UPLOAD_PATH):
+        os.makedirs(UPLOAD_PATH, exist_ok=True)
+    fd, upload_file = tempfile.mkstemp(suffix=ext, dir=UPLOAD_PATH)
+    with os.fdopen(fd, 'wb') as f:
+        upload.save(f)
+    renditions = [(original_file, orig_size), (normalized_file, norm_size), (thumbnail_file, thumb_size)]
 
     # Response data
-    original_filename = os.path.split(original_file)[1]
-    normalized_filename = os.path.split(normalized_file)[1]
-    thumbnail_filename = os.path.split(thumbnail_file)[1]
     original_url = img_url + original_filename
     normalized_url = img_url + normalized_filename
     thumbnail_url = img_url + thumbnail_filename
@@ -274,6 +524,8 @@ def upload_new_image(request, img_prefix, start_index, img_path, img_url, orig_s
     # return OK
     return dict(status=True,
                 info='Imagem salva com sucesso',
+                upload_file=upload_file,
+                renditions=renditions,
                 original_filename=original_filename,
                 normalized_filename=normalized_filename,
                 thumbnail_filename=thumbnail_filename,